@@ -0,0 +1,153 @@
+"""
+Симулятор пиковой нагрузки на назначение курьеров.
+
+Сравнивает последовательные assign() (как при вызовах по одному) и пакетный
+assign_batch() на одинаковых всплесках заказов: пропускную способность,
+среднее расстояние до точки забора и число неназначенных заказов.
+Режим --scheduler дополнительно прогоняет AssignmentScheduler целиком
+(окно накопления, пакетная проверка и коммит-заглушки).
+
+    python bench/assignment_simulator.py --couriers 5000 --bursts 20 --burst-size 400
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'delivery-service'))
+
+from couriers import CourierRegistry, distance_km
+from scheduler import AssignmentScheduler, NoCourierAvailable
+
+LAT_MIN, LAT_MAX = 55.57, 55.91
+LON_MIN, LON_MAX = 37.37, 37.84
+
+
+def build_registry(couriers: int, seed: int) -> CourierRegistry:
+    rng = random.Random(seed)
+    registry = CourierRegistry(stale_after=float("inf"))
+    for courier_id in range(couriers):
+        registry.ping(courier_id, rng.uniform(LAT_MIN, LAT_MAX), rng.uniform(LON_MIN, LON_MAX), capacity=2)
+    return registry
+
+
+def generate_bursts(bursts: int, burst_size: int, seed: int):
+    rng = random.Random(seed + 1)
+    # Заказы кучкуются вокруг нескольких «ресторанных» кластеров, как в обед
+    hotspots = [(rng.uniform(LAT_MIN, LAT_MAX), rng.uniform(LON_MIN, LON_MAX)) for _ in range(12)]
+    result = []
+    for _ in range(bursts):
+        burst = []
+        for _ in range(burst_size):
+            lat, lon = rng.choice(hotspots)
+            burst.append((lat + rng.gauss(0, 0.01), lon + rng.gauss(0, 0.015)))
+        result.append(burst)
+    return result
+
+
+def simulate(mode: str, couriers: int, bursts, seed: int) -> dict:
+    registry = build_registry(couriers, seed)
+    distances, unassigned, elapsed = [], 0, 0.0
+    for burst in bursts:
+        start = time.perf_counter()
+        if mode == "batch":
+            chosen = registry.assign_batch(burst)
+        else:
+            chosen = [registry.assign(lat, lon) for lat, lon in burst]
+        elapsed += time.perf_counter() - start
+        for (lat, lon), courier in zip(burst, chosen):
+            if courier is None:
+                unassigned += 1
+                continue
+            distances.append(distance_km(lat, lon, courier.lat, courier.lon))
+        # Между всплесками курьеры успевают развезти заказы
+        for (_, courier) in zip(burst, chosen):
+            if courier is not None:
+                registry.release(courier.id)
+    total = sum(len(burst) for burst in bursts)
+    return {
+        "mode": mode,
+        "orders": total,
+        "assignments_per_sec": round(total / elapsed) if elapsed else None,
+        "mean_pickup_km": round(sum(distances) / len(distances), 3) if distances else None,
+        "total_pickup_km": round(sum(distances), 1),
+        "unassigned": unassigned,
+    }
+
+
+def simulate_scheduler(couriers: int, bursts, seed: int, window: float, clients: int) -> dict:
+    registry = build_registry(couriers, seed)
+    calls = {"verify": 0, "commit": 0}
+
+    def verify(ids):
+        calls["verify"] += 1
+        return set(ids)
+
+    def commit(assignments):
+        calls["commit"] += 1
+        for _, courier_id in assignments:
+            registry.release(courier_id)
+        return list(range(len(assignments)))
+
+    logger = logging.getLogger("assignment-simulator")
+    scheduler = AssignmentScheduler(registry, verify, commit, logger, window=window)
+    orders = [point for burst in bursts for point in burst]
+    latencies = []
+    unassigned = []
+    lock = threading.Lock()
+
+    def client(offset: int):
+        for index in range(offset, len(orders), clients):
+            lat, lon = orders[index]
+            start = time.perf_counter()
+            try:
+                scheduler.submit(index, lat, lon).result()
+            except NoCourierAvailable:
+                unassigned.append(index)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "mode": "scheduler",
+        "orders": len(orders),
+        "assignments_per_sec": round(len(orders) / elapsed),
+        "batches": calls["commit"],
+        "verify_calls": calls["verify"],
+        "unassigned": len(unassigned),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--couriers", type=int, default=5000)
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--burst-size", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--scheduler", action="store_true", help="прогнать также AssignmentScheduler")
+    parser.add_argument("--window-ms", type=float, default=50)
+    parser.add_argument("--clients", type=int, default=200)
+    args = parser.parse_args()
+
+    bursts = generate_bursts(args.bursts, args.burst_size, args.seed)
+    results = [simulate(mode, args.couriers, bursts, args.seed) for mode in ("sequential", "batch")]
+    if args.scheduler:
+        results.append(simulate_scheduler(args.couriers, bursts, args.seed, args.window_ms / 1000, args.clients))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Время импорта и холодного старта каждого сервиса.
+
+Для каждого сервиса несколько раз запускается отдельный процесс и меряется:
+  import_ms — импорт app.py в чистом интерпретаторе (включая зависимости);
+  live_ms   — от запуска процесса до первого 200 на /health/live;
+  ready_ms  — до первого 200 на /health/ready.
+Старт идёт через bench/harness/serve.py (брокер в памяти, SQLite во
+временном каталоге), в двух режимах схемы: startup (create_all в lifespan)
+и external (схема применена заранее, как отдельный шаг деплоя).
+
+    python bench/cold_start.py --runs 5
+    python bench/cold_start.py --services order,catalog --schema-modes external
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness.services import SERVICES, free_port
+
+IMPORT_PROBE = """
+import contextlib, os, sys, time
+sys.path[:0] = [{bench!r}, {root!r}, {service!r}]
+from harness import fake_pika
+fake_pika.install()
+start = time.perf_counter()
+with contextlib.redirect_stdout(open(os.devnull, "w")):
+    import app
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def environment(workdir: str, service: str, schema_mode: str) -> dict:
+    return dict(os.environ, DATABASE_URL=f"sqlite:///{workdir}/{service}.db", RABBITMQ_HOST="fake-rabbitmq",
+                DB_SCHEMA_MODE=schema_mode, AUTH_KEYS="bench:bench-signing-key")
+
+
+def measure_import(service: str, env: dict) -> float:
+    service_dir = os.path.join(ROOT, SERVICES[service])
+    code = IMPORT_PROBE.format(bench=os.path.dirname(os.path.abspath(__file__)), root=ROOT, service=service_dir)
+    out = subprocess.run([sys.executable, "-c", code], env=env, cwd=service_dir, capture_output=True, text=True,
+                         check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def measure_start(service: str, env: dict, timeout: float = 60.0) -> tuple:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "bench", "harness", "serve.py"), service, str(port)],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                if live is None and requests.get(f"{url}/health/live", timeout=1).status_code == 200:
+                    live = (time.perf_counter() - started) * 1000
+                if live is not None and requests.get(f"{url}/health/ready", timeout=1).status_code == 200:
+                    ready = (time.perf_counter() - started) * 1000
+                    break
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait()
+    if ready is None:
+        raise RuntimeError(f"{service} did not become ready in {timeout}s")
+    return live, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default=",".join(SERVICES))
+    parser.add_argument("--schema-modes", default="startup,external")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for service in args.services.split(","):
+        for mode in args.schema_modes.split(","):
+            samples = {"import_ms": [], "live_ms": [], "ready_ms": []}
+            for _ in range(args.runs):
+                with tempfile.TemporaryDirectory(prefix="bench-cold-") as workdir:
+                    env = environment(workdir, service, mode)
+                    if mode == "external":
+                        subprocess.run([sys.executable, "-m", "common.lifecycle", "init-schema", SERVICES[service]],
+                                       env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+                    samples["import_ms"].append(measure_import(service, env))
+                    live, ready = measure_start(service, env)
+                    samples["live_ms"].append(live)
+                    samples["ready_ms"].append(ready)
+            results[f"{service}/{mode}"] = {name: round(statistics.median(values), 1) for name, values in samples.items()}
+            print(f"{service:<10} {mode:<9} " + "  ".join(f"{k} {v:>8.1f}" for k, v in results[f"{service}/{mode}"].items()),
+                  file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
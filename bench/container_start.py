@@ -0,0 +1,151 @@
+"""
+Размер образа и холодный старт контейнеров сервисов.
+
+Для каждого сервиса собирается образ (docker build из корня репозитория) и
+меряется:
+  image_mb  — размер образа;
+  import_ms — `import app` внутри контейнера (байткод из образа, без записи .pyc);
+  live_ms   — от `docker run` до первого 200 на /health/live;
+  ready_ms  — до первого 200 на /health/ready (схема создана, прогрев прошёл).
+Контейнеры запускаются в отдельной сети вместе с временным RabbitMQ; БД —
+SQLite внутри контейнера, чтобы мерить старт сервиса, а не Postgres.
+notification-service не имеет HTTP — для него меряется только импорт.
+
+    python bench/container_start.py --runs 5
+    python bench/container_start.py --services order,catalog --no-build
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SERVICES = ["user", "order", "catalog", "payment", "delivery", "notification"]
+PORTS = {"order": 8001}
+BROKER_IMAGE = "rabbitmq:3-alpine"
+
+IMPORT_PROBE = """
+import contextlib, os, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(open(os.devnull, "w")):
+    import app
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def docker(*args, **kwargs) -> str:
+    return subprocess.run(["docker", *args], check=True, capture_output=True, text=True, **kwargs).stdout.strip()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def image_name(service: str, tag: str) -> str:
+    return f"bench/{service}-service:{tag}"
+
+
+def build(service: str, tag: str):
+    subprocess.run(["docker", "build", "-q", "-t", image_name(service, tag), "-f", f"{service}-service/Dockerfile", "."],
+                   cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+
+def image_size_mb(image: str) -> float:
+    return int(docker("image", "inspect", "--format", "{{.Size}}", image)) / 1e6
+
+
+def environment(service: str) -> list:
+    env = {"DATABASE_URL": f"sqlite:////tmp/{service}.db", "RABBITMQ_HOST": "rabbitmq",
+           "AUTH_KEYS": "bench:bench-signing-key"}
+    return [arg for name, value in env.items() for arg in ("-e", f"{name}={value}")]
+
+
+def measure_import(image: str, service: str) -> float:
+    out = docker("run", "--rm", *environment(service), image, "python", "-c", IMPORT_PROBE)
+    return float(out.splitlines()[-1])
+
+
+def measure_start(image: str, service: str, network: str, timeout: float = 60.0) -> tuple:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    name = f"bench-{service}-{uuid.uuid4().hex[:8]}"
+    started = time.perf_counter()
+    docker("run", "-d", "--name", name, "--network", network, "-p", f"127.0.0.1:{port}:{PORTS.get(service, 8000)}",
+           *environment(service), image)
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                if live is None and requests.get(f"{url}/health/live", timeout=1).status_code == 200:
+                    live = (time.perf_counter() - started) * 1000
+                if live is not None and requests.get(f"{url}/health/ready", timeout=1).status_code == 200:
+                    ready = (time.perf_counter() - started) * 1000
+                    break
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.01)
+    finally:
+        subprocess.run(["docker", "rm", "-f", name], check=False, capture_output=True)
+    if ready is None:
+        raise RuntimeError(f"{service} did not become ready in {timeout}s")
+    return live, ready
+
+
+def start_broker(network: str) -> str:
+    docker("network", "create", network)
+    name = f"{network}-rabbitmq"
+    docker("run", "-d", "--name", name, "--network", network, "--network-alias", "rabbitmq",
+           "-e", "RABBITMQ_DEFAULT_USER=guest", "-e", "RABBITMQ_DEFAULT_PASS=guest123", BROKER_IMAGE)
+    deadline = time.monotonic() + 120
+    while subprocess.run(["docker", "exec", name, "rabbitmq-diagnostics", "-q", "ping"],
+                         capture_output=True).returncode != 0:
+        if time.monotonic() > deadline:
+            raise RuntimeError("RabbitMQ did not start in 120s")
+        time.sleep(1)
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", default=",".join(SERVICES))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--tag", default="bench")
+    parser.add_argument("--no-build", action="store_true", help="использовать уже собранные образы с --tag")
+    args = parser.parse_args()
+
+    network = f"bench-{uuid.uuid4().hex[:8]}"
+    broker = start_broker(network)
+    results = {}
+    try:
+        for service in args.services.split(","):
+            image = image_name(service, args.tag)
+            if not args.no_build:
+                build(service, args.tag)
+            samples = {"import_ms": [], "live_ms": [], "ready_ms": []}
+            for _ in range(args.runs):
+                samples["import_ms"].append(measure_import(image, service))
+                if service != "notification":
+                    live, ready = measure_start(image, service, network)
+                    samples["live_ms"].append(live)
+                    samples["ready_ms"].append(ready)
+            results[service] = {"image_mb": round(image_size_mb(image), 1)}
+            results[service].update({name: round(statistics.median(values), 1)
+                                     for name, values in samples.items() if values})
+            print(f"{service:<13} " + "  ".join(f"{k} {v:>8.1f}" for k, v in results[service].items()), file=sys.stderr)
+    finally:
+        subprocess.run(["docker", "rm", "-f", broker], check=False, capture_output=True)
+        subprocess.run(["docker", "network", "rm", network], check=False, capture_output=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
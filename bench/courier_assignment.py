@@ -0,0 +1,96 @@
+"""
+Бенчмарк движка назначения курьеров.
+
+Заполняет реестр N активными курьерами в пределах города, затем измеряет
+время одного решения assign() и обновления позиции ping().
+
+    python bench/courier_assignment.py --couriers 50000 --assignments 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'delivery-service'))
+
+from couriers import CourierRegistry
+
+# Примерные границы Москвы внутри МКАД
+LAT_MIN, LAT_MAX = 55.57, 55.91
+LON_MIN, LON_MAX = 37.37, 37.84
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summary(samples):
+    return {
+        "count": len(samples),
+        "p50_us": round(percentile(samples, 0.50) * 1e6, 1),
+        "p99_us": round(percentile(samples, 0.99) * 1e6, 1),
+        "max_us": round(max(samples) * 1e6, 1),
+    }
+
+
+def random_point(rng):
+    return rng.uniform(LAT_MIN, LAT_MAX), rng.uniform(LON_MIN, LON_MAX)
+
+
+def run(couriers: int, assignments: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    registry = CourierRegistry()
+    now = time.monotonic()
+    for courier_id in range(couriers):
+        lat, lon = random_point(rng)
+        registry.ping(courier_id, lat, lon, capacity=3, now=now)
+
+    assign_times, ping_times, misses = [], [], 0
+    active = []
+    for _ in range(assignments):
+        lat, lon = random_point(rng)
+        start = time.perf_counter()
+        courier = registry.assign(lat, lon, now=now)
+        assign_times.append(time.perf_counter() - start)
+        if courier is None:
+            misses += 1
+        else:
+            active.append(courier.id)
+        # Держим нагрузку стабильной: часть доставок завершается
+        if len(active) > couriers // 2:
+            registry.release(active.pop(rng.randrange(len(active))))
+
+        courier_id = rng.randrange(couriers)
+        lat, lon = random_point(rng)
+        start = time.perf_counter()
+        registry.ping(courier_id, lat, lon, now=now)
+        ping_times.append(time.perf_counter() - start)
+
+    return {
+        "couriers": couriers,
+        "assign": summary(assign_times),
+        "ping": summary(ping_times),
+        "unassigned": misses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--couriers", type=int, default=50000)
+    parser.add_argument("--assignments", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--budget-ms", type=float, default=1.0, help="допустимый p99 одного назначения")
+    args = parser.parse_args()
+
+    result = run(args.couriers, args.assignments, args.seed)
+    print(json.dumps(result, indent=2))
+    if result["assign"]["p99_us"] > args.budget_ms * 1000:
+        print(f"FAIL: assign p99 exceeds {args.budget_ms} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Нагрузочный стенд: сервисы в одном процессе или под uvicorn, брокер AMQP
+в памяти, заглушки соседних сервисов и сценарии нагрузки.
+"""
@@ -0,0 +1,150 @@
+"""
+Брокер AMQP в памяти вместо pika.
+
+Поддерживает ровно то подмножество BlockingConnection API, которым
+пользуются сервисы и common.messaging: fanout-обменники, именованные и
+эксклюзивные очереди, basic_publish/basic_consume/start_consuming.
+install() подменяет модуль pika в sys.modules; вызывать до импорта сервисов.
+"""
+import itertools
+import queue
+import sys
+import threading
+import types
+from collections import Counter
+from typing import Dict, Set
+
+
+class AMQPConnectionError(Exception):
+    pass
+
+
+class PlainCredentials:
+    def __init__(self, username, password, erase_on_connect=False):
+        self.username = username
+        self.password = password
+
+
+class ConnectionParameters:
+    def __init__(self, host="localhost", credentials=None, **kwargs):
+        self.host = host
+        self.credentials = credentials
+
+
+class BasicProperties:
+    def __init__(self, delivery_mode=None, headers=None, **kwargs):
+        self.delivery_mode = delivery_mode
+        self.headers = headers
+
+
+class _Method:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Broker:
+    def __init__(self):
+        self.queues: Dict[str, "queue.Queue"] = {}
+        self.bindings: Dict[str, Set[str]] = {}
+        self.published: Counter = Counter()
+        self._names = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def declare_queue(self, name: str) -> str:
+        with self._lock:
+            name = name or f"amq.gen-{next(self._names)}"
+            self.queues.setdefault(name, queue.Queue())
+            return name
+
+    def bind(self, exchange: str, queue_name: str):
+        with self._lock:
+            self.bindings.setdefault(exchange, set()).add(queue_name)
+
+    def publish(self, exchange: str, routing_key: str, body, properties):
+        body = body.encode() if isinstance(body, str) else body
+        with self._lock:
+            self.published[exchange or routing_key] += 1
+            targets = self.bindings.get(exchange, ()) if exchange else [routing_key]
+            queues = [self.queues.setdefault(name, queue.Queue()) for name in targets]
+        for q in queues:
+            q.put((exchange, routing_key, body, properties))
+
+
+broker = Broker()
+
+
+class BlockingChannel:
+    def __init__(self):
+        self._consumers = []
+        self._tags = itertools.count(1)
+        self._closed = threading.Event()
+
+    def exchange_declare(self, exchange, exchange_type="fanout", **kwargs):
+        broker.bindings.setdefault(exchange, set())
+
+    def queue_declare(self, queue="", **kwargs):
+        return _Method(method=_Method(queue=broker.declare_queue(queue)))
+
+    def queue_bind(self, exchange, queue, **kwargs):
+        broker.bind(exchange, queue)
+
+    def basic_qos(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        broker.publish(exchange, routing_key, body, properties)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, **kwargs):
+        self._consumers.append((broker.declare_queue(queue), on_message_callback))
+
+    def basic_ack(self, delivery_tag=None, **kwargs):
+        pass
+
+    def start_consuming(self):
+        # Один поток обслуживает все очереди канала, как и BlockingConnection
+        while not self._closed.is_set():
+            idle = True
+            for name, callback in self._consumers:
+                try:
+                    exchange, routing_key, body, properties = broker.queues[name].get(timeout=0.05)
+                except queue.Empty:
+                    continue
+                idle = False
+                method = _Method(exchange=exchange, routing_key=routing_key, delivery_tag=next(self._tags))
+                callback(self, method, properties or BasicProperties(), body)
+            if idle and not self._consumers:
+                self._closed.wait(0.05)
+
+    def close(self):
+        self._closed.set()
+
+
+class BlockingConnection:
+    def __init__(self, parameters=None):
+        self._channel = BlockingChannel()
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self._channel.close()
+
+
+def install():
+    """Регистрирует модули pika, pika.credentials и pika.exceptions."""
+    module = types.ModuleType("pika")
+    credentials = types.ModuleType("pika.credentials")
+    exceptions = types.ModuleType("pika.exceptions")
+    credentials.PlainCredentials = PlainCredentials
+    exceptions.AMQPConnectionError = AMQPConnectionError
+    module.BlockingConnection = BlockingConnection
+    module.ConnectionParameters = ConnectionParameters
+    module.BasicProperties = BasicProperties
+    module.PlainCredentials = PlainCredentials
+    module.credentials = credentials
+    module.exceptions = exceptions
+    sys.modules.update({"pika": module, "pika.credentials": credentials, "pika.exceptions": exceptions})
+    return broker
@@ -0,0 +1,174 @@
+"""
+Микробенчмарки горячих путей для регрессионного контроля.
+
+Каждый случай возвращает список замеров в секундах на одну операцию.
+HTTP-эндпоинты вызываются напрямую через ASGI, без сокетов и без внешних
+сервисов: RabbitMQ подменён fake_pika, БД — временный SQLite, апстримы —
+заглушки.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from fastapi import FastAPI
+
+from common.logging_config import JSONFormatter
+from common.middleware import LoggingMiddleware
+from harness.services import load_module
+
+
+class _Stub:
+    status_code = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        pass
+
+
+async def _asgi_call(app, method: str, path: str, query: bytes = b"", body: bytes = b"") -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query, "root_path": "",
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    sent = False
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def _time_asgi(app, samples: int, warmup: int, request: Callable[[int], tuple]) -> List[float]:
+    async def run():
+        timings = []
+        for i in range(warmup + samples):
+            method, path, query, body = request(i)
+            start = time.perf_counter()
+            status = await _asgi_call(app, method, path, query, body)
+            elapsed = time.perf_counter() - start
+            if status >= 400:
+                raise RuntimeError(f"{method} {path} -> {status}")
+            if i >= warmup:
+                timings.append(elapsed)
+        return timings
+    return asyncio.run(run())
+
+
+def _null_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.handlers = [logging.StreamHandler(open(os.devnull, "w"))]
+    logger.handlers[0].setFormatter(JSONFormatter(name))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def json_formatter_format(samples: int, warmup: int) -> List[float]:
+    formatter = JSONFormatter("bench-service")
+    record = logging.LogRecord("bench", logging.INFO, __file__, 1, "Request completed: %s %s - %s",
+                               ("POST", "/create_order", 200), None)
+    record.request_id, record.method, record.path, record.status_code = "r-1", "POST", "/create_order", 200
+    batch = 200
+    timings = []
+    for i in range(warmup + samples):
+        start = time.perf_counter()
+        for _ in range(batch):
+            formatter.format(record)
+        if i >= warmup:
+            timings.append((time.perf_counter() - start) / batch)
+    return timings
+
+
+def _ping_app(with_middleware: bool) -> FastAPI:
+    app = FastAPI()
+    if with_middleware:
+        app.add_middleware(LoggingMiddleware, service_name="bench", logger=_null_logger("middleware"))
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+    return app
+
+
+def asgi_baseline(samples: int, warmup: int) -> List[float]:
+    return _time_asgi(_ping_app(False), samples, warmup, lambda i: ("GET", "/ping", b"", b""))
+
+
+def logging_middleware(samples: int, warmup: int) -> List[float]:
+    return _time_asgi(_ping_app(True), samples, warmup, lambda i: ("GET", "/ping", b"", b""))
+
+
+def _service(name: str):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    module = load_module(name, {"DATABASE_URL": f"sqlite:///{workdir}/{name}.db", "RABBITMQ_HOST": "fake-rabbitmq"})
+    # ASGI-вызовы идут мимо lifespan, поэтому схему создаём явно
+    module.lifecycle.init_schema()
+    return module
+
+
+def create_order(samples: int, warmup: int) -> List[float]:
+    module = _service("order")
+    module.user_client.get = lambda path, params=None, hedge=False: _Stub({"username": "bench", "address": "Bench St. 1"})
+    module.catalog_consumer.start = lambda: None
+    module.price_cache.ttl = float("inf")
+    for dish_id in range(1, 11):
+        module.price_cache.put(dish_id, 100.0 + dish_id)
+    body = json.dumps({"items": [{"dish_id": 1, "qty": 2}, {"dish_id": 5, "qty": 1}, {"dish_id": 9, "qty": 3}]}).encode()
+    return _time_asgi(module.app, samples, warmup,
+                      lambda i: ("POST", "/create_order", f"user_id={i % 50 + 1}".encode(), body))
+
+
+def get_dishes(samples: int, warmup: int) -> List[float]:
+    module = _service("catalog")
+    db = module.SessionLocal()
+    db.add_all([module.Dish(name=f"Dish {r}-{i}", description="bench", price=100.0 + i, restaurant_id=r)
+                for r in range(1, 21) for i in range(30)])
+    db.commit()
+    db.close()
+    return _time_asgi(module.app, samples, warmup,
+                      lambda i: ("GET", f"/dishes/restaurant/{i % 20 + 1}", b"", b""))
+
+
+def get_dishes_1k(samples: int, warmup: int) -> List[float]:
+    # Одно меню на 1000 блюд: доминирует сериализация ответа
+    module = _service("catalog")
+    db = module.SessionLocal()
+    db.add_all([module.Dish(name=f"Dish {i}", description="bench", price=100.0 + i % 50, restaurant_id=1)
+                for i in range(1000)])
+    db.commit()
+    db.close()
+    return _time_asgi(module.app, samples, warmup, lambda i: ("GET", "/dishes/restaurant/1", b"", b""))
+
+
+CASES: Dict[str, Callable[[int, int], List[float]]] = {
+    "json_formatter_format": json_formatter_format,
+    "asgi_baseline": asgi_baseline,
+    "logging_middleware": logging_middleware,
+    "create_order": create_order,
+    "get_dishes": get_dishes,
+    "get_dishes_1k": get_dishes_1k,
+}
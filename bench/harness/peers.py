@@ -0,0 +1,119 @@
+"""
+Заглушки сервисов для стенда: тот же HTTP-контракт, что у настоящих, но
+без БД и брокера, с мгновенными ответами. Позволяют нагружать один сервис,
+не поднимая остальные.
+"""
+import itertools
+import threading
+from typing import List, Optional
+
+from fastapi import FastAPI, Query
+
+from common.auth import TokenSigner
+
+SIGNING_KEYS = {"bench": b"bench-signing-key"}
+
+
+def _counter():
+    ids, lock = itertools.count(1), threading.Lock()
+
+    def next_id() -> int:
+        with lock:
+            return next(ids)
+    return next_id
+
+
+def user_app() -> FastAPI:
+    app, next_id, users = FastAPI(), _counter(), {}
+    signer = TokenSigner(SIGNING_KEYS, "bench")
+
+    @app.post("/register")
+    def register(username: str, password: str, address: str):
+        users[username] = (next_id(), address)
+        return {"message": "User registered"}
+
+    @app.post("/login")
+    def login(username: str, password: str):
+        user_id, _ = users.setdefault(username, (next_id(), "Stub St. 1"))
+        token, claims = signer.issue(user_id, username)
+        return {"message": "Logged in", "access_token": token, "token_type": "bearer",
+                "expires_in": claims["exp"] - claims["iat"]}
+
+    @app.get("/user/{user_id}")
+    def get_user(user_id: int):
+        return {"username": f"user{user_id}", "address": "Stub St. 1"}
+
+    return app
+
+
+def catalog_app() -> FastAPI:
+    app, next_id, dishes = FastAPI(), _counter(), {}
+
+    @app.post("/dishes/")
+    def create_dish(name: str, description: str, price: float, restaurant_id: int):
+        dish_id = next_id()
+        dishes[dish_id] = (name, price, restaurant_id)
+        return {"id": dish_id, "name": name}
+
+    @app.get("/dishes/restaurant/{restaurant_id}")
+    def get_dishes(restaurant_id: int):
+        return [{"id": i, "name": n, "price": p} for i, (n, p, r) in dishes.items() if r == restaurant_id]
+
+    @app.get("/dishes/prices")
+    def get_prices(ids: List[int] = Query(...)):
+        return {"prices": [{"id": i, "price": dishes.get(i, ("", 100.0, 0))[1]} for i in ids]}
+
+    return app
+
+
+def order_app() -> FastAPI:
+    app, next_id = FastAPI(), _counter()
+
+    @app.post("/create_order")
+    def create_order(user_id: int, order_in: dict):
+        return {"message": "Order created", "order": {"id": next_id(), "user_id": user_id, "total": 100.0}}
+
+    @app.get("/orders/lookup")
+    def lookup(ids: List[int] = Query(...)):
+        return {"orders": [{"id": i, "status": "created", "total": 100.0} for i in ids]}
+
+    @app.get("/orders/{user_id}")
+    def get_orders(user_id: int):
+        return {"orders": []}
+
+    @app.get("/history/{user_id}")
+    def get_history(user_id: int):
+        return {"orders": []}
+
+    return app
+
+
+def payment_app() -> FastAPI:
+    app, next_id = FastAPI(), _counter()
+
+    @app.post("/pay/{order_id}")
+    def pay(order_id: int, amount: Optional[float] = None):
+        return {"status": "paid", "payment_id": next_id()}
+
+    return app
+
+
+def delivery_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/couriers/{courier_id}/ping")
+    def ping(courier_id: int, lat: float, lon: float, capacity: int = 3):
+        return {"id": courier_id, "lat": lat, "lon": lon}
+
+    @app.post("/assign/{order_id}")
+    def assign(order_id: int, lat: float = None, lon: float = None):
+        return {"status": "assigned", "courier_id": 1}
+
+    return app
+
+
+def build(service: str) -> FastAPI:
+    return {
+        "user": user_app, "catalog": catalog_app, "order": order_app,
+        "payment": payment_app, "delivery": delivery_app,
+    }[service]()
@@ -0,0 +1,146 @@
+"""
+Сценарии нагрузки и сбор статистики по эндпоинтам.
+
+Каждый сценарий — последовательность HTTP-вызовов одного «пользователя».
+Задержка пишется под именем эндпоинта (шаблон маршрута), а не URL, чтобы
+не плодить ключи на каждый id.
+"""
+import base64
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+import requests
+
+# Москва внутри МКАД — курьеры и точки забора
+LAT_MIN, LAT_MAX = 55.57, 55.91
+LON_MIN, LON_MAX = 37.37, 37.84
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class Client:
+    """HTTP-клиент сценария: один Session на поток, замер каждого вызова."""
+
+    def __init__(self, urls: Dict[str, str], recorder: Recorder):
+        self.urls = urls
+        self.recorder = recorder
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def call(self, method: str, service: str, route: str, path: str, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.urls[service]}{path}", timeout=30, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(f"{method} {route}", time.perf_counter() - start, False)
+            raise ScenarioError(f"{method} {route}: {e}")
+        ok = response.status_code < 400
+        self.recorder.record(f"{method} {route}", time.perf_counter() - start, ok)
+        if not ok:
+            raise ScenarioError(f"{method} {route}: {response.status_code}")
+        return response
+
+
+def _token_subject(token: str) -> int:
+    payload = token.split(".")[0]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["sub"]
+
+
+class World:
+    """Общие данные сценариев: блюда, рестораны, счётчик пользователей."""
+
+    def __init__(self, restaurants: int, rng: random.Random):
+        self.restaurants = restaurants
+        self.dish_ids: List[int] = []
+        self.rng = rng
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def next_username(self) -> str:
+        with self._lock:
+            self._users += 1
+            return f"bench-{self._users}-{self.rng.randrange(10 ** 9)}"
+
+    def random_user(self) -> int:
+        return self.rng.randint(1, max(1, self._users))
+
+    def point(self):
+        return self.rng.uniform(LAT_MIN, LAT_MAX), self.rng.uniform(LON_MIN, LON_MAX)
+
+
+def seed(client: Client, world: World, dishes_per_restaurant: int, couriers: int):
+    """Наполняет каталог, выводит курьеров на линию и заводит первого пользователя."""
+    client.call("POST", "user", "/register", "/register",
+                params={"username": world.next_username(), "password": "bench-password", "address": "Bench St. 1"})
+    for restaurant_id in range(1, world.restaurants + 1):
+        for i in range(dishes_per_restaurant):
+            r = client.call("POST", "catalog", "/dishes/", "/dishes/", params={
+                "name": f"Dish {restaurant_id}-{i}", "description": "bench",
+                "price": round(world.rng.uniform(150, 900), 2), "restaurant_id": restaurant_id})
+            world.dish_ids.append(r.json()["id"])
+    for courier_id in range(1, couriers + 1):
+        lat, lon = world.point()
+        client.call("POST", "delivery", "/couriers/{courier_id}/ping", f"/couriers/{courier_id}/ping",
+                    params={"lat": lat, "lon": lon, "capacity": 1000})
+
+
+def checkout(client: Client, world: World):
+    """register -> login -> create_order -> pay -> assign."""
+    username = world.next_username()
+    client.call("POST", "user", "/register", "/register",
+                params={"username": username, "password": "bench-password", "address": "Bench St. 1"})
+    token = client.call("POST", "user", "/login", "/login",
+                        params={"username": username, "password": "bench-password"}).json()["access_token"]
+    user_id = _token_subject(token)
+    items = [{"dish_id": dish_id, "qty": world.rng.randint(1, 3)}
+             for dish_id in world.rng.sample(world.dish_ids, k=min(3, len(world.dish_ids)))]
+    order = client.call("POST", "order", "/create_order", "/create_order", params={"user_id": user_id},
+                        json={"items": items}, headers={"Authorization": f"Bearer {token}"}).json()["order"]
+    client.call("POST", "payment", "/pay/{order_id}", f"/pay/{order['id']}",
+                params={"amount": order["total"]})
+    lat, lon = world.point()
+    client.call("POST", "delivery", "/assign/{order_id}", f"/assign/{order['id']}", params={"lat": lat, "lon": lon})
+
+
+def browse(client: Client, world: World):
+    """Меню случайного ресторана и профиль пользователя."""
+    restaurant_id = world.rng.randint(1, world.restaurants)
+    client.call("GET", "catalog", "/dishes/restaurant/{restaurant_id}", f"/dishes/restaurant/{restaurant_id}")
+    client.call("GET", "user", "/user/{user_id}", f"/user/{world.random_user()}")
+
+
+def track(client: Client, world: World):
+    """История заказов пользователя."""
+    user_id = world.random_user()
+    client.call("GET", "order", "/history/{user_id}", f"/history/{user_id}")
+
+
+SCENARIOS: Dict[str, Callable[[Client, World], None]] = {
+    "checkout": checkout,
+    "browse": browse,
+    "track": track,
+}
@@ -0,0 +1,27 @@
+"""
+Запуск одного сервиса под uvicorn с брокером в памяти (режим subprocess).
+
+    python bench/harness/serve.py order 8001
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from harness import fake_pika
+
+fake_pika.install()
+
+import uvicorn
+
+from harness.services import load_app
+
+
+def main():
+    service, port = sys.argv[1], int(sys.argv[2])
+    uvicorn.run(load_app(service, {}), host="127.0.0.1", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
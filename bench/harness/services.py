@@ -0,0 +1,138 @@
+"""
+Запуск сервисов для нагрузочного стенда.
+
+Режим inprocess: все выбранные сервисы импортируются в один процесс и
+поднимаются под uvicorn в отдельных потоках на своих портах, общаясь по
+настоящему HTTP и через общий брокер в памяти (fake_pika). Режим
+subprocess: каждый сервис — отдельный процесс uvicorn (bench/harness/serve.py)
+со своим брокером в памяти; события между сервисами тогда не доходят.
+Не выбранные сервисы заменяются заглушками из peers.
+"""
+import contextlib
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+import uvicorn
+
+from harness import peers
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+SERVICES = {
+    "user": "user-service",
+    "catalog": "catalog-service",
+    "order": "order-service",
+    "payment": "payment-service",
+    "delivery": "delivery-service",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def load_module(service: str, env: Dict[str, str]):
+    """Импортирует app.py сервиса под уникальным именем модуля."""
+    os.environ.update(env)
+    service_dir = os.path.join(ROOT, SERVICES[service])
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+    spec = importlib.util.spec_from_file_location(f"{service}_service_app", os.path.join(service_dir, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    # Логи форматируются как обычно (это часть стоимости запроса), но
+    # обработчик, созданный setup_logging, пишет в /dev/null, а не в вывод стенда
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        spec.loader.exec_module(module)
+    return module
+
+
+def load_app(service: str, env: Dict[str, str]):
+    return load_module(service, env).app
+
+
+class ThreadedServer:
+    def __init__(self, app, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+class SubprocessServer:
+    def __init__(self, service: str, port: int, env: Dict[str, str]):
+        self.args = [sys.executable, os.path.join(ROOT, "bench", "harness", "serve.py"), service, str(port)]
+        self.env = dict(os.environ, **env)
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.args, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{url}/openapi.json", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+class Stack:
+    """Набор запущенных сервисов и заглушек; urls[service] — базовый адрес."""
+
+    def __init__(self, services: List[str], workdir: str, mode: str = "inprocess",
+                 database_url: Optional[str] = None):
+        self.services = services
+        self.mode = mode
+        self.ports = {name: free_port() for name in SERVICES}
+        self.urls = {name: f"http://127.0.0.1:{port}" for name, port in self.ports.items()}
+        self.database_url = database_url or f"sqlite:///{workdir}/{{service}}.db"
+        self.servers = []
+
+    def env_for(self, service: str) -> Dict[str, str]:
+        return {
+            "DATABASE_URL": self.database_url.format(service=service),
+            "RABBITMQ_HOST": "fake-rabbitmq",
+            "USER_SERVICE_URL": self.urls["user"],
+            "CATALOG_SERVICE_URL": self.urls["catalog"],
+            "ORDER_SERVICE_URL": self.urls["order"],
+            "AUTH_KEYS": "bench:bench-signing-key",
+        }
+
+    def start(self):
+        for name in SERVICES:
+            if name in self.services:
+                if self.mode == "subprocess":
+                    server = SubprocessServer(name, self.ports[name], self.env_for(name))
+                else:
+                    server = ThreadedServer(load_app(name, self.env_for(name)), self.ports[name])
+            else:
+                server = ThreadedServer(peers.build(name), self.ports[name])
+            server.start()
+            self.servers.append(server)
+        for name in SERVICES:
+            wait_ready(self.urls[name])
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
@@ -0,0 +1,52 @@
+"""
+Статистика для сравнения прогонов бенчмарков без внешних зависимостей.
+
+mann_whitney_greater — односторонний U-тест (нормальное приближение с
+поправкой на связи): «новые замеры стохастически больше базовых».
+bootstrap_ratio_ci — доверительный интервал отношения статистики (квантиля,
+среднего) new/base.
+"""
+import math
+import random
+from typing import Callable, List, Sequence, Tuple
+
+
+def quantile(samples: Sequence[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def mann_whitney_greater(new: Sequence[float], base: Sequence[float]) -> float:
+    """p-value гипотезы, что new в среднем больше base."""
+    n1, n2 = len(new), len(base)
+    combined = sorted([(v, 1) for v in new] + [(v, 0) for v in base])
+    rank_sum, ties, i = 0.0, 0.0, 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(flag for _, flag in combined[i:j + 1])
+        size = j - i + 1
+        ties += size ** 3 - size
+        i = j + 1
+    n = n1 + n2
+    u = rank_sum - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def bootstrap_ratio_ci(new: Sequence[float], base: Sequence[float], statistic: Callable[[Sequence[float]], float],
+                       iterations: int = 1000, confidence: float = 0.95, seed: int = 1) -> Tuple[float, float]:
+    rng = random.Random(seed)
+    ratios: List[float] = []
+    for _ in range(iterations):
+        resampled_new = rng.choices(new, k=len(new))
+        resampled_base = rng.choices(base, k=len(base))
+        ratios.append(statistic(resampled_new) / statistic(resampled_base))
+    ratios.sort()
+    tail = (1 - confidence) / 2
+    return ratios[int(tail * iterations)], ratios[min(iterations - 1, int((1 - tail) * iterations))]
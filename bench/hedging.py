@@ -0,0 +1,131 @@
+"""
+Бенчмарк хеджирования запросов ServiceClient.
+
+Поднимает две реплики-заглушки GET /user/{id}: быструю и «медленную», у
+которой часть ответов подвисает (пауза GC, шумный сосед). Одна и та же
+нагрузка прогоняется без хеджирования и с ним; результат — перцентили
+задержки и доля дополнительных запросов к апстриму.
+
+    python bench/hedging.py --requests 3000 --clients 8 --stall-rate 0.05 --stall-ms 200
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from common.http_client import ServiceClient
+from common.resilience import AdaptiveTimeout, UpstreamUnavailable
+
+
+def start_replica(base_ms: float, stall_rate: float, stall_ms: float, seed: int):
+    rng = random.Random(seed)
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            with lock:
+                counter["requests"] += 1
+                stalled = rng.random() < stall_rate
+                jitter = rng.expovariate(1.0) * base_ms * 0.2
+            time.sleep((stall_ms if stalled else base_ms + jitter) / 1000)
+            body = b'{"username": "bench", "address": "Bench St. 1"}'
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # клиент уже закрыл соединение проигравшего дубля
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counter
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+
+def run(client: ServiceClient, total: int, clients: int, hedge: bool) -> tuple:
+    latencies, errors, lock = [], [0], threading.Lock()
+    per_client = total // clients
+
+    def worker():
+        for i in range(per_client):
+            start = time.perf_counter()
+            try:
+                client.get(f"/user/{i}", hedge=hedge).json()
+            except UpstreamUnavailable:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--base-ms", type=float, default=3.0)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall-ms", type=float, default=200.0)
+    parser.add_argument("--budget", type=float, default=0.05)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench")
+    results = {}
+    for mode in ("baseline", "hedged"):
+        replicas = [start_replica(args.base_ms, 0.0, 0.0, 1),
+                    start_replica(args.base_ms, args.stall_rate, args.stall_ms, 2)]
+        urls = ",".join(f"http://127.0.0.1:{server.server_address[1]}" for server, _ in replicas)
+        # Нижняя граница таймаута выше паузы: сравнивается только хеджирование
+        timeout = AdaptiveTimeout(f"bench-{mode}", minimum=args.stall_ms / 1000 * 2, maximum=5.0)
+        client = ServiceClient(f"bench-{mode}", urls, logger, timeout=timeout,
+                               max_concurrent=args.clients * 2, hedge_budget=args.budget)
+        # Прогрев: соединения и статистика задержек для порога хеджирования
+        run(client, args.clients * 40, args.clients, hedge=False)
+        before = sum(counter["requests"] for _, counter in replicas)
+        latencies, errors = run(client, args.requests, args.clients, hedge=mode == "hedged")
+        upstream = sum(counter["requests"] for _, counter in replicas) - before
+        results[mode] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": round(max(latencies) * 1000, 2),
+            "hedge_delay_ms": round((client.timeout.hedge_delay or 0) * 1000, 2),
+            "extra_load_pct": round((upstream - len(latencies) - errors) / (len(latencies) + errors) * 100, 2),
+        }
+        for server, _ in replicas:
+            server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
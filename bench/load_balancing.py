@@ -0,0 +1,69 @@
+"""
+Бенчмарк клиентской балансировки ServiceClient по репликам.
+
+Поднимает N реплик-заглушек (одна из них медленнее остальных) и гоняет
+через клиент постоянную нагрузку. Результат — распределение запросов по
+репликам и перцентили задержки: P2C по EWMA уводит трафик с медленной
+реплики, а одинаковые реплики получают поровну.
+
+    python bench/load_balancing.py --replicas 3 --slow-ms 20 --requests 3000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from common.http_client import ServiceClient
+from hedging import percentile, start_replica
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--base-ms", type=float, default=3.0)
+    parser.add_argument("--slow-ms", type=float, default=20.0)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    replicas = [start_replica(args.slow_ms if i == 0 else args.base_ms, 0.0, 0.0, i) for i in range(args.replicas)]
+    urls = [f"http://127.0.0.1:{server.server_address[1]}" for server, _ in replicas]
+    client = ServiceClient("bench-lb", ",".join(urls), logging.getLogger("bench"),
+                           max_concurrent=args.clients * 2)
+
+    latencies, lock = [], threading.Lock()
+
+    def worker():
+        for i in range(args.requests // args.clients):
+            start = time.perf_counter()
+            client.get(f"/user/{i}").json()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = sum(counter["requests"] for _, counter in replicas)
+    print(json.dumps({
+        "share_pct": {
+            ("slow " if i == 0 else "") + url: round(counter["requests"] / total * 100, 1)
+            for i, (url, (_, counter)) in enumerate(zip(urls, replicas))
+        },
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+    }, indent=2))
+    for server, _ in replicas:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Бенчмарк user-service под смешанной нагрузкой: шторм /login против /user/{id}.
+
+Сервис поднимается под uvicorn в отдельном процессе на SQLite (чтобы
+клиентские потоки не делили GIL с сервером). Сначала
+замеряется задержка get_user без входов, затем та же нагрузка вместе
+со штормом логинов. Результат — пропускная способность логинов, число
+отказов 503 и p50/p99 get_user в обеих фазах.
+
+    python bench/password_hashing.py --duration 10 --login-clients 64 --read-clients 8
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, env: dict) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=os.path.join(ROOT, "user-service"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("user-service did not start")
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2) if ordered else None
+
+
+def run_phase(base: str, duration: float, login_clients: int, read_clients: int) -> dict:
+    stop = time.monotonic() + duration
+    reads, logins, rejected, lock = [], [0], [0], threading.Lock()
+
+    def reader():
+        session = requests.Session()
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            session.get(f"{base}/user/1").raise_for_status()
+            with lock:
+                reads.append(time.perf_counter() - start)
+
+    def login_storm():
+        session = requests.Session()
+        while time.monotonic() < stop:
+            r = session.post(f"{base}/login", params={"username": "bench", "password": "bench-password"})
+            with lock:
+                if r.status_code == 200:
+                    logins[0] += 1
+                elif r.status_code == 503:
+                    rejected[0] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(read_clients)]
+    threads += [threading.Thread(target=login_storm) for _ in range(login_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "login_clients": login_clients,
+        "logins_per_sec": round(logins[0] / duration, 1),
+        "logins_rejected": rejected[0],
+        "get_user_requests": len(reads),
+        "get_user_p50_ms": percentile(reads, 0.50),
+        "get_user_p99_ms": percentile(reads, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--login-clients", type=int, default=64)
+    parser.add_argument("--read-clients", type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-users-")
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{workdir}/users.db")
+    port = free_port()
+    server = start_server(port, env)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        requests.post(f"{base}/register", params={
+            "username": "bench", "password": "bench-password", "address": "Bench St. 1"}).raise_for_status()
+        results = {
+            "idle": run_phase(base, args.duration, 0, args.read_clients),
+            "login_storm": run_phase(base, args.duration, args.login_clients, args.read_clients),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
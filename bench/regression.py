@@ -0,0 +1,172 @@
+"""
+Регрессионный контроль производительности горячих путей.
+
+run   — прогоняет микробенчмарки и печатает сводку; с --save записывает
+        результат как базовый в bench/baselines/<profile>.json.
+check — прогоняет те же случаи и сравнивает с базовым прогоном профиля.
+        Регрессия — когда изменение значимо по U-тесту Манна-Уитни И весь
+        bootstrap-интервал отношения (квантиля p50/p99 или среднего времени
+        для пропускной способности) лежит за порогом. Код выхода 1 при
+        регрессии.
+
+Базовый прогон записан другим процессом в другое время, и дрейф машины
+между прогонами (частота CPU, соседи по хосту) внутри одного прогона не
+виден: сравнение одного и того же кода даёт узкие интервалы, сдвинутые на
+10-25% в любую сторону. Поэтому пороги по умолчанию шире этого дрейфа, а
+регрессией считается только изменение, которое за порогом с запасом
+доверительного интервала, а не одной точечной оценкой.
+
+Профиль машины по умолчанию — ОС, архитектура, число CPU и версия Python;
+базовые прогоны разных машин не сравниваются между собой.
+
+    python bench/regression.py run --save
+    python bench/regression.py check --threshold 0.30 --tail-threshold 0.50
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import fake_pika
+
+fake_pika.install()
+
+from harness.microbench import CASES
+from harness.stats import bootstrap_ratio_ci, mann_whitney_greater, quantile
+
+SCHEMA_VERSION = 1
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def default_profile() -> str:
+    return (f"{platform.system().lower()}-{platform.machine()}-{os.cpu_count()}cpu-"
+            f"py{sys.version_info.major}{sys.version_info.minor}")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def summarize(samples) -> dict:
+    return {
+        "p50_us": round(quantile(samples, 0.50) * 1e6, 2),
+        "p99_us": round(quantile(samples, 0.99) * 1e6, 2),
+        "throughput_ops": round(1 / statistics.fmean(samples), 1),
+    }
+
+
+def run_cases(names, samples: int, warmup: int) -> dict:
+    results = {}
+    for name in names:
+        timings = CASES[name](samples, warmup)
+        results[name] = dict(summarize(timings), samples=[round(t, 9) for t in timings])
+        print(f"  {name:<24} p50 {results[name]['p50_us']:>10.2f} us   p99 {results[name]['p99_us']:>10.2f} us",
+              file=sys.stderr)
+    return results
+
+
+def compare(name: str, base: dict, new: dict, threshold: float, tail_threshold: float, alpha: float) -> list:
+    """Возвращает строки отчёта; первая колонка — признак регрессии."""
+    rows = []
+    base_samples, new_samples = base["samples"], new["samples"]
+    p_slower = mann_whitney_greater(new_samples, base_samples)
+    for metric, q, limit in (("p50", 0.50, threshold), ("p99", 0.99, tail_threshold)):
+        old, cur = base[f"{metric}_us"], new[f"{metric}_us"]
+        change = cur / old - 1
+        low, high = bootstrap_ratio_ci(new_samples, base_samples, lambda s: quantile(s, q))
+        regressed = low > 1 + limit and p_slower < alpha
+        rows.append((regressed, f"{name:<24} {metric:<10} {old:>10.2f} -> {cur:>10.2f} us  {change:+7.1%}  "
+                                f"CI [{low:.2f}, {high:.2f}]  p={p_slower:.3g}"))
+    # Пропускная способность — 1 / среднее время: падение на threshold = рост среднего в 1 / (1 - threshold) раз
+    old, cur = base["throughput_ops"], new["throughput_ops"]
+    change = cur / old - 1
+    low, high = bootstrap_ratio_ci(new_samples, base_samples, statistics.fmean)
+    regressed = low > 1 / (1 - threshold) and p_slower < alpha
+    rows.append((regressed, f"{name:<24} {'throughput':<10} {old:>10.1f} -> {cur:>10.1f} op/s {change:+7.1%}  "
+                            f"CI [{1 / high:.2f}, {1 / low:.2f}]  p={p_slower:.3g}"))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("run", "check"))
+    parser.add_argument("--profile", default=default_profile())
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--samples", type=int, default=400)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--save", action="store_true", help="Записать результат как базовый (run)")
+    parser.add_argument("--threshold", type=float, default=0.30, help="Допустимый рост p50 и падение пропускной способности")
+    parser.add_argument("--tail-threshold", type=float, default=0.50, help="Допустимый рост p99")
+    parser.add_argument("--alpha", type=float, default=0.01, help="Уровень значимости U-теста")
+    args = parser.parse_args()
+
+    names = [n for n in args.cases.split(",") if n]
+    unknown = set(names) - set(CASES)
+    if unknown:
+        raise SystemExit(f"Unknown cases: {sorted(unknown)}")
+    path = os.path.join(BASELINES, f"{args.profile}.json")
+
+    baseline = None
+    if args.command == "check":
+        if not os.path.exists(path):
+            raise SystemExit(f"No baseline for profile '{args.profile}' ({path}); record one with 'run --save'")
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get("schema_version") != SCHEMA_VERSION:
+            raise SystemExit(f"Baseline schema {baseline.get('schema_version')} != {SCHEMA_VERSION}; re-record it")
+
+    print(f"Profile {args.profile}, {args.samples} samples per case", file=sys.stderr)
+    results = run_cases(names, args.samples, args.warmup)
+    if "asgi_baseline" in results and "logging_middleware" in results:
+        overhead = results["logging_middleware"]["p50_us"] - results["asgi_baseline"]["p50_us"]
+        print(f"  LoggingMiddleware overhead at p50: {overhead:.2f} us", file=sys.stderr)
+
+    if args.command == "run":
+        document = {
+            "schema_version": SCHEMA_VERSION,
+            "profile": args.profile,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "cases": results,
+        }
+        if args.save:
+            os.makedirs(BASELINES, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(document, f, indent=1)
+                f.write("\n")
+            print(f"Baseline saved to {path}", file=sys.stderr)
+        else:
+            print(json.dumps({name: {k: v for k, v in r.items() if k != "samples"} for name, r in results.items()},
+                             indent=2))
+        return
+
+    print(f"\nCompared with baseline {baseline['git_revision']} recorded {baseline['recorded_at']}:")
+    failed = False
+    for name in names:
+        if name not in baseline["cases"]:
+            print(f"  {name:<24} (no baseline, skipped)")
+            continue
+        for regressed, line in compare(name, baseline["cases"][name], results[name],
+                                       args.threshold, args.tail_threshold, args.alpha):
+            failed |= regressed
+            print(f"{'!!' if regressed else '  '} {line}")
+    if failed:
+        print("\nPerformance regression detected (lines marked !!)")
+        sys.exit(1)
+    print("\nNo significant regressions")
+
+
+if __name__ == "__main__":
+    main()
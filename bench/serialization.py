@@ -0,0 +1,104 @@
+"""
+Время сериализации ответов списочных эндпоинтов на 1000 элементов.
+
+Для каждого эндпоинта строится тело ответа той же формы, что возвращает
+сервис, и сравниваются два пути:
+  default — путь FastAPI по умолчанию: jsonable_encoder + JSONResponse (json.dumps);
+  fast    — FastJSONRoute + FastJSONResponse: тело сразу рендерится orjson.
+Печатается медиана и p95 на один ответ в миллисекундах и ускорение.
+
+    python bench/serialization.py --items 1000 --samples 200
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'order-service'))
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from common.responses import FastJSONResponse
+import history
+
+
+def dishes(n: int):
+    # catalog-service GET /dishes/restaurant/{restaurant_id}
+    return [{"id": i, "name": f"Dish {i}", "price": 100.0 + i % 50} for i in range(n)]
+
+
+def orders(n: int):
+    # order-service GET /orders/{user_id}
+    return {"orders": [{"id": i, "items": [{"dish_id": d, "qty": 1 + d % 3, "price": 120.5} for d in range(3)],
+                        "total": 361.5, "status": "created"} for i in range(n)]}
+
+
+def order_history(n: int):
+    # order-service GET /history/{user_id}
+    now = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456)
+    rows = [SimpleNamespace(order_id=i, user_id=7, items=[{"dish_id": 1, "qty": 2, "price": 99.0}], total=198.0,
+                            address="Bench St. 1", status="delivered", payment_status="paid", payment_id=i,
+                            amount=198.0, delivery_status="delivered", delivery_id=i, courier_id=i % 20,
+                            created_at=now, updated_at=now,
+                            timeline=[{"status": s, "at": now.isoformat()} for s in ("created", "paid", "delivered")])
+            for i in range(n)]
+    return {"orders": [history.history_to_dict(r) for r in rows]}
+
+
+PAYLOADS = {
+    "catalog GET /dishes/restaurant/{id}": dishes,
+    "order GET /orders/{user_id}": orders,
+    "order GET /history/{user_id}": order_history,
+}
+
+
+def default_path(content) -> bytes:
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_path(content) -> bytes:
+    return FastJSONResponse(content).body
+
+
+def measure(func, content, samples: int, warmup: int) -> list:
+    timings = []
+    for i in range(warmup + samples):
+        start = time.perf_counter()
+        func(content)
+        if i >= warmup:
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    results = {}
+    for endpoint, build in PAYLOADS.items():
+        content = build(args.items)
+        assert json.loads(default_path(content)) == json.loads(fast_path(content)), endpoint
+        row = {}
+        for name, func in (("default", default_path), ("fast", fast_path)):
+            timings = sorted(measure(func, content, args.samples, args.warmup))
+            row[f"{name}_p50_ms"] = round(statistics.median(timings), 3)
+            row[f"{name}_p95_ms"] = round(timings[int(len(timings) * 0.95) - 1], 3)
+        row["speedup"] = round(row["default_p50_ms"] / row["fast_p50_ms"], 1)
+        row["bytes"] = len(fast_path(content))
+        results[endpoint] = row
+        print(f"{endpoint:<38} default {row['default_p50_ms']:>7.3f} ms  fast {row['fast_p50_ms']:>7.3f} ms  "
+              f"x{row['speedup']}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
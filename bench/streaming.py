@@ -0,0 +1,77 @@
+"""
+Пиковая память и время до первого байта: GET /dishes/restaurant/{id}
+обычным ответом и с ?stream=true на меню разного размера.
+
+Запросы идут напрямую через ASGI в catalog-service (SQLite во временном
+каталоге, брокер в памяти); пиковая память — tracemalloc за время запроса.
+
+    python bench/streaming.py --sizes 1000,10000,100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import fake_pika
+from harness.microbench import _service
+
+fake_pika.install()
+
+
+async def request(app, path: str, query: bytes) -> dict:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query, "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    stats = {"ttfb_ms": None, "bytes": 0}
+    started = time.perf_counter()
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            if stats["ttfb_ms"] is None:
+                stats["ttfb_ms"] = (time.perf_counter() - started) * 1000
+            stats["bytes"] += len(message["body"])
+
+    await app(scope, receive, send)
+    stats["total_ms"] = (time.perf_counter() - started) * 1000
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    args = parser.parse_args()
+
+    module = _service("catalog")
+    results = {}
+    for restaurant_id, size in enumerate(int(s) for s in args.sizes.split(",")):
+        db = module.SessionLocal()
+        db.add_all([module.Dish(name=f"Dish {i}", description="bench", price=100.0 + i % 50,
+                                restaurant_id=restaurant_id) for i in range(size)])
+        db.commit()
+        db.close()
+        for mode, query in (("buffered", b""), ("stream", b"stream=true")):
+            asyncio.run(request(module.app, f"/dishes/restaurant/{restaurant_id}", query))  # прогрев
+            tracemalloc.start()
+            stats = asyncio.run(request(module.app, f"/dishes/restaurant/{restaurant_id}", query))
+            stats["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            results[f"{size}/{mode}"] = {k: round(v, 2) for k, v in stats.items()}
+            print(f"{size:>7} {mode:<9} ttfb {stats['ttfb_ms']:>8.1f} ms  total {stats['total_ms']:>8.1f} ms  "
+                  f"peak {stats['peak_mb']:>7.1f} MB", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
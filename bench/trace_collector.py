@@ -0,0 +1,142 @@
+"""
+Локальная замена коллектора трасс: принимает спаны от сервисов
+(TRACE_COLLECTOR_URL=http://127.0.0.1:4318/v1/spans) и показывает
+критический путь каждой трассы — цепочку спанов, которая определяла
+итоговое время запроса, с собственным временем каждого звена.
+
+    python bench/trace_collector.py --port 4318
+    curl http://127.0.0.1:4318/traces            # последние трассы
+    curl http://127.0.0.1:4318/traces/<trace_id> # критический путь
+
+По Ctrl-C печатает критические пути самых медленных трасс.
+"""
+import argparse
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+class Store:
+    def __init__(self, max_traces: int = 10000):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, spans: List[dict]):
+        with self._lock:
+            for span in spans:
+                self._traces.setdefault(span["trace_id"], []).append(span)
+                self._traces.move_to_end(span["trace_id"])
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, trace_id: str) -> List[dict]:
+        with self._lock:
+            return list(self._traces.get(trace_id, ()))
+
+    def summaries(self, limit: int = 50) -> List[dict]:
+        with self._lock:
+            traces = list(self._traces.items())[-limit:]
+        return [summarize(trace_id, spans) for trace_id, spans in reversed(traces)]
+
+
+def _end(span: dict) -> float:
+    return span["start"] + span["duration"]
+
+
+def critical_path(spans: List[dict]) -> List[dict]:
+    """
+    От корня спускаемся в дочерний спан, закончившийся последним: именно он
+    задерживал завершение родителя. self_ms — время звена за вычетом
+    следующего звена пути.
+    """
+    by_id = {span["span_id"]: span for span in spans}
+    children: Dict[str, List[dict]] = {}
+    roots = []
+    for span in spans:
+        if span.get("parent_id") in by_id:
+            children.setdefault(span["parent_id"], []).append(span)
+        else:
+            roots.append(span)
+    if not roots:
+        return []
+    node = max(roots, key=lambda s: s["duration"])
+    path = []
+    while node is not None:
+        nxt = max(children.get(node["span_id"], ()), key=_end, default=None)
+        path.append({
+            "service": node["service"], "name": node["name"], "kind": node["kind"],
+            "duration_ms": round(node["duration"] * 1000, 3),
+            "self_ms": round((node["duration"] - (nxt["duration"] if nxt else 0)) * 1000, 3),
+        })
+        node = nxt
+    return path
+
+
+def summarize(trace_id: str, spans: List[dict]) -> dict:
+    path = critical_path(spans)
+    return {
+        "trace_id": trace_id,
+        "spans": len(spans),
+        "services": sorted({span["service"] for span in spans}),
+        "root": path[0]["name"] if path else None,
+        "duration_ms": path[0]["duration_ms"] if path else None,
+    }
+
+
+def make_handler(store: Store):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            store.add(json.loads(body))
+            self.send_response(204)
+            self.end_headers()
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["traces"]:
+                payload = store.summaries()
+            elif len(parts) == 2 and parts[0] == "traces":
+                spans = store.get(parts[1])
+                payload = {"trace_id": parts[1], "critical_path": critical_path(spans), "spans": spans}
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = json.dumps(payload, indent=2).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--top", type=int, default=5, help="Сколько самых медленных трасс напечатать при выходе")
+    args = parser.parse_args()
+
+    store = Store()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(store))
+    print(f"Collecting spans on http://127.0.0.1:{args.port}/v1/spans")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    slowest = sorted((s for s in store.summaries(limit=store.max_traces) if s["duration_ms"] is not None),
+                     key=lambda s: s["duration_ms"], reverse=True)[:args.top]
+    for summary in slowest:
+        print(f"\n{summary['trace_id']}  {summary['root']}  {summary['duration_ms']} ms  ({', '.join(summary['services'])})")
+        for step in critical_path(store.get(summary["trace_id"])):
+            print(f"  {step['service']:<22} {step['name']:<40} {step['duration_ms']:>9.2f} ms  self {step['self_ms']:>8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
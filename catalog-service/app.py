@@ -1,32 +1,46 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from fastapi import FastAPI, Depends, HTTPException, Query
+from sqlalchemy import create_engine, select, Column, Integer, String, Float
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from typing import List
 import os
-import sys
-import pika
-from pika.credentials import PlainCredentials
-
-# Добавляем путь к common модулю
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from common.logging_config import setup_logging
+from common.messaging import Publisher, encode_event
 from common.middleware import LoggingMiddleware, setup_metrics_endpoint
-
-app = FastAPI(title="Catalog Service")
+from common.compression import CompressionMiddleware
+from common.profiler import setup_profiler_endpoint
+from common.lifecycle import Lifecycle, pool_has_capacity, pool_options, warm_pool
+from common.timing import instrument_engine
+from common.responses import FastJSONResponse, FastJSONRoute
+from common.streaming import stream_json_array
 
 # Настройка логирования
 logger = setup_logging("catalog-service")
 
+# Схема БД и прогрев соединений — в lifespan, а не при импорте
+lifecycle = Lifecycle("catalog-service", logger)
+
+app = FastAPI(title="Catalog Service", default_response_class=FastJSONResponse, lifespan=lifecycle.lifespan)
+app.router.route_class = FastJSONRoute
+
 # Добавляем middleware для логирования и метрик
+# Сжатие внутри LoggingMiddleware: его время входит в фазы запроса
+app.add_middleware(CompressionMiddleware, service_name="catalog-service")
 app.add_middleware(LoggingMiddleware, service_name="catalog-service", logger=logger)
 setup_metrics_endpoint(app, "catalog-service")
+setup_profiler_endpoint(app, "catalog-service")
+lifecycle.setup_health_endpoints(app)
 
 logger.info("Catalog Service started")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 
-engine = create_engine(DATABASE_URL)
+# Одно постоянное соединение с брокером вместо нового на каждое событие
+event_publisher = Publisher(RABBITMQ_HOST, logger)
+
+engine = create_engine(DATABASE_URL, **pool_options())
+instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -38,7 +52,11 @@ class Dish(Base):
     price = Column(Float)
     restaurant_id = Column(Integer)
 
-Base.metadata.create_all(bind=engine)
+lifecycle.schema(Base.metadata, engine)
+# Новая реплика готова только с открытыми соединениями к БД и каналом к брокеру
+lifecycle.warmup("database", lambda: warm_pool(engine))
+lifecycle.warmup("amqp_publisher", event_publisher.warm)
+lifecycle.check("db_pool", lambda: pool_has_capacity(engine))
 
 def get_db():
     db = SessionLocal()
@@ -48,12 +66,7 @@ def get_db():
         db.close()
 
 def send_event(event: str, data: dict):
-    credentials = PlainCredentials('guest', 'guest123')
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='catalog_events', exchange_type='fanout')
-    channel.basic_publish(exchange='catalog_events', routing_key='', body=f"{event}:{data}")
-    connection.close()
+    event_publisher.publish('catalog_events', encode_event(event, data))
 
 @app.post("/dishes/")
 def create_dish(name: str, description: str, price: float, restaurant_id: int, db: Session = Depends(get_db)):
@@ -62,16 +75,43 @@ def create_dish(name: str, description: str, price: float, restaurant_id: int, d
     db.add(dish)
     db.commit()
     db.refresh(dish)
-    send_event("DishCreated", {"id": dish.id, "name": name})
+    send_event("DishCreated", {"id": dish.id, "name": name, "price": price, "restaurant_id": restaurant_id})
     logger.info(f"Dish created successfully: {dish.id}")
     return {"id": dish.id, "name": name}
 
+def dish_summary(d) -> dict:
+    return {"id": d.id, "name": d.name, "price": d.price}
+
 @app.get("/dishes/restaurant/{restaurant_id}")
-def get_dishes(restaurant_id: int, db: Session = Depends(get_db)):
+def get_dishes(restaurant_id: int, stream: bool = False, db: Session = Depends(get_db)):
     logger.info(f"Fetching dishes for restaurant: {restaurant_id}")
-    dishes = db.query(Dish).filter(Dish.restaurant_id == restaurant_id).all()
+    statement = select(Dish.id, Dish.name, Dish.price).where(Dish.restaurant_id == restaurant_id).order_by(Dish.id)
+    if stream:
+        # Выгрузка без материализации: строки читаются и отдаются пачками
+        return stream_json_array(SessionLocal, statement, dish_summary)
+    dishes = db.execute(statement).all()
     logger.info(f"Found {len(dishes)} dishes for restaurant {restaurant_id}")
-    return [{"id": d.id, "name": d.name, "price": d.price} for d in dishes]
+    return [dish_summary(d) for d in dishes]
+
+@app.get("/dishes/prices")
+def get_prices(ids: List[int] = Query(...), db: Session = Depends(get_db)):
+    # Пакетный запрос цен: order-service считает сумму заказа за один вызов
+    rows = db.query(Dish.id, Dish.price).filter(Dish.id.in_(ids)).all()
+    logger.info(f"Resolved prices for {len(rows)} of {len(ids)} dishes")
+    return {"prices": [{"id": r.id, "price": r.price} for r in rows]}
+
+@app.put("/dishes/{dish_id}/price")
+def update_price(dish_id: int, price: float, db: Session = Depends(get_db)):
+    logger.info(f"Updating price of dish {dish_id} to {price}")
+    dish = db.query(Dish).filter(Dish.id == dish_id).first()
+    if not dish:
+        logger.warning(f"Dish not found: {dish_id}")
+        raise HTTPException(status_code=404, detail="Dish not found")
+    dish.price = price
+    db.commit()
+    send_event("DishPriceChanged", {"id": dish_id, "price": price})
+    logger.info(f"Dish price updated: {dish_id}")
+    return {"id": dish_id, "price": price}
 
 @app.get("/dishes/{dish_id}")
 def get_dish(dish_id: int, db: Session = Depends(get_db)):
@@ -0,0 +1,182 @@
+"""
+Подписанные токены сессии (HMAC-SHA256) и их локальная проверка.
+
+user-service выпускает токены, остальные сервисы проверяют их сами, без
+обращения к user-service или БД: проверенные claims кэшируются (LRU с
+истечением), отозванные токены приходят через обменник auth_events.
+
+Ключи задаются в AUTH_KEYS как "kid1:secret1,kid2:secret2"; подписывает
+AUTH_ACTIVE_KID (по умолчанию первый). Для ротации новый ключ добавляется
+в список, затем становится активным, а старый удаляется после истечения
+выпущенных им токенов.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from common.messaging import Consumer, decode_event
+
+AUTH_EXCHANGE = "auth_events"
+
+
+class TokenError(Exception):
+    pass
+
+
+def load_keys(logger: Optional[logging.Logger] = None) -> Tuple[Dict[str, bytes], str]:
+    """Читает ключи подписи из окружения; возвращает (ключи, активный kid)."""
+    raw = os.getenv("AUTH_KEYS", "")
+    keys = {}
+    for pair in filter(None, (p.strip() for p in raw.split(","))):
+        kid, _, secret = pair.partition(":")
+        keys[kid] = secret.encode()
+    if not keys:
+        if logger:
+            logger.warning("AUTH_KEYS is not set, using an ephemeral signing key")
+        keys = {"ephemeral": secrets.token_bytes(32)}
+    active = os.getenv("AUTH_ACTIVE_KID") or next(iter(keys))
+    return keys, active
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(key: bytes, payload: str) -> str:
+    return _b64encode(hmac.new(key, payload.encode(), hashlib.sha256).digest())
+
+
+class TokenSigner:
+    def __init__(self, keys: Dict[str, bytes], active_kid: str, ttl: int = 3600):
+        self.keys = keys
+        self.active_kid = active_kid
+        self.ttl = ttl
+
+    def issue(self, user_id: int, username: str) -> Tuple[str, dict]:
+        now = int(time.time())
+        claims = {"sub": user_id, "username": username, "iat": now, "exp": now + self.ttl,
+                  "jti": uuid.uuid4().hex, "kid": self.active_kid}
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return f"{payload}.{_sign(self.keys[self.active_kid], payload)}", claims
+
+
+class TokenVerifier:
+    """Проверяет токены; результат кэшируется до min(exp, now + cache_ttl)."""
+
+    def __init__(self, keys: Dict[str, bytes], cache_size: int = 10000, cache_ttl: float = 300.0):
+        self.keys = keys
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, jti: str, exp: float):
+        with self._lock:
+            self._revoked[jti] = exp
+            now = time.time()
+            if len(self._revoked) > self.cache_size:
+                self._revoked = {j: e for j, e in self._revoked.items() if e > now}
+
+    def _decode(self, token: str) -> dict:
+        try:
+            payload, signature = token.split(".")
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise TokenError("Malformed token")
+        if not isinstance(claims, dict):
+            raise TokenError("Malformed token")
+        key = self.keys.get(claims.get("kid"))
+        if key is None:
+            raise TokenError("Unknown signing key")
+        if not hmac.compare_digest(_sign(key, payload), signature):
+            raise TokenError("Invalid signature")
+        return claims
+
+    def verify(self, token: str) -> dict:
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(token)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(token)
+                claims = entry[0]
+            else:
+                claims = None
+        if claims is None:
+            claims = self._decode(token)
+            if claims["exp"] <= now:
+                raise TokenError("Token expired")
+            with self._lock:
+                self._cache[token] = (claims, min(claims["exp"], now + self.cache_ttl))
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        if claims["jti"] in self._revoked:
+            raise TokenError("Token revoked")
+        return claims
+
+
+class Authenticator:
+    """
+    FastAPI-зависимость: возвращает claims из заголовка Authorization.
+
+    Без заголовка возвращает None, если required=False (AUTH_REQUIRED),
+    иначе 401. Потребитель отзывов запускается вызовом start().
+    """
+
+    def __init__(self, host: str, logger: logging.Logger, keys: Optional[Dict[str, bytes]] = None,
+                 required: Optional[bool] = None):
+        if keys is None:
+            keys, _ = load_keys(logger)
+        self.verifier = TokenVerifier(
+            keys,
+            cache_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+            cache_ttl=float(os.getenv("AUTH_CACHE_TTL", "300")),
+        )
+        self.required = os.getenv("AUTH_REQUIRED", "false").lower() == "true" if required is None else required
+        self.consumer = Consumer(host, [AUTH_EXCHANGE], self._on_event, logger)
+
+    def start(self):
+        self.consumer.start()
+
+    def warm(self, timeout: float = 10.0):
+        self.consumer.warm(timeout)
+
+    def _on_event(self, exchange: str, body: bytes, properties):
+        event, data = decode_event(body)
+        if event == "TokenRevoked":
+            self.verifier.revoke(data["jti"], data["exp"])
+
+    async def __call__(self, request: Request) -> Optional[dict]:
+        header = request.headers.get("authorization")
+        if not header:
+            if self.required:
+                raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+            return None
+        scheme, _, token = header.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Invalid authorization header", headers={"WWW-Authenticate": "Bearer"})
+        try:
+            return self.verifier.verify(token)
+        except TokenError as e:
+            raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+
+def ensure_subject(claims: Optional[dict], user_id: int):
+    """Запрещает доступ к данным другого пользователя, если запрос аутентифицирован."""
+    if claims is not None and claims["sub"] != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
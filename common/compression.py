@@ -0,0 +1,223 @@
+"""
+Сжатие ответов по Accept-Encoding: gzip, а при установленных brotli и
+zstandard — также br и zstd (pip install "delivery-common[compression]").
+
+Чистый ASGI-middleware: тело ответа целиком (JSONResponse и т.п.) длиной от
+COMPRESSION_MIN_SIZE байт с текстовым Content-Type сжимается выбранным
+кодеком; потоковые ответы (SSE, StreamingResponse) и уже сжатые
+пропускаются как есть. Сжатые варианты ответов на GET хранятся в LRU-кэше
+(COMPRESSION_CACHE_BYTES) по хешу тела и кодеку: одно и то же меню
+сжимается один раз, а не на каждый запрос.
+
+Метрики: http_compression_responses_total{service,encoding,result},
+http_compression_saved_bytes_total и http_compression_cpu_seconds_total
+(процессорное время самих кодеков); в разбивке запроса по фазам —
+фаза compression.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from prometheus_client import Counter
+from starlette.datastructures import Headers, MutableHeaders
+
+from common.timing import phase
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli необязателен
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard необязателен
+    zstandard = None
+
+http_compression_responses_total = Counter(
+    'http_compression_responses_total',
+    'Responses considered for compression',
+    ['service', 'encoding', 'result']
+)
+
+http_compression_saved_bytes_total = Counter(
+    'http_compression_saved_bytes_total',
+    'Response bytes saved by compression',
+    ['service', 'encoding']
+)
+
+http_compression_cpu_seconds_total = Counter(
+    'http_compression_cpu_seconds_total',
+    'CPU time spent compressing responses',
+    ['service', 'encoding']
+)
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def available_encoders(gzip_level: int = 6, brotli_quality: int = 5, zstd_level: int = 3) -> Dict[str, Callable]:
+    """Кодеки в порядке предпочтения сервера; br и zstd — только если установлены библиотеки."""
+    encoders: Dict[str, Callable[[bytes], bytes]] = {}
+    if zstandard is not None:
+        encoders["zstd"] = lambda body: zstandard.ZstdCompressor(level=zstd_level).compress(body)
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=brotli_quality)
+    # mtime=0: одинаковое тело даёт одинаковые байты
+    encoders["gzip"] = lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return encoders
+
+
+def choose_encoding(accept_encoding: str, supported) -> Optional[str]:
+    """Кодек с наибольшим q из Accept-Encoding; при равных q — по порядку supported."""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for name in supported:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressedCache:
+    """LRU сжатых тел, ограниченный суммарным размером в байтах."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: tuple, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    """Сжимает целые текстовые ответы от minimum_size байт кодеком, выбранным по Accept-Encoding."""
+
+    def __init__(self, app, service_name: str, minimum_size: Optional[int] = None,
+                 cache_bytes: Optional[int] = None, encodings: Optional[str] = None):
+        self.app = app
+        self.service_name = service_name
+        self.minimum_size = int(os.getenv("COMPRESSION_MIN_SIZE", "1024")) if minimum_size is None else minimum_size
+        cache_bytes = int(os.getenv("COMPRESSION_CACHE_BYTES", str(16 * 1024 * 1024))) if cache_bytes is None \
+            else cache_bytes
+        self.cache = CompressedCache(cache_bytes) if cache_bytes > 0 else None
+        encoders = available_encoders(
+            gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+            brotli_quality=int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5")),
+            zstd_level=int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3")),
+        )
+        # COMPRESSION_ENCODINGS — разрешённые кодеки в порядке предпочтения, например "br,gzip"
+        allowed = encodings if encodings is not None else os.getenv("COMPRESSION_ENCODINGS")
+        if allowed:
+            encoders = {name: encoders[name] for name in allowed.split(",") if name in encoders}
+        self.encoders = encoders
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encoders:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encoders)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            passthrough = True
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if message.get("more_body", False) or not self._compressible(headers, body):
+                # Поток (SSE) и мелкие/нетекстовые/уже сжатые ответы — без изменений
+                await send(start_message)
+                await send(message)
+                return
+            compressed = self._compress(encoding, body, scope["method"] == "GET")
+            if len(compressed) >= len(body):
+                http_compression_responses_total.labels(self.service_name, encoding, "not_smaller").inc()
+                headers.add_vary_header("Accept-Encoding")
+                await send(start_message)
+                await send(message)
+                return
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _compressible(self, headers: MutableHeaders, body: bytes) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        if len(body) < self.minimum_size:
+            http_compression_responses_total.labels(self.service_name, "identity", "too_small").inc()
+            return False
+        return True
+
+    @phase("compression")
+    def _compress(self, encoding: str, body: bytes, cacheable: bool) -> bytes:
+        key = None
+        if cacheable and self.cache is not None:
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+            cached = self.cache.get(key)
+            if cached is not None:
+                http_compression_responses_total.labels(self.service_name, encoding, "cache_hit").inc()
+                http_compression_saved_bytes_total.labels(self.service_name, encoding).inc(len(body) - len(cached))
+                return cached
+        started = time.thread_time()
+        compressed = self.encoders[encoding](body)
+        http_compression_cpu_seconds_total.labels(self.service_name, encoding).inc(time.thread_time() - started)
+        if len(compressed) < len(body):
+            http_compression_responses_total.labels(self.service_name, encoding, "compressed").inc()
+            http_compression_saved_bytes_total.labels(self.service_name, encoding).inc(len(body) - len(compressed))
+            if key is not None:
+                self.cache.put(key, compressed)
+        return compressed
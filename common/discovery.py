@@ -0,0 +1,149 @@
+"""
+Выбор реплики апстрима на стороне клиента.
+
+Спецификация — список адресов через запятую. Адрес вида
+dns+http://user-service:8000 раскрывается во все A-записи имени и
+периодически обновляется (в docker compose имя сервиса резолвится во все
+его реплики). Реплика выбирается по принципу power of two choices: из двух
+случайных здоровых берётся та, у которой меньше EWMA задержки с поправкой
+на число запросов в полёте. Реплика, подряд отвечающая ошибками, временно
+исключается (passive ejection).
+"""
+import random
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter, Gauge
+
+upstream_endpoints = Gauge(
+    'upstream_endpoints',
+    'Known upstream replicas by state',
+    ['upstream', 'state']
+)
+
+upstream_ejections_total = Counter(
+    'upstream_ejections_total',
+    'Upstream replicas ejected after consecutive failures',
+    ['upstream']
+)
+
+
+class Endpoint:
+    __slots__ = ("url", "inflight", "ewma", "failures", "ejected_until")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.inflight = 0
+        self.ewma = 0.0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def score(self, default_latency: float) -> float:
+        return (self.ewma or default_latency) * (self.inflight + 1)
+
+
+def _expand(spec: str) -> List[str]:
+    urls = []
+    for item in filter(None, (part.strip().rstrip("/") for part in spec.split(","))):
+        if not item.startswith("dns+"):
+            urls.append(item)
+            continue
+        parts = urlsplit(item[len("dns+"):])
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        try:
+            infos = socket.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+        except OSError:
+            continue
+        for address in dict.fromkeys(info[4][0] for info in infos):
+            host = f"[{address}]" if ":" in address else address
+            urls.append(f"{parts.scheme}://{host}:{port}")
+    return urls
+
+
+class Resolver:
+    def __init__(self, name: str, spec: str, refresh_interval: float = 30.0,
+                 eject_after: int = 5, eject_seconds: float = 30.0,
+                 decay: float = 0.3, default_latency: float = 0.05):
+        self.name = name
+        self.spec = spec
+        self.refresh_interval = refresh_interval
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.decay = decay
+        self.default_latency = default_latency
+        self._endpoints: Dict[str, Endpoint] = {}
+        self._refreshed_at = float("-inf")
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        urls = _expand(self.spec)
+        if not urls:
+            if self._endpoints:
+                return  # DNS недоступен — продолжаем со старым списком
+            # Ещё ничего не резолвилось: обращаемся по имени как есть
+            urls = [item.strip().rstrip("/").replace("dns+", "", 1) for item in self.spec.split(",") if item.strip()]
+        with self._lock:
+            self._endpoints = {url: self._endpoints.get(url) or Endpoint(url) for url in urls}
+            self._refreshed_at = time.monotonic()
+        self._report()
+
+    def _report(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        ejected = sum(1 for e in self._endpoints.values() if e.ejected_until > now)
+        upstream_endpoints.labels(upstream=self.name, state="healthy").set(len(self._endpoints) - ejected)
+        upstream_endpoints.labels(upstream=self.name, state="ejected").set(ejected)
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return list(self._endpoints.values())
+
+    def pick(self, exclude: Optional[Endpoint] = None) -> Endpoint:
+        now = time.monotonic()
+        if now - self._refreshed_at > self.refresh_interval:
+            with self._lock:
+                # Обновляет список один поток, остальные пока работают со старым
+                stale = now - self._refreshed_at > self.refresh_interval
+                if stale:
+                    self._refreshed_at = now
+            if stale:
+                self.refresh()
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+            healthy = [e for e in endpoints if e.ejected_until <= now] or endpoints
+            candidates = [e for e in healthy if e is not exclude] or healthy
+            if len(candidates) == 1:
+                chosen = candidates[0]
+            else:
+                a, b = random.sample(candidates, 2)
+                chosen = a if a.score(self.default_latency) <= b.score(self.default_latency) else b
+            chosen.inflight += 1
+        return chosen
+
+    def cancel(self, endpoint: Endpoint):
+        """Снимает запрос, учтённый pick(), но так и не отправленный (отменённый hedge)."""
+        with self._lock:
+            endpoint.inflight -= 1
+
+    def release(self, endpoint: Endpoint, latency: float, ok: bool):
+        now = time.monotonic()
+        ejected = False
+        with self._lock:
+            endpoint.inflight -= 1
+            if ok:
+                endpoint.failures = 0
+                if endpoint.ewma:
+                    latency = self.decay * latency + (1 - self.decay) * endpoint.ewma
+                endpoint.ewma = latency
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.eject_after and endpoint.ejected_until <= now:
+                endpoint.ejected_until = now + self.eject_seconds
+                endpoint.failures = 0
+                ejected = True
+        if ejected:
+            upstream_ejections_total.labels(upstream=self.name).inc()
+            self._report(now)
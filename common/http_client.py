@@ -0,0 +1,224 @@
+"""
+HTTP-клиент для вызовов между сервисами.
+
+Один requests.Session на апстрим (пул соединений) плюс защита из
+common.resilience. Ответы 4xx возвращаются вызывающему как есть и не
+считаются ошибкой апстрима; 5xx, таймауты и ошибки соединения считаются
+и превращаются в UpstreamUnavailable.
+
+base_url — список реплик через запятую, в том числе dns+http://имя:порт
+(см. common.discovery); реплика выбирается Resolver'ом. Идемпотентные GET
+можно хеджировать (hedge=True): если ответа нет дольше hedge_delay (p95
+недавних задержек), тот же запрос уходит на другую реплику и побеждает
+первый ответ.
+Доля дублей ограничена бюджетом hedge_budget от числа запросов.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Optional
+
+import requests
+import requests.adapters
+
+from common.discovery import Endpoint, Resolver
+from common.timing import phase
+from common.tracing import inject, start_span
+from common.resilience import (
+    AdaptiveTimeout, Bulkhead, CircuitBreaker, UpstreamUnavailable,
+    upstream_hedges_total, upstream_requests_total,
+)
+
+
+class ServiceClient:
+    def __init__(self, name: str, base_url: str, logger: logging.Logger,
+                 breaker: Optional[CircuitBreaker] = None,
+                 timeout: Optional[AdaptiveTimeout] = None,
+                 max_concurrent: int = 32,
+                 hedge_budget: float = 0.05,
+                 hedge_burst: float = 10.0,
+                 resolver: Optional[Resolver] = None):
+        self.name = name
+        self.resolver = resolver or Resolver(name, base_url)
+        self.logger = logger
+        self.breaker = breaker or CircuitBreaker(name)
+        self.timeout = timeout or AdaptiveTimeout(name)
+        self.bulkhead = Bulkhead(name, max_concurrent)
+        self.session = requests.Session()
+        # Соединений в пуле хватает и на основные запросы, и на дубли
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=2 * max_concurrent)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.hedge_budget = hedge_budget
+        self.hedge_burst = hedge_burst
+        self._hedge_tokens = hedge_burst
+        self._hedge_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_concurrent = max_concurrent
+
+    @classmethod
+    def from_env(cls, name: str, base_url: str, logger: logging.Logger, prefix: str) -> "ServiceClient":
+        """Настройки из <prefix>_TIMEOUT_MIN/MAX, _MAX_CONCURRENT, _BREAKER_*, _HEDGE_*, _EJECT_*."""
+        def env(key: str, default: str) -> str:
+            return os.getenv(f"{prefix}_{key}", default)
+
+        return cls(
+            name, base_url, logger,
+            breaker=CircuitBreaker(
+                name,
+                failure_threshold=float(env("BREAKER_FAILURE_RATE", "0.5")),
+                min_calls=int(env("BREAKER_MIN_CALLS", "20")),
+                open_seconds=float(env("BREAKER_OPEN_SECONDS", "10")),
+            ),
+            timeout=AdaptiveTimeout(
+                name,
+                minimum=float(env("TIMEOUT_MIN", "0.05")),
+                maximum=float(env("TIMEOUT_MAX", "5")),
+                hedge_percentile=float(env("HEDGE_PERCENTILE", "0.95")),
+            ),
+            max_concurrent=int(env("MAX_CONCURRENT", "32")),
+            hedge_budget=float(env("HEDGE_BUDGET", "0.05")),
+            resolver=Resolver(
+                name, base_url,
+                refresh_interval=float(env("DNS_REFRESH_SECONDS", "30")),
+                eject_after=int(env("EJECT_AFTER_FAILURES", "5")),
+                eject_seconds=float(env("EJECT_SECONDS", "30")),
+            ),
+        )
+
+    def warm(self, connections: int = 2, path: str = "/health/live", timeout: float = 2.0) -> int:
+        """
+        Открывает keep-alive соединения ко всем репликам заранее, чтобы первые
+        запросы после старта не платили за TCP-рукопожатие. Недоступный апстрим
+        не ошибка: готовность сервиса от него не зависит. Возвращает число
+        успешных прогревочных запросов.
+        """
+        self.resolver.refresh()
+        targets = [endpoint.url for endpoint in self.resolver.endpoints for _ in range(connections)]
+        if not targets:
+            return 0
+
+        def probe(url: str) -> bool:
+            try:
+                self.session.get(f"{url}{path}", timeout=timeout).close()
+                return True
+            except requests.RequestException:
+                return False
+        # Параллельно, иначе запросы пойдут по одному и тому же соединению
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix=f"{self.name}-warm") as pool:
+            warmed = sum(pool.map(probe, targets))
+        self.logger.info(f"Warmed {warmed}/{len(targets)} connections to {self.name}")
+        return warmed
+
+    def _reject(self, reason: str):
+        upstream_requests_total.labels(upstream=self.name, outcome=f"rejected_{reason}").inc()
+        self.logger.warning(f"Call to {self.name} rejected: {reason}")
+        raise UpstreamUnavailable(self.name, reason)
+
+    @phase("upstream_http")
+    def get(self, path: str, params: Optional[dict] = None, hedge: bool = False) -> requests.Response:
+        if not self.bulkhead.acquire():
+            self._reject("bulkhead_full")
+        if not self.breaker.allow():
+            self.bulkhead.release()
+            self._reject("circuit_open")
+        failure = None
+        try:
+            if hedge and self.hedge_budget > 0:
+                response = self._hedged(path, params)
+            else:
+                response = self._attempt(self.resolver.pick(), path, params)
+            failure = f"status_{response.status_code}" if response.status_code >= 500 else ""
+        except requests.Timeout:
+            failure = "timeout"
+        except requests.RequestException as e:
+            failure = type(e).__name__
+        finally:
+            self.bulkhead.release()
+            if failure is None:
+                # Неожиданное исключение без исхода: не держим пробный слот half-open
+                self.breaker.release_probe()
+        if failure:
+            self._failed(failure)
+        self.breaker.record_success()
+        upstream_requests_total.labels(upstream=self.name, outcome="success").inc()
+        return response
+
+    def _failed(self, reason: str):
+        self.breaker.record_failure()
+        upstream_requests_total.labels(upstream=self.name, outcome="failure").inc()
+        self.logger.error(f"Call to {self.name} failed: {reason}")
+        raise UpstreamUnavailable(self.name, reason)
+
+    def _attempt(self, endpoint: Endpoint, path: str, params: Optional[dict]) -> requests.Response:
+        """Один запрос к выбранной реплике; реплика уже учтена в полёте вызовом pick()."""
+        start = time.perf_counter()
+        with start_span(f"GET {self.name}{path}", "client") as span:
+            span.attributes["peer"] = endpoint.url
+            try:
+                response = self.session.get(f"{endpoint.url}{path}", params=params, timeout=self.timeout.current,
+                                            headers=inject())
+            except requests.RequestException as e:
+                self.resolver.release(endpoint, time.perf_counter() - start, ok=False)
+                if isinstance(e, requests.Timeout):
+                    self.timeout.observe_timeout()
+                raise
+            span.attributes["http.status_code"] = response.status_code
+        elapsed = time.perf_counter() - start
+        ok = response.status_code < 500
+        self.resolver.release(endpoint, elapsed, ok)
+        if ok:
+            self.timeout.observe(elapsed)
+        return response
+
+    def _take_hedge_token(self) -> bool:
+        with self._hedge_lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            return True
+
+    def _hedged(self, path: str, params: Optional[dict]) -> requests.Response:
+        with self._hedge_lock:
+            # Каждый запрос пополняет бюджет на hedge_budget дубля
+            self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_budget)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2 * self._max_concurrent,
+                                                    thread_name_prefix=f"{self.name}-hedge")
+        primary_endpoint = self.resolver.pick()
+        # Попытки идут в потоках пула: контекст трассировки передаём явно, по копии на попытку
+        primary = self._executor.submit(contextvars.copy_context().run, self._attempt, primary_endpoint, path, params)
+        delay = self.timeout.hedge_delay
+        if delay is None or wait([primary], timeout=delay).done:
+            return primary.result()
+        if not self._take_hedge_token():
+            upstream_hedges_total.labels(upstream=self.name, outcome="over_budget").inc()
+            return primary.result()
+        upstream_hedges_total.labels(upstream=self.name, outcome="sent").inc()
+        hedge_endpoint = self.resolver.pick(exclude=primary_endpoint)
+        hedge = self._executor.submit(contextvars.copy_context().run, self._attempt, hedge_endpoint, path, params)
+        endpoints = {primary: primary_endpoint, hedge: hedge_endpoint}
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code < 500:
+                    for loser in pending:
+                        self._abandon(loser, endpoints[loser])
+                    if future is hedge:
+                        upstream_hedges_total.labels(upstream=self.name, outcome="won").inc()
+                    return future.result()
+        # Обе попытки неудачны — решает исход основного запроса
+        return primary.result()
+
+    def _abandon(self, future: Future, endpoint: Endpoint):
+        # requests не умеет прерывать запрос на лету: не начатый отменяем (и снимаем
+        # его учёт в полёте — _attempt для него не выполнится), а ответ начатого
+        # закрываем сразу по готовности, чтобы вернуть соединение
+        if future.cancel():
+            self.resolver.cancel(endpoint)
+        else:
+            future.add_done_callback(lambda f: f.exception() is None and f.result().close())
@@ -0,0 +1,190 @@
+"""
+Жизненный цикл сервиса: запуск через lifespan, схема БД вне импорта,
+параллельный прогрев и эндпоинты /health/live и /health/ready.
+
+Импорт app.py больше не ходит ни в БД, ни в брокер. При старте:
+  - схема создаётся в lifespan (DB_SCHEMA_MODE=startup, по умолчанию) или
+    не трогается вовсе (DB_SCHEMA_MODE=external) — тогда её применяет
+    отдельный шаг деплоя:
+        python -m common.lifecycle init-schema order-service
+    startup оставлен для локального запуска и тестов; docker-compose
+    запускает сервисы с external, схему применяют одноразовые контейнеры
+    <service>-schema до старта реплик.
+  - шаги прогрева (соединение с БД, потребители RabbitMQ и т.п.) идут
+    параллельно в фоне, не задерживая приём запросов; упавший шаг
+    повторяется с паузой.
+/health/live отвечает, пока процесс жив; /health/ready — 200 только когда
+схема готова, все шаги прогрева прошли и все текущие проверки (например,
+свободные соединения в пуле БД) выполняются, иначе 503 с состоянием шагов.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+from typing import Callable, Dict, List, Optional
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+PENDING, OK, FAILED = "pending", "ok", "failed"
+
+
+class Lifecycle:
+    def __init__(self, service_name: str, logger: logging.Logger, retry_delay: float = 2.0):
+        self.service_name = service_name
+        self.logger = logger
+        self.retry_delay = retry_delay
+        self.checks: Dict[str, str] = {}
+        self._schema = None
+        self._warmups: Dict[str, Callable[[], None]] = {}
+        self._checks: Dict[str, Callable[[], bool]] = {}
+        self._shutdown: List[Callable[[], None]] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def schema(self, metadata, engine):
+        """Регистрирует схему, которую нужно создать до приёма запросов."""
+        self._schema = (metadata, engine)
+
+    def warmup(self, name: str, func: Callable[[], None]):
+        """Регистрирует синхронный шаг прогрева; выполняется в потоке, параллельно с остальными."""
+        self._warmups[name] = func
+        return func
+
+    def check(self, name: str, func: Callable[[], bool]):
+        """Регистрирует проверку, которая вычисляется при каждом запросе /health/ready."""
+        self._checks[name] = func
+        return func
+
+    def on_shutdown(self, func: Callable[[], None]):
+        self._shutdown.append(func)
+        return func
+
+    def init_schema(self):
+        if self._schema is not None:
+            metadata, engine = self._schema
+            metadata.create_all(bind=engine)
+
+    def status(self) -> Dict[str, str]:
+        checks = dict(self.checks)
+        for name, func in self._checks.items():
+            try:
+                checks[name] = OK if func() else FAILED
+            except Exception:
+                checks[name] = FAILED
+        return checks
+
+    @property
+    def ready(self) -> bool:
+        return all(state == OK for state in self.status().values())
+
+    async def _run_warmup(self, name: str, func: Callable[[], None]):
+        while True:
+            try:
+                await asyncio.to_thread(func)
+            except Exception as e:
+                self.checks[name] = FAILED
+                self.logger.warning(f"Warm-up step '{name}' failed ({e}). Retrying in {self.retry_delay}s...")
+                await asyncio.sleep(self.retry_delay)
+            else:
+                self.checks[name] = OK
+                return
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app):
+        if self._schema is not None and os.getenv("DB_SCHEMA_MODE", "startup") == "startup":
+            # Схема нужна до первого запроса — ждём её, но вне event loop
+            self.checks["schema"] = PENDING
+            await asyncio.to_thread(self.init_schema)
+            self.checks["schema"] = OK
+        for name in self._warmups:
+            self.checks[name] = PENDING
+        self._tasks = [asyncio.create_task(self._run_warmup(name, func)) for name, func in self._warmups.items()]
+        self.logger.info(f"{self.service_name} accepting requests, warming up: {', '.join(self._warmups) or '-'}")
+        try:
+            yield
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            for func in self._shutdown:
+                try:
+                    func()
+                except Exception:
+                    self.logger.exception("Shutdown hook failed")
+
+    def setup_health_endpoints(self, app):
+        """Добавляет /health/live и /health/ready."""
+
+        @app.get("/health/live", include_in_schema=False)
+        async def live():
+            return {"status": "alive"}
+
+        @app.get("/health/ready", include_in_schema=False)
+        async def ready():
+            checks = self.status()
+            is_ready = all(state == OK for state in checks.values())
+            body = {"status": "ready" if is_ready else "not_ready", "checks": checks}
+            return JSONResponse(body, status_code=200 if is_ready else 503)
+
+
+def ping_database(engine):
+    """Шаг прогрева: открывает соединение пула и проверяет, что БД отвечает."""
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def pool_options() -> dict:
+    """Размеры пула БД из окружения: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT."""
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": True,
+    }
+
+
+def warm_pool(engine, size: Optional[int] = None):
+    """
+    Шаг прогрева: держит открытыми одновременно size соединений (DB_POOL_MIN)
+    и возвращает их в пул — первые запросы после старта не ждут подключения к БД.
+    """
+    size = int(os.getenv("DB_POOL_MIN", "2")) if size is None else size
+    if hasattr(engine.pool, "size"):
+        size = min(size, engine.pool.size())
+    connections = []
+    try:
+        for _ in range(max(size, 1)):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def pool_has_capacity(engine) -> bool:
+    """False, когда заняты все соединения пула вместе с overflow: новые запросы встанут в очередь."""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout") or getattr(pool, "_max_overflow", -1) < 0:
+        return True
+    return pool.checkedout() < pool.size() + pool._max_overflow
+
+
+def _import_service(service_dir: str):
+    # common — установленный пакет; в путь добавляется только каталог сервиса с app.py
+    sys.path.insert(0, os.path.abspath(service_dir))
+    import importlib
+    return importlib.import_module("app")
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] != "init-schema":
+        raise SystemExit("usage: python -m common.lifecycle init-schema <service-dir>")
+    module = _import_service(argv[1])
+    module.lifecycle.init_schema()
+    module.logger.info("Schema initialized")
+
+
+if __name__ == "__main__":
+    main()
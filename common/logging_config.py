@@ -8,6 +8,8 @@ import sys
 from datetime import datetime
 from typing import Optional
 
+from common import tracing
+
 
 class JSONFormatter(logging.Formatter):
     """Форматтер для структурированного JSON-логирования."""
@@ -33,6 +35,10 @@ class JSONFormatter(logging.Formatter):
             log_data["path"] = record.path
         if hasattr(record, "status_code"):
             log_data["status_code"] = record.status_code
+        span = tracing.current_span()
+        if span is not None:
+            log_data["trace_id"] = span.trace_id
+            log_data["span_id"] = span.span_id
         
         if record.exc_info:
             log_data["exception"] = self.formatException(record.exc_info)
@@ -51,6 +57,7 @@ def setup_logging(service_name: str, level: str = "INFO") -> logging.Logger:
     Returns:
         Настроенный логгер
     """
+    tracing.configure(service_name)
     logger = logging.getLogger(service_name)
     logger.setLevel(getattr(logging, level.upper()))
     
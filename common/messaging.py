@@ -0,0 +1,267 @@
+"""
+Общие помощники для работы с RabbitMQ.
+Публикация через одно постоянное соединение и фоновые потребители fanout-обменников.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+import pika
+from pika.credentials import PlainCredentials
+from prometheus_client import Counter
+
+from common.timing import phase
+from common.tracing import inject, start_span
+
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest123")
+
+amqp_publish_dropped_total = Counter(
+    'amqp_publish_dropped_total',
+    'Messages dropped by the publisher before reaching the broker',
+    ['target', 'reason']
+)
+
+
+def connection_parameters(host: str) -> pika.ConnectionParameters:
+    """Параметры подключения к RabbitMQ с учётными данными из окружения."""
+    return pika.ConnectionParameters(
+        host=host,
+        credentials=PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS),
+        heartbeat=30,
+    )
+
+
+def encode_event(event: str, data: dict) -> str:
+    """Кодирует событие в формат "<Event>:<json>"."""
+    return f"{event}:{json.dumps(data)}"
+
+
+def decode_event(body: bytes) -> Tuple[str, dict]:
+    """Разбирает сообщение формата "<Event>:<json>"."""
+    event, _, payload = body.decode().partition(":")
+    return event, (json.loads(payload) if payload else {})
+
+
+def consume_span(source: str, properties, service: Optional[str] = None) -> start_span:
+    """Спан обработки сообщения, продолжающий трассу публикатора (traceparent в заголовках)."""
+    headers = getattr(properties, "headers", None) or {}
+    return start_span(f"consume {source}", "consumer", headers.get("traceparent"), service)
+
+
+class Publisher:
+    """
+    Публикует сообщения из фонового потока через одно постоянное соединение.
+
+    Вызывающий код только кладёт сообщение в ограниченную очередь и не ждёт
+    брокер; при переполнении очереди сообщение отбрасывается. Сообщение,
+    которое max_attempts раз подряд не удалось отправить по открытому
+    соединению (например, несовпадение типа обменника), тоже отбрасывается,
+    чтобы не блокировать очередь за ним.
+    """
+
+    def __init__(self, host: str, logger: logging.Logger, max_pending: int = 10000, retry_delay: float = 5.0,
+                 max_attempts: int = 5):
+        self.host = host
+        self.logger = logger
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="amqp-publisher", daemon=True)
+                self._thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def warm(self, timeout: float = 10.0):
+        """Запускает поток публикации и ждёт открытия канала (шаг прогрева)."""
+        self.start()
+        if not self._connected.wait(timeout):
+            raise ConnectionError(f"AMQP publisher channel to {self.host} is not open")
+
+    @phase("amqp_publish")
+    def publish(self, exchange: str, body: str, routing_key: str = "", headers: Optional[dict] = None) -> bool:
+        """Ставит сообщение в очередь на отправку. Пустой exchange — прямая durable-очередь routing_key."""
+        self.start()
+        with start_span(f"publish {exchange or routing_key}", "producer"):
+            headers = inject(dict(headers) if headers else None)
+        try:
+            self._queue.put_nowait((exchange, routing_key, body, headers))
+        except queue.Full:
+            self.logger.warning(f"AMQP publish queue is full, dropping message for '{exchange or routing_key}'")
+            amqp_publish_dropped_total.labels(exchange or routing_key, "queue_full").inc()
+            return False
+        return True
+
+    def _run(self):
+        pending = None
+        failures = 0
+        while True:
+            try:
+                connection = pika.BlockingConnection(connection_parameters(self.host))
+                channel = connection.channel()
+                declared = set()
+                self._connected.set()
+                while True:
+                    if pending is None:
+                        try:
+                            pending = self._queue.get(timeout=1.0)
+                        except queue.Empty:
+                            connection.process_data_events(time_limit=0)
+                            continue
+                    exchange, routing_key, body, headers = pending
+                    target = exchange or routing_key
+                    if target not in declared:
+                        if exchange:
+                            channel.exchange_declare(exchange=exchange, exchange_type='fanout')
+                        else:
+                            channel.queue_declare(queue=routing_key, durable=True)
+                        declared.add(target)
+                    channel.basic_publish(
+                        exchange=exchange,
+                        routing_key=routing_key,
+                        body=body,
+                        properties=pika.BasicProperties(delivery_mode=2, headers=headers),
+                    )
+                    pending = None
+                    failures = 0
+            except Exception as e:
+                # Считаем только сбои при открытом соединении: недоступный брокер сообщение не отбрасывает
+                if pending is not None and self._connected.is_set():
+                    failures += 1
+                    if failures >= self.max_attempts:
+                        target = pending[0] or pending[1]
+                        self.logger.error(f"Dropping AMQP message for '{target}' after {failures} failed attempts ({e})")
+                        amqp_publish_dropped_total.labels(target, "failed").inc()
+                        pending, failures = None, 0
+                self._connected.clear()
+                self.logger.warning(f"RabbitMQ publisher unavailable ({e}). Retrying in {self.retry_delay}s...")
+                time.sleep(self.retry_delay)
+
+
+class Consumer:
+    """
+    Фоновый потребитель fanout-обменников.
+
+    Без queue_name используется эксклюзивная очередь (каждая реплика получает
+    все сообщения), с queue_name — общая durable-очередь с подтверждениями
+    (каждое сообщение обрабатывает одна реплика).
+
+    Сообщение из durable-очереди подтверждается только после успешной
+    обработки. При ошибке оно после паузы возвращается в очередь со
+    счётчиком попыток в заголовке x-attempts, а после max_attempts
+    неудач уходит в очередь <queue_name>.dead.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        exchanges: Iterable[str],
+        handler: Callable[[str, bytes, pika.BasicProperties], None],
+        logger: logging.Logger,
+        queue_name: str = "",
+        retry_delay: float = 5.0,
+        max_attempts: int = 5,
+    ):
+        self.host = host
+        self.exchanges = list(exchanges)
+        self.handler = handler
+        self.logger = logger
+        self.queue_name = queue_name
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+
+    @property
+    def dead_letter_queue(self) -> str:
+        return f"{self.queue_name}.dead"
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                name = f"amqp-consumer-{self.queue_name or '-'.join(self.exchanges)}"
+                self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+                self._thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def warm(self, timeout: float = 10.0):
+        """Запускает поток потребителя и ждёт подписки на очередь (шаг прогрева)."""
+        self.start()
+        if not self._connected.wait(timeout):
+            raise ConnectionError(f"AMQP consumer of {', '.join(self.exchanges)} on {self.host} is not subscribed")
+
+    def _on_message(self, ch, method, properties, body):
+        headers = dict(getattr(properties, "headers", None) or {})
+        # При повторе exchange исходного события хранится в заголовке
+        exchange = headers.get("x-exchange", method.exchange)
+        try:
+            # Логгер сервиса назван по имени сервиса (setup_logging)
+            with consume_span(exchange or method.routing_key, properties, self.logger.name):
+                self.handler(exchange, body, properties)
+        except Exception:
+            self.logger.exception(f"Failed to handle message from '{exchange}'")
+            if self.queue_name:
+                self._retry(ch, method, headers, exchange, body)
+            return
+        if self.queue_name:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _retry(self, ch, method, headers: dict, exchange: str, body: bytes):
+        attempts = int(headers.get("x-attempts", 0)) + 1
+        headers.update({"x-attempts": attempts, "x-exchange": exchange})
+        if attempts < self.max_attempts:
+            # Пауза с обработкой heartbeat: при сбое БД не крутим сообщение вхолостую
+            ch.connection.sleep(min(0.5 * 2 ** (attempts - 1), self.retry_delay))
+            target = self.queue_name
+        else:
+            self.logger.error(f"Message from '{exchange}' failed {attempts} times, moving to {self.dead_letter_queue}")
+            target = self.dead_letter_queue
+        # Сначала копия с новым счётчиком, потом ack оригинала: при обрыве между ними — повтор, а не потеря
+        ch.basic_publish(exchange='', routing_key=target, body=body,
+                         properties=pika.BasicProperties(delivery_mode=2, headers=headers))
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _run(self):
+        while True:
+            try:
+                connection = pika.BlockingConnection(connection_parameters(self.host))
+                channel = connection.channel()
+                if self.queue_name:
+                    channel.queue_declare(queue=self.queue_name, durable=True)
+                    channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+                    queue_name = self.queue_name
+                else:
+                    queue_name = channel.queue_declare(queue='', exclusive=True).method.queue
+                for exchange in self.exchanges:
+                    channel.exchange_declare(exchange=exchange, exchange_type='fanout')
+                    channel.queue_bind(exchange=exchange, queue=queue_name)
+                channel.basic_qos(prefetch_count=100)
+                channel.basic_consume(
+                    queue=queue_name,
+                    on_message_callback=self._on_message,
+                    auto_ack=not self.queue_name,
+                )
+                self.logger.info(f"Consuming from {', '.join(self.exchanges)}")
+                self._connected.set()
+                channel.start_consuming()
+            except Exception as e:
+                self._connected.clear()
+                self.logger.warning(f"RabbitMQ consumer unavailable ({e}). Retrying in {self.retry_delay}s...")
+                time.sleep(self.retry_delay)
@@ -1,6 +1,7 @@
 """
 Общий middleware для логирования и метрик.
 """
+import os
 import time
 import uuid
 from fastapi import Request, Response
@@ -8,6 +9,9 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 import logging
 
+from common.timing import begin_request, end_request
+from common.tracing import start_span
+
 http_requests_total = Counter(
     'http_requests_total',
     'Total HTTP requests',
@@ -31,17 +35,32 @@ http_errors_total = Counter(
 class LoggingMiddleware(BaseHTTPMiddleware):
     """Middleware для логирования HTTP-запросов."""
     
-    def __init__(self, app, service_name: str, logger: logging.Logger):
+    def __init__(self, app, service_name: str, logger: logging.Logger, server_timing: bool = None):
         super().__init__(app)
         self.service_name = service_name
         self.logger = logger
+        if server_timing is None:
+            server_timing = os.getenv("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+        self.server_timing = server_timing
     
     async def dispatch(self, request: Request, call_next):
+        # Серверный спан продолжает трассу вызывающего сервиса, если пришёл traceparent
+        with start_span(f"{request.method} {request.url.path}", "server", request.headers.get("traceparent"),
+                        self.service_name) as span:
+            response = await self._dispatch(request, call_next)
+            route = request.scope.get("route")
+            if route is not None:
+                span.name = f"{request.method} {route.path}"
+            span.attributes["http.status_code"] = response.status_code
+            return response
+
+    async def _dispatch(self, request: Request, call_next):
         request_id = str(uuid.uuid4())
         
         request.state.request_id = request_id
         
         start_time = time.time()
+        timing_token = begin_request()
         
         self.logger.info(
             f"Request started: {request.method} {request.url.path}",
@@ -55,6 +74,11 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         try:
             response = await call_next(request)
             process_time = time.time() - start_time
+            # Шаблон маршрута, а не сырой путь: иначе гистограмма фаз разрастается по id
+            route = request.scope.get("route")
+            timings = end_request(timing_token, self.service_name, getattr(route, "path", "unmatched"))
+            if self.server_timing:
+                response.headers["Server-Timing"] = timings.server_timing(process_time)
             
             self.logger.info(
                 f"Request completed: {request.method} {request.url.path} - {response.status_code}",
@@ -92,6 +116,7 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             
         except Exception as e:
             process_time = time.time() - start_time
+            end_request(timing_token, self.service_name, "failed")
             self.logger.error(
                 f"Request failed: {request.method} {request.url.path}",
                 extra={
@@ -0,0 +1,102 @@
+"""
+Статистический профайлер по запросу: GET /debug/profile?seconds=N.
+
+Отдельный поток с заданным интервалом снимает стеки всех потоков процесса
+через sys._current_frames() — включая рабочие потоки threadpool, в которых
+выполняются синхронные эндпоинты, — и возвращает их в свёрнутом формате
+(collapsed stacks: "поток;кадр;кадр N"), который понимают flamegraph.pl,
+speedscope и inferno.
+
+Без PROFILER_TOKEN эндпоинт отвечает 404; с ним требуется заголовок
+X-Admin-Token. Одновременно идёт не больше одного профилирования, длительность
+и частота ограничены, вне профилирования накладных расходов нет.
+"""
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from fastapi import Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+MAX_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+
+# Листовые кадры, в которых поток просто ждёт (пул, очередь, сокет сервера)
+IDLE_LEAVES = {"wait", "select", "poll", "accept", "_wait_for_tstate_lock"}
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool = False) -> Counter:
+    """Снимает стеки всех потоков, кроме своего, каждые interval секунд в течение seconds."""
+    own = threading.get_ident()
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not include_idle and frame.f_code.co_name in IDLE_LEAVES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapse(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def setup_profiler_endpoint(app, service_name: str):
+    """Добавляет эндпоинт /debug/profile (только при заданном PROFILER_TOKEN)."""
+    busy = threading.Lock()
+
+    @app.get("/debug/profile", include_in_schema=False)
+    async def profile(seconds: float = Query(10.0, gt=0, le=MAX_SECONDS),
+                      interval_ms: float = Query(10.0, ge=MIN_INTERVAL * 1000),
+                      include_idle: bool = False,
+                      x_admin_token: Optional[str] = Header(None)):
+        token = os.getenv("PROFILER_TOKEN")
+        if not token:
+            raise HTTPException(status_code=404, detail="Not Found")
+        if not x_admin_token or not hmac.compare_digest(x_admin_token, token):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        if not busy.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="Profiling already in progress")
+        # Сэмплер работает в отдельном потоке, а не в threadpool запросов, чтобы не занимать его рабочих;
+        # блокировку снимает сам поток — даже если клиент отключился, второй сэмплер не стартует раньше
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def deliver(setter, value):
+            if not future.done():
+                setter(value)
+
+        def run():
+            try:
+                result = sample_stacks(seconds, interval_ms / 1000, include_idle)
+            except Exception as e:
+                loop.call_soon_threadsafe(deliver, future.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(deliver, future.set_result, result)
+            finally:
+                busy.release()
+        threading.Thread(target=run, name="profiler", daemon=True).start()
+        stacks = await future
+        return PlainTextResponse(collapse(stacks), headers={
+            "Content-Disposition": f'attachment; filename="{service_name}-{int(time.time())}.folded"',
+        })
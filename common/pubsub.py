@@ -0,0 +1,167 @@
+"""
+Внутрипроцессная шина статусов для SSE-подписчиков.
+Между репликами события пересылаются через fanout-обменник RabbitMQ.
+"""
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from common.messaging import Consumer, Publisher
+
+
+class Subscription:
+    """Подписка одного клиента: буфер ограничен, при переполнении теряются самые старые события."""
+
+    __slots__ = ("topic", "loop", "_buffer", "_ready")
+
+    def __init__(self, topic: str, loop: asyncio.AbstractEventLoop, max_buffered: int):
+        self.topic = topic
+        self.loop = loop
+        self._buffer: deque = deque(maxlen=max_buffered)
+        self._ready = asyncio.Event()
+
+    def push(self, data: str):
+        """Вызывается только в потоке event loop подписчика."""
+        self._buffer.append(data)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[str]:
+        """Возвращает следующее событие или None, если за timeout ничего не пришло."""
+        if not self._buffer:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._buffer.popleft()
+
+
+class StatusBroker:
+    """Рассылает события подписчикам темы; publish можно вызывать из любого потока."""
+
+    def __init__(self, max_buffered: int = 16, max_subscribers: int = 10000):
+        self.max_buffered = max_buffered
+        self.max_subscribers = max_subscribers
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self) -> int:
+        return self._count
+
+    def check_capacity(self):
+        if self._count >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Too many subscribers")
+
+    def subscribe(self, topic: str) -> Subscription:
+        """Создаёт подписку; должна вызываться внутри работающего event loop."""
+        subscription = Subscription(topic, asyncio.get_running_loop(), self.max_buffered)
+        with self._lock:
+            self.check_capacity()
+            self._topics.setdefault(topic, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._topics.get(subscription.topic)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._topics[subscription.topic]
+
+    def publish(self, topic: str, message: dict):
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        if not subscribers:
+            return
+        data = json.dumps(message)
+        by_loop: Dict[asyncio.AbstractEventLoop, list] = {}
+        for subscription in subscribers:
+            by_loop.setdefault(subscription.loop, []).append(subscription)
+        for loop, group in by_loop.items():
+            loop.call_soon_threadsafe(_push_all, group, data)
+
+
+def _push_all(subscriptions, data: str):
+    for subscription in subscriptions:
+        subscription.push(data)
+
+
+def envelope_events(envelope: dict) -> List[dict]:
+    """События конверта status_events: одиночного ({topic, message}) или пакетного ({events: [...]})."""
+    return envelope["events"] if "events" in envelope else [envelope]
+
+
+class StatusBridge:
+    """
+    Локальная шина статусов, связанная с другими репликами через RabbitMQ.
+
+    publish сразу доставляет событие локальным подписчикам и отправляет его
+    в обменник; свои же сообщения из обменника отбрасываются по origin.
+    Потребитель запускается при первой подписке.
+    """
+
+    def __init__(self, host: str, logger: logging.Logger, exchange: str = "status_events", heartbeat: float = 15.0):
+        self.exchange = exchange
+        self.heartbeat = heartbeat
+        self.logger = logger
+        self.origin = uuid.uuid4().hex
+        self.broker = StatusBroker()
+        self.publisher = Publisher(host, logger)
+        self.consumer = Consumer(host, [exchange], self._on_message, logger)
+
+    def publish(self, topic: str, message: dict):
+        self.broker.publish(topic, message)
+        envelope = {"origin": self.origin, "topic": topic, "message": message}
+        self.publisher.publish(self.exchange, json.dumps(envelope))
+
+    def publish_batch(self, events: List[Tuple[str, dict]]):
+        """Несколько событий (topic, message) одним сообщением в обменник."""
+        if not events:
+            return
+        for topic, message in events:
+            self.broker.publish(topic, message)
+        envelope = {"origin": self.origin, "events": [{"topic": topic, "message": message} for topic, message in events]}
+        self.publisher.publish(self.exchange, json.dumps(envelope))
+
+    def _on_message(self, exchange: str, body: bytes, properties):
+        envelope = json.loads(body)
+        if envelope.get("origin") == self.origin:
+            return
+        for event in envelope_events(envelope):
+            self.broker.publish(event["topic"], event["message"])
+
+    async def _events(self, topic: str) -> AsyncIterator[bytes]:
+        # Подписка — при первой итерации: ответ, который так и не начали отдавать, её не занимает
+        subscription = self.broker.subscribe(topic)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                data = await subscription.get(self.heartbeat)
+                if data is None:
+                    yield b": keep-alive\n\n"
+                else:
+                    yield f"event: status\ndata: {data}\n\n".encode()
+        finally:
+            self.broker.unsubscribe(subscription)
+
+    def stream(self, topic: str) -> StreamingResponse:
+        """SSE-ответ с событиями темы."""
+        self.consumer.start()
+        # Переполнение — 503 до начала потока; сама подписка создаётся в _events
+        self.broker.check_capacity()
+        return StreamingResponse(
+            self._events(topic),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
@@ -0,0 +1,218 @@
+"""
+Защита вызовов между сервисами: circuit breaker, адаптивный таймаут и bulkhead.
+
+Состояние хранится отдельно для каждого апстрима, поэтому медленный
+user-service не влияет на вызовы catalog-service и наоборот.
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+
+upstream_circuit_state = Gauge(
+    'upstream_circuit_state',
+    'Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)',
+    ['upstream']
+)
+
+upstream_requests_total = Counter(
+    'upstream_requests_total',
+    'Calls to upstream services by outcome',
+    ['upstream', 'outcome']
+)
+
+upstream_timeout_seconds = Gauge(
+    'upstream_timeout_seconds',
+    'Current adaptive timeout per upstream',
+    ['upstream']
+)
+
+upstream_hedges_total = Counter(
+    'upstream_hedges_total',
+    'Hedged (duplicate) requests by outcome',
+    ['upstream', 'outcome']
+)
+
+upstream_inflight = Gauge(
+    'upstream_inflight',
+    'Calls to upstream services in flight',
+    ['upstream']
+)
+
+
+class UpstreamUnavailable(Exception):
+    """Апстрим недоступен: breaker открыт, bulkhead заполнен, таймаут или 5xx."""
+
+    def __init__(self, upstream: str, reason: str):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Breaker по доле ошибок в скользящем окне последних вызовов.
+
+    closed -> open, когда в окне не меньше min_calls вызовов и доля ошибок
+    достигла failure_threshold; через open_seconds пропускается до
+    half_open_calls пробных вызовов: все успешны — closed, любая ошибка — open.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: float = 0.5, min_calls: int = 20,
+                 window: int = 50, open_seconds: float = 10.0, half_open_calls: int = 3):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._outcomes: "deque[bool]" = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: str):
+        self.state = state
+        upstream_circuit_state.labels(upstream=self.name).set(self._STATE_VALUE[state])
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    return False
+                self._set_state(self.HALF_OPEN)
+                self._probes = self._probe_successes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def _trip(self, now: float):
+        self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+        self._set_state(self.OPEN)
+
+    def _record(self, failed: bool):
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        self._failures += failed
+
+    def record_success(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._set_state(self.CLOSED)
+            elif self.state == self.CLOSED:
+                self._record(False)
+
+    def release_probe(self):
+        """Вызов не дал исхода (неожиданное исключение): пробный слот half-open возвращается."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_failure(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trip(now)
+            elif self.state == self.CLOSED:
+                self._record(True)
+                if (len(self._outcomes) >= self.min_calls
+                        and self._failures / len(self._outcomes) >= self.failure_threshold):
+                    self._trip(now)
+
+
+def _at(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdaptiveTimeout:
+    """
+    Таймаут = перцентиль недавних задержек * multiplier в пределах [minimum, maximum].
+
+    Пока замеров меньше warmup, используется maximum. Перцентили
+    пересчитываются раз в recompute_every замеров, а не на каждом вызове;
+    заодно обновляется hedge_delay — порог для дублирующего запроса.
+
+    Вызов, оборвавшийся по таймауту, успешной задержки не даёт, поэтому
+    observe_timeout() записывает замер, равный текущему таймауту, и сразу
+    увеличивает таймаут в backoff раз (до maximum): иначе после затишья
+    замедлившийся апстрим навсегда упирается в слишком маленький таймаут.
+    """
+
+    def __init__(self, name: str, percentile: float = 0.99, multiplier: float = 3.0,
+                 minimum: float = 0.05, maximum: float = 5.0, window: int = 256,
+                 warmup: int = 20, recompute_every: int = 16, hedge_percentile: float = 0.95,
+                 backoff: float = 2.0):
+        self.name = name
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.minimum = minimum
+        self.maximum = maximum
+        self.warmup = warmup
+        self.recompute_every = recompute_every
+        self.hedge_percentile = hedge_percentile
+        self.backoff = backoff
+        self._samples: "deque[float]" = deque(maxlen=window)
+        self._since_recompute = 0
+        self._lock = threading.Lock()
+        self.current = maximum
+        self.hedge_delay: Optional[float] = None
+        upstream_timeout_seconds.labels(upstream=name).set(maximum)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.warmup:
+                return None
+            ordered = sorted(self._samples)
+        return _at(ordered, q)
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._since_recompute += 1
+            if self._since_recompute < self.recompute_every or len(self._samples) < self.warmup:
+                return
+            self._since_recompute = 0
+            ordered = sorted(self._samples)
+        self.current = min(self.maximum, max(self.minimum, _at(ordered, self.percentile) * self.multiplier))
+        self.hedge_delay = _at(ordered, self.hedge_percentile)
+        upstream_timeout_seconds.labels(upstream=self.name).set(self.current)
+
+    def observe_timeout(self):
+        with self._lock:
+            # Настоящая задержка не меньше таймаута — пишем его как нижнюю оценку
+            self._samples.append(self.current)
+            self.current = min(self.maximum, self.current * self.backoff)
+        upstream_timeout_seconds.labels(upstream=self.name).set(self.current)
+
+
+class Bulkhead:
+    """Не больше max_concurrent одновременных вызовов апстрима; лишние сразу отклоняются."""
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self) -> bool:
+        if not self._slots.acquire(blocking=False):
+            return False
+        upstream_inflight.labels(upstream=self.name).inc()
+        return True
+
+    def release(self):
+        self._slots.release()
+        upstream_inflight.labels(upstream=self.name).dec()
@@ -0,0 +1,99 @@
+"""
+Быстрый рендеринг JSON-ответов.
+
+По умолчанию FastAPI прогоняет результат эндпоинта без response_model через
+jsonable_encoder (рекурсивная копия всех dict/list) и затем json.dumps.
+Эндпоинты сервисов возвращают обычные dict/list из примитивов, datetime и
+JSON-колонок, так что копия не нужна:
+  - FastJSONResponse рендерит тело через orjson (если установлен, иначе
+    stdlib json) напрямую и только для неподдерживаемых типов откатывается
+    к jsonable_encoder; время рендеринга относится к фазе serialization;
+  - FastJSONRoute оборачивает такие эндпоинты так, что dict/list сразу
+    заворачивается в FastJSONResponse, минуя jsonable_encoder FastAPI.
+Эндпоинты с response_model, аннотацией возвращаемого типа или параметром
+Response обрабатываются FastAPI как обычно.
+
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.router.route_class = FastJSONRoute
+"""
+import functools
+import inspect
+import json
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse, Response
+
+from common.timing import phase
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """JSON в байтах: orjson или stdlib json; нестандартные типы (pydantic, Decimal, ...) — через jsonable_encoder."""
+    try:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return _stdlib_dumps(content)
+    except (TypeError, ValueError):
+        # Тот же путь, что у JSONResponse FastAPI по умолчанию
+        return _stdlib_dumps(jsonable_encoder(content))
+
+
+def _stdlib_dumps(content) -> bytes:
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, который рендерит тело через dumps()."""
+
+    @phase("serialization")
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _returns_plain_json(endpoint, response_model) -> bool:
+    """Без response_model, аннотации результата и параметра Response, не генератор."""
+    if response_model or inspect.isgeneratorfunction(endpoint) or inspect.isasyncgenfunction(endpoint):
+        return False
+    signature = inspect.signature(endpoint)
+    if signature.return_annotation is not inspect.Signature.empty:
+        return False
+    return not any(inspect.isclass(p.annotation) and issubclass(p.annotation, Response)
+                   for p in signature.parameters.values())
+
+
+class FastJSONRoute(APIRoute):
+    """APIRoute, у которого dict/list из эндпоинта сразу становится FastJSONResponse."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        response_class = kwargs.get("response_class")
+        if isinstance(response_class, DefaultPlaceholder):
+            response_class = response_class.value
+        if response_class in (None, JSONResponse):
+            response_class = FastJSONResponse
+        if issubclass(response_class, FastJSONResponse) and _returns_plain_json(endpoint, kwargs.get("response_model")):
+            endpoint = self._wrap(endpoint, response_class, kwargs.get("status_code") or 200)
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def _wrap(endpoint, response_class, status_code):
+        def respond(result):
+            if type(result) is dict or type(result) is list:
+                return response_class(result, status_code=status_code)
+            return result
+
+        # Сигнатура и globals берутся FastAPI из __wrapped__, async/sync — как у исходной функции
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapper(*args, **kwargs):
+                return respond(await endpoint(*args, **kwargs))
+        else:
+            @functools.wraps(endpoint)
+            def wrapper(*args, **kwargs):
+                return respond(endpoint(*args, **kwargs))
+        return wrapper
@@ -0,0 +1,51 @@
+"""
+Потоковая выдача больших выборок JSON-массивом.
+
+Вместо .all() + список + целая JSON-строка строки читаются из БД пачками по
+chunk_size (yield_per; на PostgreSQL это серверный курсор, на SQLite —
+постраничная выборка из курсора), каждая пачка сразу кодируется и уходит
+клиенту. Память не зависит от размера выборки, первый байт уходит после
+первой пачки.
+
+Сессией владеет сам генератор: зависимость get_db закрывается вместе с
+эндпоинтом, а тело ответа читается уже после него. При обрыве соединения
+генератор закрывается и возвращает соединение в пул.
+
+    return stream_json_array(SessionLocal, select(Dish.id, Dish.name), dish_to_dict)
+    # {"orders": [...]} вместо [...]
+    return stream_json_array(SessionLocal, statement, order_to_dict, key="orders")
+"""
+import os
+from typing import Callable, Iterator, Optional
+
+from starlette.responses import StreamingResponse
+
+from common.responses import dumps
+
+
+class StreamingJSONResponse(StreamingResponse):
+    media_type = "application/json"
+
+
+def json_array_chunks(session_factory: Callable, statement, to_dict: Callable, key: Optional[str] = None,
+                      chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """Генератор тела: [ или {"key":[, затем пачки элементов через запятую, затем ] или ]}."""
+    chunk_size = chunk_size or int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+    session = session_factory()
+    try:
+        result = session.execute(statement.execution_options(yield_per=chunk_size))
+        yield (b'{' + dumps(key) + b':[') if key is not None else b'['
+        first = True
+        for rows in result.partitions():
+            body = dumps([to_dict(row) for row in rows])[1:-1]
+            yield body if first else b',' + body
+            first = False
+        yield b']}' if key is not None else b']'
+    finally:
+        session.close()
+
+
+def stream_json_array(session_factory: Callable, statement, to_dict: Callable, key: Optional[str] = None,
+                      chunk_size: Optional[int] = None, status_code: int = 200) -> StreamingJSONResponse:
+    return StreamingJSONResponse(json_array_chunks(session_factory, statement, to_dict, key, chunk_size),
+                                 status_code=status_code)
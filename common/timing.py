@@ -0,0 +1,139 @@
+"""
+Разбивка времени запроса по фазам (db, upstream_http, amqp_publish, serialization).
+
+LoggingMiddleware создаёт на каждый запрос объект Timings в contextvar;
+таймеры phase() прибавляют к нему длительность своей фазы. Контекст
+копируется в потоки threadpool, поэтому синхронные обработчики пишут в тот же
+объект. Вне запроса таймеры ничего не делают. После ответа фазы попадают в
+гистограмму http_request_phase_seconds{service,route,phase} и, если включено
+(SERVER_TIMING=1), в заголовок Server-Timing.
+
+Стоимость таймера — два perf_counter и словарь, единицы микросекунд на
+запрос против миллисекунд самого запроса.
+"""
+import functools
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import Histogram
+from sqlalchemy import event
+
+http_request_phase_seconds = Histogram(
+    'http_request_phase_seconds',
+    'Time spent in a request phase',
+    ['service', 'route', 'phase'],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+)
+
+
+class Timings:
+    """Накопленные длительности фаз одного запроса; вложенные таймеры одной фазы не суммируются дважды."""
+
+    __slots__ = ("durations", "_depth")
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self._depth: Dict[str, int] = {}
+
+    def enter(self, name: str) -> bool:
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        return depth == 0
+
+    def exit(self, name: str, elapsed: Optional[float]):
+        self._depth[name] -= 1
+        if elapsed is not None:
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.durations.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[Timings]] = ContextVar("request_timings", default=None)
+# labels() на каждое наблюдение заметно дороже самого таймера — кэшируем дочерние серии
+_series: Dict[tuple, object] = {}
+
+
+def begin_request():
+    """Начинает учёт фаз запроса; возвращает токен для end_request."""
+    return _current.set(Timings())
+
+
+def end_request(token, service: str, route: str) -> Timings:
+    timings = _current.get()
+    _current.reset(token)
+    for name, seconds in timings.durations.items():
+        key = (service, route, name)
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = http_request_phase_seconds.labels(service=service, route=route, phase=name)
+        series.observe(seconds)
+    return timings
+
+
+class phase:
+    """Таймер фазы: контекстный менеджер (with phase("db"): ...) или декоратор (@phase("amqp_publish"))."""
+
+    __slots__ = ("name", "_timings", "_outer", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._timings: Optional[Timings] = None
+        self._outer = False
+        self._start = 0.0
+
+    def __enter__(self):
+        self._timings = timings = _current.get()
+        if timings is not None:
+            self._outer = timings.enter(self.name)
+            if self._outer:
+                self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timings = self._timings
+        if timings is not None:
+            timings.exit(self.name, time.perf_counter() - self._start if self._outer else None)
+            self._timings = None
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def instrument_engine(engine):
+    """Относит время выполнения SQL-запросов и commit/rollback движка к фазе db."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        timer = phase("db")
+        timer.__enter__()
+        conn.info.setdefault("phase_timers", []).append(timer)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        timers = conn.info.get("phase_timers")
+        if timers:
+            timers.pop().__exit__(None, None, None)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        timers = context.connection.info.get("phase_timers") if context.connection is not None else None
+        if timers:
+            timers.pop().__exit__(None, None, None)
+
+    # commit и rollback идут мимо курсора: событие приходит до вызова DBAPI,
+    # поэтому оборачиваем сами вызовы диалекта
+    dialect = engine.dialect
+    dialect.do_commit = phase("db")(dialect.do_commit)
+    dialect.do_rollback = phase("db")(dialect.do_rollback)
+    return engine
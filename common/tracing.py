@@ -0,0 +1,187 @@
+"""
+Распространение контекста трассировки (W3C traceparent) через HTTP и AMQP.
+
+Текущий спан хранится в contextvar: LoggingMiddleware открывает серверный
+спан по входящему traceparent, ServiceClient и публикаторы RabbitMQ
+передают контекст дальше в заголовках, Consumer восстанавливает его из
+заголовков сообщения. JSONFormatter добавляет trace_id/span_id в каждую
+запись лога.
+
+Завершённые спаны отправляются пачками из фонового потока на
+TRACE_COLLECTOR_URL (POST JSON-списка); без него спаны не экспортируются,
+но контекст всё равно передаётся. Доля сэмплируемых корневых трасс —
+TRACE_SAMPLE_RATE.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+_logger = logging.getLogger("tracing")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "name", "kind", "service", "attributes", "start",
+                 "_started")
+
+    def __init__(self, name: str, kind: str, service: str, trace_id: str, parent_id: Optional[str], sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.name = name
+        self.kind = kind
+        self.service = service
+        self.attributes: Dict[str, object] = {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent_span_id, sampled) или None, если заголовок отсутствует или некорректен."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff" or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+class Exporter:
+    """Фоновая пакетная отправка спанов; при переполнении очереди спаны отбрасываются."""
+
+    def __init__(self, url: str, max_pending: int = 10000, batch_size: int = 512, interval: float = 1.0):
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, record: dict):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            batch: List[dict] = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                request = urllib.request.Request(self.url, data=json.dumps(batch).encode(),
+                                                 headers={"Content-Type": "application/json"}, method="POST")
+                urllib.request.urlopen(request, timeout=2).close()
+            except Exception as e:
+                _logger.debug(f"Trace export failed: {e}")
+
+
+class _Config:
+    service = "unknown"
+    sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+    exporter: Optional[Exporter] = None
+
+
+if os.getenv("TRACE_COLLECTOR_URL"):
+    _Config.exporter = Exporter(os.environ["TRACE_COLLECTOR_URL"])
+
+
+def configure(service: str, collector_url: Optional[str] = None, sample_rate: Optional[float] = None):
+    """Задаёт имя сервиса для спанов; collector_url/sample_rate перекрывают переменные окружения."""
+    _Config.service = service
+    if collector_url is not None:
+        _Config.exporter = Exporter(collector_url) if collector_url else None
+    if sample_rate is not None:
+        _Config.sample_rate = sample_rate
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+class start_span:
+    """
+    Открывает спан как дочерний к parent (traceparent из заголовка) или к
+    текущему; без обоих начинается новая трасса. Сервис спана — явный
+    service, иначе сервис текущего спана, иначе заданный configure()
+    (несколько сервисов в одном процессе, как в нагрузочном стенде,
+    различаются по явному service на входе).
+    """
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, name: str, kind: str = "internal", parent: Optional[str] = None,
+                 service: Optional[str] = None):
+        remote = parse_traceparent(parent)
+        current = _current.get()
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+        elif current is not None:
+            trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+        else:
+            trace_id = random.getrandbits(128).to_bytes(16, "big").hex()
+            parent_id, sampled = None, random.random() < _Config.sample_rate
+        service = service or (current.service if current is not None else _Config.service)
+        self.span = Span(name, kind, service, trace_id, parent_id, sampled)
+        self._token = None
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        span = self.span
+        exporter = _Config.exporter
+        if exporter is not None and span.sampled:
+            if exc is not None:
+                span.attributes["error"] = type(exc).__name__
+            exporter.export({
+                "trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id,
+                "name": span.name, "kind": span.kind, "service": span.service,
+                "start": span.start, "duration": time.perf_counter() - span._started,
+                "attributes": span.attributes,
+            })
+        return False
+
+
+def inject(headers: Optional[dict] = None) -> dict:
+    """Добавляет traceparent текущего спана в заголовки (HTTP или AMQP) и возвращает их."""
+    headers = {} if headers is None else headers
+    span = _current.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
@@ -1,45 +1,97 @@
 from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import create_engine, Column, Integer, String
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, func, select, Column, Index, Integer, String
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from typing import List, Optional, Tuple
+import asyncio
+import functools
 import os
-import sys
-import requests
-import pika
-from pika.credentials import PlainCredentials
-
-# Добавляем путь к common модулю
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from common.logging_config import setup_logging
 from common.middleware import LoggingMiddleware, setup_metrics_endpoint
-
-app = FastAPI(title="Delivery Service")
+from common.compression import CompressionMiddleware
+from common.profiler import setup_profiler_endpoint
+from common.lifecycle import Lifecycle, ping_database
+from common.timing import instrument_engine
+from common.responses import FastJSONResponse, FastJSONRoute
+from common.http_client import ServiceClient
+from common.messaging import Consumer, Publisher, decode_event, encode_event
+from common.pubsub import StatusBridge
+from common.resilience import UpstreamUnavailable
+from couriers import CourierRegistry
+from order_projection import OrderProjection, delivery_order_lookups_total
+from scheduler import (AssignmentScheduler, DeliveryAlreadyAssigned, NoCourierAvailable, OrderLookupFailed,
+                       OrderNotAssignable, OrderNotFound)
 
 # Настройка логирования
 logger = setup_logging("delivery-service")
 
+# Схема БД и прогрев соединений — в lifespan, а не при импорте
+lifecycle = Lifecycle("delivery-service", logger)
+
+app = FastAPI(title="Delivery Service", default_response_class=FastJSONResponse, lifespan=lifecycle.lifespan)
+app.router.route_class = FastJSONRoute
+
 # Добавляем middleware для логирования и метрик
+# Сжатие внутри LoggingMiddleware: его время входит в фазы запроса
+app.add_middleware(CompressionMiddleware, service_name="delivery-service")
 app.add_middleware(LoggingMiddleware, service_name="delivery-service", logger=logger)
 setup_metrics_endpoint(app, "delivery-service")
+setup_profiler_endpoint(app, "delivery-service")
+lifecycle.setup_health_endpoints(app)
 
 logger.info("Delivery Service started")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order-service:8001")
+# immediate — назначение в каждом запросе, batch — через пакетный планировщик
+ASSIGNMENT_MODE = os.getenv("ASSIGNMENT_MODE", "immediate")
+# Проверка заказа локальная; 1 — досматривать промахи пакетным /orders/lookup
+# (только на время заполнения проекции для заказов старше неё)
+ORDER_LOOKUP_FALLBACK = os.getenv("ORDER_LOOKUP_FALLBACK", "0") == "1"
+
+status_bridge = StatusBridge(RABBITMQ_HOST, logger)
+# Одно постоянное соединение с брокером вместо нового на каждое уведомление
+event_publisher = Publisher(RABBITMQ_HOST, logger)
+order_client = ServiceClient.from_env("order-service", ORDER_SERVICE_URL, logger, "ORDER_SERVICE")
+
+# Реестр курьеров и движок назначения (позиции приходят пингами)
+courier_registry = CourierRegistry(
+    cell_size_km=float(os.getenv("COURIER_CELL_KM", "0.5")),
+    load_penalty_km=float(os.getenv("COURIER_LOAD_PENALTY_KM", "1.0")),
+    max_radius_km=float(os.getenv("COURIER_MAX_RADIUS_KM", "15")),
+    stale_after=float(os.getenv("COURIER_STALE_SECONDS", "120")),
+)
 
 engine = create_engine(DATABASE_URL)
+instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
 class Delivery(Base):
     __tablename__ = "deliveries"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer)
+    # Одна доставка на заказ, даже если DeliveryRequested обработали две реплики
+    order_id = Column(Integer, unique=True)
     courier_id = Column(Integer)
     status = Column(String, default="assigned")
+    # Нагрузка курьеров считается по активным доставкам перед каждым назначением
+    __table_args__ = (Index("ix_deliveries_status_courier", "status", "courier_id"),)
+
+class KnownOrder(Base):
+    # Проекция заказов из order_events: по ней проверяется существование заказа
+    __tablename__ = "known_orders"
+    order_id = Column(Integer, primary_key=True)
+    status = Column(String)
 
-Base.metadata.create_all(bind=engine)
+# Та же проекция в памяти реплики: байт статуса на заказ
+order_projection = OrderProjection()
+
+lifecycle.schema(Base.metadata, engine)
+lifecycle.warmup("database", lambda: ping_database(engine))
+lifecycle.warmup("amqp_publisher", event_publisher.warm)
 
 def get_db():
     db = SessionLocal()
@@ -48,33 +100,314 @@ def get_db():
     finally:
         db.close()
 
-@app.post("/assign/{order_id}")
-def assign_delivery(order_id: int, courier_id: int, db: Session = Depends(get_db)):
-    logger.info(f"Assigning delivery for order: {order_id} to courier: {courier_id}")
-    # Проверяем заказ
+def notify_delivery(message: str):
+    event_publisher.publish('', message, routing_key='notifications')
+
+@app.post("/couriers/{courier_id}/ping")
+def courier_ping(courier_id: int, lat: float, lon: float, capacity: Optional[int] = None):
+    courier = courier_registry.ping(courier_id, lat, lon, capacity)
+    return courier.to_dict()
+
+@app.put("/couriers/{courier_id}/availability")
+def set_courier_availability(courier_id: int, available: bool):
+    courier = courier_registry.set_available(courier_id, available)
+    if courier is None:
+        raise HTTPException(status_code=404, detail="Courier not found")
+    logger.info(f"Courier {courier_id} availability set to {available}")
+    return courier.to_dict()
+
+@app.get("/couriers/{courier_id}")
+def get_courier(courier_id: int):
+    courier = courier_registry.get(courier_id)
+    if courier is None:
+        raise HTTPException(status_code=404, detail="Courier not found")
+    return courier.to_dict()
+
+def publish_delivery_status(delivery: Delivery):
+    status_bridge.publish(f"order:{delivery.order_id}", {
+        "type": "delivery", "order_id": delivery.order_id, "delivery_id": delivery.id,
+        "courier_id": delivery.courier_id, "status": delivery.status,
+    })
+
+def publish_delivery_event(event: str, data: dict):
+    # События для саги заказа в order-service: назначение, отказ, завершение доставки
+    event_publisher.publish('delivery_events', encode_event(event, data))
+
+def publish_assigned(delivery: Delivery):
+    publish_delivery_event("DeliveryAssigned", {"order_id": delivery.order_id, "delivery_id": delivery.id,
+                                                "courier_id": delivery.courier_id})
+
+def store_orders(db: Session, orders: List[Tuple[int, str]], only_new: bool = False):
+    """Записывает статусы заказов в known_orders; only_new — не трогать уже известные (повтор OrderCreated)."""
+    for attempt in range(2):
+        existing = {row.order_id: row for row in
+                    db.query(KnownOrder).filter(KnownOrder.order_id.in_([order_id for order_id, _ in orders]))}
+        for order_id, status in orders:
+            row = existing.get(order_id)
+            if row is None:
+                existing[order_id] = KnownOrder(order_id=order_id, status=status)
+                db.add(existing[order_id])
+            elif not only_new:
+                row.status = status
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # Ту же строку параллельно вставила другая реплика — перечитываем и повторяем
+            db.rollback()
+    raise RuntimeError(f"Failed to store {len(orders)} known orders")
+
+def load_order_projection():
+    # Шаг прогрева: проекция в памяти восстанавливается из known_orders
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(KnownOrder.order_id, KnownOrder.status).execution_options(yield_per=10000))
+        loaded = order_projection.load((row.order_id, row.status) for row in rows)
+    finally:
+        db.close()
+    logger.info(f"Order projection loaded: {loaded} orders")
+
+def known_orders(order_ids: List[int]) -> set:
+    """Существующие заказы из пачки: проекция в памяти, затем known_orders (и /orders/lookup, если включён)."""
+    missing = order_projection.missing(order_ids)
+    delivery_order_lookups_total.labels("memory").inc(len(order_ids) - len(missing))
+    if missing:
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(KnownOrder.order_id, KnownOrder.status)
+                              .where(KnownOrder.order_id.in_(missing))).all()
+            order_projection.load((row.order_id, row.status) for row in rows)
+            delivery_order_lookups_total.labels("table").inc(len(rows))
+            missing = order_projection.missing(missing)
+            if missing and ORDER_LOOKUP_FALLBACK:
+                # Заказ старше проекции или его событие ещё в пути
+                resp = order_client.get("/orders/lookup", params={"ids": missing}, hedge=True)
+                resp.raise_for_status()
+                fetched = [(o["id"], o["status"]) for o in resp.json()["orders"]]
+                if fetched:
+                    store_orders(db, fetched, only_new=True)
+                    order_projection.load(fetched)
+                delivery_order_lookups_total.labels("upstream").inc(len(fetched))
+                missing = order_projection.missing(missing)
+        finally:
+            db.close()
+    delivery_order_lookups_total.labels("not_found").inc(len(missing))
+    return set(order_ids).difference(missing)
+
+def commit_deliveries(assignments: List[Tuple[int, int]]) -> List[Optional[int]]:
+    db = SessionLocal(expire_on_commit=False)
     try:
-        order_resp = requests.get(f"{ORDER_SERVICE_URL}/orders/{order_id}")
-        order_resp.raise_for_status()
-        logger.info(f"Order verified: {order_id}")
+        deliveries = [Delivery(order_id=order_id, courier_id=courier_id, status="in_transit")
+                      for order_id, courier_id in assignments]
+        db.add_all(deliveries)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Часть заказов уже назначила другая реплика: сохраняем остальные
+            db.rollback()
+            taken = {row.order_id for row in db.query(Delivery.order_id)
+                     .filter(Delivery.order_id.in_([order_id for order_id, _ in assignments]))}
+            deliveries = [Delivery(order_id=order_id, courier_id=courier_id, status="in_transit")
+                          for order_id, courier_id in assignments if order_id not in taken]
+            db.add_all(deliveries)
+            db.commit()
+    finally:
+        db.close()
+    # Доставки уже сохранены: сбой публикации не должен освобождать курьеров и ронять пачку
+    try:
+        notify_delivery(f"Deliveries assigned: orders {', '.join(str(d.order_id) for d in deliveries)}")
+        for delivery in deliveries:
+            publish_delivery_status(delivery)
+            publish_assigned(delivery)
+    except Exception:
+        logger.exception(f"Failed to publish {len(deliveries)} committed assignments")
+    ids = {d.order_id: d.id for d in deliveries}
+    return [ids.get(order_id) for order_id, _ in assignments]
+
+def refresh_courier_loads():
+    # Источник нагрузки — таблица deliveries: видны назначения и завершения других реплик
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(Delivery.courier_id, func.count())
+                          .where(Delivery.status == "in_transit")
+                          .group_by(Delivery.courier_id)).all()
+    finally:
+        db.close()
+    courier_registry.sync_loads(dict(rows))
+
+assignment_scheduler = AssignmentScheduler(
+    courier_registry, known_orders, commit_deliveries, logger,
+    window=float(os.getenv("ASSIGNMENT_WINDOW_MS", "50")) / 1000,
+    max_batch=int(os.getenv("ASSIGNMENT_MAX_BATCH", "500")),
+    assignable=lambda order_id: order_projection.assignable(order_id),
+    refresh_loads=lambda: refresh_courier_loads(),
+)
+
+def on_saga_assignment(order_id: int, future):
+    # Ответ саге: успех уже опубликован commit_deliveries, здесь — только отказ
+    error = future.exception()
+    if isinstance(error, DeliveryAlreadyAssigned):
+        # Доставку сохранила другая реплика — повторяем её ответ
+        db = SessionLocal()
+        try:
+            existing = db.query(Delivery).filter(Delivery.order_id == order_id).first()
+        finally:
+            db.close()
+        if existing is not None:
+            publish_assigned(existing)
+    elif isinstance(error, NoCourierAvailable):
+        logger.warning(f"No courier available for order: {order_id}")
+        publish_delivery_event("DeliveryFailed", {"order_id": order_id, "reason": "no courier available"})
+    elif error is not None:
+        # Временный сбой: ответа нет, сага повторит DeliveryRequested по таймауту
+        logger.error(f"Saga assignment for order {order_id} failed: {error}")
+
+def order_event_statuses(event: str, data: dict) -> List[Tuple[int, str]]:
+    if event == "OrderCreated":
+        return [(data["order_id"], "created")]
+    if event == "OrderStatusChanged":
+        return [(data["order_id"], data.get("status"))]
+    if event == "OrderStatusesChanged":
+        # Пакетная смена статусов (/update_orders) — одно событие на пакет
+        return [(o["order_id"], o["status"]) for o in data["orders"]]
+    return []
+
+def handle_projection_event(exchange: str, body: bytes, properties):
+    # Эксклюзивная очередь реплики: проекция в памяти у каждой реплики
+    event, data = decode_event(body)
+    for order_id, status in order_event_statuses(event, data):
+        order_projection.apply(order_id, status, only_new=event == "OrderCreated")
+
+def handle_order_event(exchange: str, body: bytes, properties):
+    event, data = decode_event(body)
+    statuses = order_event_statuses(event, data)
+    if statuses:
+        # Durable-копия проекции: событие записывает одна реплика, остальные дочитают её при промахе
+        db = SessionLocal()
+        try:
+            store_orders(db, statuses, only_new=event == "OrderCreated")
+        finally:
+            db.close()
+        for order_id, status in statuses:
+            order_projection.apply(order_id, status, only_new=event == "OrderCreated")
+        return
+    if event != "DeliveryRequested":
+        return
+    order_id = data["order_id"]
+    db = SessionLocal()
+    try:
+        existing = db.query(Delivery).filter(Delivery.order_id == order_id).first()
+    finally:
+        db.close()
+    if existing is not None:
+        # Повтор команды: доставка уже назначена, повторяем ответ
+        publish_assigned(existing)
+        return
+    # Заказ подтверждён сагой (оплачен) — в пакет без HTTP-проверки; поток потребителя не ждёт пачку
+    future = assignment_scheduler.submit(order_id, data["lat"], data["lon"], verified=True)
+    future.add_done_callback(functools.partial(on_saga_assignment, order_id))
+
+# Общая durable-очередь: каждую команду саги выполняет ровно одна реплика
+order_consumer = Consumer(RABBITMQ_HOST, ['order_events'], handle_order_event, logger, queue_name='delivery-orders')
+projection_consumer = Consumer(RABBITMQ_HOST, ['order_events'], handle_projection_event, logger)
+lifecycle.warmup("order_projection", load_order_projection)
+lifecycle.warmup("amqp_consumers", lambda: (order_consumer.warm(), projection_consumer.warm()))
+
+def assign_now(order_id: int, courier_id: Optional[int], lat: Optional[float], lon: Optional[float], db: Session):
+    # Проверяем заказ по локальной проекции
+    try:
+        exists = order_id in known_orders([order_id])
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        logger.error(f"Order not found: {order_id}, error: {e}")
+        logger.error(f"Order lookup failed: {order_id}, error: {e}")
+        raise HTTPException(status_code=503, detail="Order lookup failed")
+    if not exists:
+        logger.error(f"Order not found: {order_id}")
         raise HTTPException(404, "Order not found")
+    if not order_projection.assignable(order_id):
+        logger.warning(f"Order {order_id} is {order_projection.status(order_id)}, not assigning")
+        raise HTTPException(status_code=409, detail=f"Order is {order_projection.status(order_id)}")
+
+    refresh_courier_loads()
+    # Курьер выбирается движком назначения, если не указан явно
+    if courier_id is None:
+        courier = courier_registry.assign(lat, lon)
+        if courier is None:
+            logger.warning(f"No courier available for order: {order_id}")
+            raise HTTPException(status_code=503, detail="No courier available")
+        courier_id = courier.id
+    else:
+        courier_registry.reserve(courier_id)
 
     delivery = Delivery(order_id=order_id, courier_id=courier_id, status="in_transit")
     db.add(delivery)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        courier_registry.cancel(courier_id)
+        logger.warning(f"Delivery already assigned for order: {order_id}")
+        raise HTTPException(status_code=409, detail="Delivery already assigned")
+    except Exception:
+        courier_registry.cancel(courier_id)
+        raise
+    courier_registry.confirm(courier_id)
 
     # Уведомляем
-    credentials = PlainCredentials('guest', 'guest123')
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials))
-    channel = connection.channel()
-    channel.queue_declare(queue='notifications', durable=True)
-    channel.basic_publish(exchange='', routing_key='notifications', body=f"Delivery assigned: order {order_id}")
-    connection.close()
-
-    logger.info(f"Delivery assigned successfully: {delivery.id}")
+    notify_delivery(f"Delivery assigned: order {order_id}")
+
+    publish_delivery_status(delivery)
+    publish_assigned(delivery)
+    logger.info(f"Delivery assigned successfully: {delivery.id} to courier: {courier_id}")
     return {"status": "assigned", "courier_id": courier_id}
 
+@app.post("/assign/{order_id}")
+async def assign_delivery(order_id: int, courier_id: Optional[int] = None, lat: Optional[float] = None,
+                          lon: Optional[float] = None, db: Session = Depends(get_db)):
+    if courier_id is None and (lat is None or lon is None):
+        raise HTTPException(status_code=422, detail="Either courier_id or pickup lat/lon is required")
+    logger.info(f"Assigning delivery for order: {order_id}")
+    if courier_id is not None or ASSIGNMENT_MODE != "batch":
+        return await run_in_threadpool(assign_now, order_id, courier_id, lat, lon, db)
+
+    # Пакетный режим: ждём ближайшую пачку планировщика, не занимая поток
+    try:
+        result = await asyncio.wrap_future(assignment_scheduler.submit(order_id, lat, lon))
+    except OrderNotFound:
+        logger.error(f"Order not found: {order_id}")
+        raise HTTPException(404, "Order not found")
+    except OrderNotAssignable:
+        logger.warning(f"Order {order_id} is {order_projection.status(order_id)}, not assigning")
+        raise HTTPException(status_code=409, detail=f"Order is {order_projection.status(order_id)}")
+    except OrderLookupFailed:
+        raise HTTPException(status_code=503, detail="Order lookup failed")
+    except NoCourierAvailable:
+        logger.warning(f"No courier available for order: {order_id}")
+        raise HTTPException(status_code=503, detail="No courier available")
+    except DeliveryAlreadyAssigned:
+        logger.warning(f"Delivery already assigned for order: {order_id}")
+        raise HTTPException(status_code=409, detail="Delivery already assigned")
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    logger.info(f"Delivery assigned in batch: {result['delivery_id']} to courier: {result['courier_id']}")
+    return {"status": "assigned", "courier_id": result["courier_id"]}
+
+@app.put("/deliveries/{delivery_id}/complete")
+def complete_delivery(delivery_id: int, db: Session = Depends(get_db)):
+    delivery = db.query(Delivery).filter(Delivery.id == delivery_id).first()
+    if not delivery:
+        logger.warning(f"Delivery not found: {delivery_id}")
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    if delivery.status != "delivered":
+        delivery.status = "delivered"
+        db.commit()
+        courier_registry.release(delivery.courier_id)
+        publish_delivery_status(delivery)
+        publish_delivery_event("DeliveryCompleted", {"order_id": delivery.order_id, "delivery_id": delivery.id})
+    logger.info(f"Delivery completed: {delivery_id}")
+    return {"delivery_id": delivery.id, "status": delivery.status}
+
 @app.get("/deliveries/order/{order_id}")
 def get_delivery(order_id: int, db: Session = Depends(get_db)):
     logger.info(f"Fetching delivery for order: {order_id}")
@@ -84,3 +417,8 @@ def get_delivery(order_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Delivery not found")
     logger.info(f"Delivery fetched successfully: {delivery.id}")
     return {"delivery_id": delivery.id, "courier_id": delivery.courier_id, "status": delivery.status}
+
+@app.get("/deliveries/order/{order_id}/stream")
+async def stream_delivery_status(order_id: int):
+    logger.info(f"Status stream opened for order: {order_id}")
+    return status_bridge.stream(f"order:{order_id}")
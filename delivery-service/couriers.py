@@ -0,0 +1,276 @@
+"""
+Реестр курьеров и движок назначения.
+
+Позиции курьеров лежат в равномерной сетке (ячейка ~cell_size_km), которая
+обновляется инкрементально при каждом пинге. В сетке находятся только
+курьеры, способные взять заказ, поэтому поиск не тратит время на занятых.
+
+Нагрузка курьера — активные доставки из таблицы deliveries (sync_loads перед
+назначением) плюс свои ещё не сохранённые резервы, поэтому доставки,
+назначенные и завершённые другими репликами, тоже учитываются.
+"""
+import heapq
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+KM_PER_DEGREE = 111.195
+
+
+class Courier:
+    __slots__ = ("id", "lat", "lon", "load", "reserved", "capacity", "available", "last_ping", "cell")
+
+    def __init__(self, courier_id: int, lat: float, lon: float, capacity: int):
+        self.id = courier_id
+        self.lat = lat
+        self.lon = lon
+        self.load = 0
+        # Назначения этой реплики, ещё не сохранённые в deliveries
+        self.reserved = 0
+        self.capacity = capacity
+        self.available = True
+        self.last_ping = 0.0
+        self.cell: Optional[Tuple[int, int]] = None
+
+    @property
+    def eligible(self) -> bool:
+        return self.available and self.load < self.capacity
+
+    def to_dict(self) -> dict:
+        return {
+            "courier_id": self.id, "lat": self.lat, "lon": self.lon,
+            "load": self.load, "capacity": self.capacity, "available": self.available,
+        }
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Равнопромежуточное приближение: на масштабах города погрешность пренебрежимо мала."""
+    x = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return math.sqrt(x * x + y * y) * KM_PER_DEGREE
+
+
+class CourierRegistry:
+    """
+    Потокобезопасный реестр курьеров с пространственным индексом.
+
+    Оценка кандидата: расстояние до точки забора + load * load_penalty_km,
+    так что свободный курьер чуть дальше выигрывает у загруженного рядом.
+    """
+
+    def __init__(
+        self,
+        cell_size_km: float = 0.5,
+        load_penalty_km: float = 1.0,
+        max_radius_km: float = 15.0,
+        stale_after: float = 120.0,
+        default_capacity: int = 3,
+    ):
+        self.cell_deg = cell_size_km / KM_PER_DEGREE
+        self.load_penalty_km = load_penalty_km
+        self.max_radius_km = max_radius_km
+        self.stale_after = stale_after
+        self.default_capacity = default_capacity
+        self._couriers: Dict[int, Courier] = {}
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._couriers)
+
+    def _cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _unindex(self, courier: Courier):
+        if courier.cell is None:
+            return
+        members = self._cells.get(courier.cell)
+        if members is not None:
+            members.discard(courier.id)
+            if not members:
+                del self._cells[courier.cell]
+        courier.cell = None
+
+    def _reindex(self, courier: Courier):
+        cell = self._cell_of(courier.lat, courier.lon) if courier.eligible else None
+        if cell == courier.cell:
+            return
+        self._unindex(courier)
+        if cell is not None:
+            self._cells.setdefault(cell, set()).add(courier.id)
+            courier.cell = cell
+
+    def ping(self, courier_id: int, lat: float, lon: float, capacity: Optional[int] = None,
+             now: Optional[float] = None) -> Courier:
+        """Регистрирует курьера или обновляет его позицию."""
+        with self._lock:
+            courier = self._couriers.get(courier_id)
+            if courier is None:
+                courier = Courier(courier_id, lat, lon, capacity or self.default_capacity)
+                self._couriers[courier_id] = courier
+            else:
+                courier.lat, courier.lon = lat, lon
+                if capacity is not None:
+                    courier.capacity = capacity
+            courier.last_ping = time.monotonic() if now is None else now
+            self._reindex(courier)
+            return courier
+
+    def set_available(self, courier_id: int, available: bool) -> Optional[Courier]:
+        with self._lock:
+            courier = self._couriers.get(courier_id)
+            if courier is not None:
+                courier.available = available
+                self._reindex(courier)
+            return courier
+
+    def get(self, courier_id: int) -> Optional[Courier]:
+        return self._couriers.get(courier_id)
+
+    def _take(self, courier: Courier):
+        courier.load += 1
+        courier.reserved += 1
+        self._reindex(courier)
+
+    def reserve(self, courier_id: int) -> Optional[Courier]:
+        """Увеличивает нагрузку курьера, выбранного вручную."""
+        with self._lock:
+            courier = self._couriers.get(courier_id)
+            if courier is not None:
+                self._take(courier)
+            return courier
+
+    def confirm(self, courier_id: int):
+        """Резерв сохранён в deliveries: дальше его учитывает sync_loads."""
+        with self._lock:
+            courier = self._couriers.get(courier_id)
+            if courier is not None and courier.reserved > 0:
+                courier.reserved -= 1
+
+    def cancel(self, courier_id: int) -> Optional[Courier]:
+        """Отменяет несохранённый резерв (сбой или конфликт при записи доставки)."""
+        with self._lock:
+            courier = self._couriers.get(courier_id)
+            if courier is not None and courier.reserved > 0:
+                courier.reserved -= 1
+                courier.load -= 1
+                self._reindex(courier)
+            return courier
+
+    def release(self, courier_id: int) -> Optional[Courier]:
+        """Снимает с курьера одну доставку."""
+        with self._lock:
+            courier = self._couriers.get(courier_id)
+            if courier is not None and courier.load > 0:
+                courier.load -= 1
+                self._reindex(courier)
+            return courier
+
+    def sync_loads(self, active: Dict[int, int]):
+        """Нагрузка = активные доставки курьера в deliveries (active) + свои несохранённые резервы."""
+        with self._lock:
+            for courier in self._couriers.values():
+                load = active.get(courier.id, 0) + courier.reserved
+                if load != courier.load:
+                    courier.load = load
+                    self._reindex(courier)
+
+    def candidates(self, lat: float, lon: float, limit: int = 1,
+                   now: Optional[float] = None) -> List[Tuple[float, Courier]]:
+        """
+        Лучшие кандидаты (оценка, курьер) по возрастанию оценки.
+
+        Кольца ячеек обходятся от центра наружу; поиск останавливается, как
+        только нижняя граница расстояния до следующего кольца хуже limit-го
+        найденного кандидата. Вызывать под self._lock.
+        """
+        now = time.monotonic() if now is None else now
+        center_row, center_col = self._cell_of(lat, lon)
+        ring_km = self.cell_deg * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        max_ring = int(self.max_radius_km / ring_km) + 1
+        found: List[Tuple[float, Courier]] = []
+        stale: List[Courier] = []
+        for ring in range(max_ring + 1):
+            if len(found) >= limit and found[limit - 1][0] <= (ring - 1) * ring_km:
+                break
+            for cell in _ring_cells(center_row, center_col, ring):
+                members = self._cells.get(cell)
+                if not members:
+                    continue
+                for courier_id in members:
+                    courier = self._couriers[courier_id]
+                    if now - courier.last_ping > self.stale_after:
+                        stale.append(courier)
+                        continue
+                    dist = distance_km(lat, lon, courier.lat, courier.lon)
+                    if dist > self.max_radius_km:
+                        continue
+                    found.append((dist + courier.load * self.load_penalty_km, courier))
+            found.sort(key=lambda item: item[0])
+            del found[limit:]
+        for courier in stale:
+            self._unindex(courier)
+        return found
+
+    def assign(self, lat: float, lon: float, now: Optional[float] = None) -> Optional[Courier]:
+        """Выбирает лучшего курьера для точки забора и резервирует его."""
+        with self._lock:
+            best = self.candidates(lat, lon, limit=1, now=now)
+            if not best:
+                return None
+            courier = best[0][1]
+            self._take(courier)
+            return courier
+
+    def assign_batch(self, points: List[Tuple[float, float]], k: int = 8,
+                     now: Optional[float] = None) -> List[Optional[Courier]]:
+        """
+        Назначает курьеров сразу на пачку точек забора.
+
+        Рёбра (заказ, один из k ближайших курьеров) выбираются жадно по
+        глобальному минимуму оценки, поэтому заказ из начала пачки не
+        забирает курьера, который гораздо ближе к другому заказу. Оценка
+        ребра пересчитывается, если курьер уже получил заказ из этой пачки.
+        """
+        with self._lock:
+            heap = []
+            for index, (lat, lon) in enumerate(points):
+                for score, courier in self.candidates(lat, lon, limit=k, now=now):
+                    heap.append((score, index, courier.id, courier.load))
+            heapq.heapify(heap)
+            result: List[Optional[Courier]] = [None] * len(points)
+            while heap:
+                score, index, courier_id, seen_load = heapq.heappop(heap)
+                if result[index] is not None:
+                    continue
+                courier = self._couriers[courier_id]
+                if not courier.eligible:
+                    continue
+                if courier.load != seen_load:
+                    score += (courier.load - seen_load) * self.load_penalty_km
+                    heapq.heappush(heap, (score, index, courier_id, courier.load))
+                    continue
+                self._take(courier)
+                result[index] = courier
+            # Все k кандидатов достались другим заказам — ищем дальше по одному
+            for index, (lat, lon) in enumerate(points):
+                if result[index] is None:
+                    best = self.candidates(lat, lon, limit=1, now=now)
+                    if best:
+                        courier = best[0][1]
+                        self._take(courier)
+                        result[index] = courier
+            return result
+
+
+def _ring_cells(row: int, col: int, ring: int) -> Iterable[Tuple[int, int]]:
+    if ring == 0:
+        yield row, col
+        return
+    for d in range(-ring, ring + 1):
+        yield row - ring, col + d
+        yield row + ring, col + d
+    for d in range(-ring + 1, ring):
+        yield row + d, col - ring
+        yield row + d, col + ring
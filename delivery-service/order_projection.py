@@ -0,0 +1,87 @@
+"""
+Локальная проекция заказов для проверки существования без запроса в order-service.
+
+Статус каждого заказа — один байт в bytearray, индекс — order_id (id
+заказов последовательные): миллион заказов занимает ~1 МБ, проверка — одно
+обращение по индексу. Заказы с id больше max_dense хранятся в словаре.
+
+Проекция в памяти у каждой реплики своя и обновляется событиями
+order_events (OrderCreated, OrderStatusChanged, пакетный OrderStatusesChanged); durable-копия — таблица
+known_orders, из которой проекция восстанавливается при старте. Промах
+проверяется в таблице, а для заказов старше проекции — пакетным
+/orders/lookup в order-service (см. known_orders в app.py).
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+# Код 0 — заказ неизвестен; неизвестные проекции статусы хранятся как "unknown"
+STATUSES = ("created", "paid", "in_delivery", "delivered", "cancelled", "unknown")
+_CODES = {status: code for code, status in enumerate(STATUSES, start=1)}
+# Статусы, при которых заказу можно назначить курьера
+ASSIGNABLE = ("created", "paid")
+
+delivery_order_lookups_total = Counter(
+    'delivery_order_lookups_total',
+    'Order existence checks by where they were resolved',
+    ['source']
+)
+
+
+class OrderProjection:
+    """Статусы заказов по order_id: bytearray до max_dense, дальше — словарь."""
+
+    def __init__(self, max_dense: int = 1 << 26):
+        self.max_dense = max_dense
+        self._states = bytearray()
+        self._sparse: Dict[int, int] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, order_id: int) -> bool:
+        return self._code(order_id) != 0
+
+    def _code(self, order_id: int) -> int:
+        if 0 <= order_id < len(self._states):
+            return self._states[order_id]
+        return self._sparse.get(order_id, 0)
+
+    def status(self, order_id: int) -> Optional[str]:
+        code = self._code(order_id)
+        return STATUSES[code - 1] if code else None
+
+    def assignable(self, order_id: int) -> bool:
+        return self.status(order_id) in ASSIGNABLE
+
+    def apply(self, order_id: int, status: str, only_new: bool = False) -> bool:
+        """Записывает статус заказа; only_new — только если заказ ещё неизвестен (повтор OrderCreated)."""
+        code = _CODES.get(status, _CODES["unknown"])
+        with self._lock:
+            current = self._code(order_id)
+            if current == code or (only_new and current):
+                return False
+            if 0 <= order_id < self.max_dense:
+                if order_id >= len(self._states):
+                    # Рост с запасом, чтобы не копировать массив на каждый новый заказ
+                    self._states.extend(bytes(max(order_id + 1, len(self._states) * 2) - len(self._states)))
+                self._states[order_id] = code
+            else:
+                self._sparse[order_id] = code
+            if not current:
+                self._count += 1
+            return True
+
+    def load(self, rows: Iterable[Tuple[int, str]]) -> int:
+        """Восстановление из таблицы known_orders при старте."""
+        loaded = 0
+        for order_id, status in rows:
+            self.apply(order_id, status)
+            loaded += 1
+        return loaded
+
+    def missing(self, order_ids: Iterable[int]) -> List[int]:
+        return [order_id for order_id in order_ids if not self._code(order_id)]
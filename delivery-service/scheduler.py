@@ -0,0 +1,213 @@
+"""
+Пакетный планировщик назначения курьеров.
+
+Заявки копятся в течение короткого окна, после чего пачка обрабатывается
+целиком: одна проверка заказов по локальной проекции, совместный подбор курьеров
+и одна транзакция на все строки Delivery.
+"""
+import functools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from prometheus_client import Histogram
+
+from common.resilience import UpstreamUnavailable
+from couriers import CourierRegistry
+
+assignment_batch_size = Histogram(
+    'delivery_assignment_batch_size',
+    'Number of assignment requests processed in one scheduler batch',
+    buckets=[1, 2, 5, 10, 25, 50, 100, 250, 500, 1000]
+)
+
+
+class OrderNotFound(Exception):
+    pass
+
+
+class NoCourierAvailable(Exception):
+    pass
+
+
+class DeliveryAlreadyAssigned(Exception):
+    pass
+
+
+class OrderNotAssignable(Exception):
+    pass
+
+
+class OrderLookupFailed(Exception):
+    pass
+
+
+def _copy_outcome(target: Future, source: Future):
+    if target.done():
+        return
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class _Request:
+    __slots__ = ("order_id", "lat", "lon", "verified", "future")
+
+    def __init__(self, order_id: int, lat: float, lon: float, verified: bool = False):
+        self.order_id = order_id
+        self.lat = lat
+        self.lon = lon
+        # Заказ уже подтверждён (команда саги) — проверка в order-service не нужна
+        self.verified = verified
+        self.future: Future = Future()
+
+
+class AssignmentScheduler:
+    """
+    Собирает заявки на назначение за окно window секунд (или до max_batch штук).
+
+    verify_orders(ids) возвращает множество существующих заказов,
+    commit([(order_id, courier_id), ...]) сохраняет доставки одной транзакцией
+    и возвращает их id в том же порядке (None — у заказа уже есть доставка).
+    assignable(order_id) отсекает существующие, но отменённые или
+    доставленные заказы; refresh_loads() обновляет нагрузку курьеров из БД
+    один раз перед подбором на всю пачку.
+    Повторная заявка на заказ, который ещё в работе, получает тот же Future.
+    """
+
+    def __init__(
+        self,
+        registry: CourierRegistry,
+        verify_orders: Callable[[List[int]], Set[int]],
+        commit: Callable[[List[Tuple[int, int]]], List[Optional[int]]],
+        logger: logging.Logger,
+        window: float = 0.05,
+        max_batch: int = 500,
+        assignable: Optional[Callable[[int], bool]] = None,
+        refresh_loads: Optional[Callable[[], None]] = None,
+    ):
+        self.registry = registry
+        self.verify_orders = verify_orders
+        self.commit = commit
+        self.logger = logger
+        self.window = window
+        self.max_batch = max_batch
+        self.assignable = assignable
+        self.refresh_loads = refresh_loads
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[int, Future] = {}
+
+    def submit(self, order_id: int, lat: float, lon: float, verified: bool = False) -> Future:
+        """Ставит заказ в очередь; Future завершится {"delivery_id", "courier_id"} или исключением."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="assignment-scheduler", daemon=True)
+                self._thread.start()
+            inflight = self._inflight.get(order_id)
+            if inflight is not None:
+                return inflight
+            request = _Request(order_id, lat, lon, verified)
+            self._inflight[order_id] = request.future
+        request.future.add_done_callback(functools.partial(self._done, order_id))
+        self._queue.put(request)
+        return request.future
+
+    def _done(self, order_id: int, future: Future):
+        with self._lock:
+            if self._inflight.get(order_id) is future:
+                del self._inflight[order_id]
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self.flush(batch)
+            except Exception as e:
+                self.logger.exception(f"Assignment batch of {len(batch)} failed")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def flush(self, batch: Iterable[_Request]):
+        batch = list(batch)
+        assignment_batch_size.observe(len(batch))
+        # Повтор заказа в пачке получает результат первой заявки, а не вторую доставку
+        first = {}
+        for request in batch:
+            if request.order_id in first:
+                first[request.order_id].future.add_done_callback(functools.partial(_copy_outcome, request.future))
+            else:
+                first[request.order_id] = request
+        batch = list(first.values())
+
+        unverified = sorted(request.order_id for request in batch if not request.verified)
+        lookup_error = None
+        try:
+            existing = self.verify_orders(unverified) if unverified else set()
+        except Exception as e:
+            # Непроверенные заявки получают ошибку (5xx), а не "заказ не найден"; заявки саги идут дальше
+            self.logger.error(f"Order verification failed for {len(unverified)} orders: {e}")
+            lookup_error = e if isinstance(e, UpstreamUnavailable) else OrderLookupFailed(str(e))
+            existing = set()
+
+        pending = []
+        for request in batch:
+            if request.verified:
+                pending.append(request)
+            elif lookup_error is not None:
+                request.future.set_exception(lookup_error)
+            elif request.order_id not in existing:
+                request.future.set_exception(OrderNotFound(request.order_id))
+            elif self.assignable is not None and not self.assignable(request.order_id):
+                request.future.set_exception(OrderNotAssignable(request.order_id))
+            else:
+                pending.append(request)
+
+        if pending and self.refresh_loads is not None:
+            self.refresh_loads()
+        couriers = self.registry.assign_batch([(request.lat, request.lon) for request in pending])
+        matched = []
+        for request, courier in zip(pending, couriers):
+            if courier is None:
+                request.future.set_exception(NoCourierAvailable(request.order_id))
+            else:
+                matched.append((request, courier.id))
+        if not matched:
+            return
+
+        try:
+            delivery_ids = self.commit([(request.order_id, courier_id) for request, courier_id in matched])
+        except Exception:
+            for _, courier_id in matched:
+                self.registry.cancel(courier_id)
+            raise
+        assigned = 0
+        for (request, courier_id), delivery_id in zip(matched, delivery_ids):
+            if delivery_id is None:
+                # Доставку уже сохранила другая реплика — курьер этой пачки не нужен
+                self.registry.cancel(courier_id)
+                request.future.set_exception(DeliveryAlreadyAssigned(request.order_id))
+            else:
+                self.registry.confirm(courier_id)
+                request.future.set_result({"delivery_id": delivery_id, "courier_id": courier_id})
+                assigned += 1
+        self.logger.info(f"Assigned {assigned} of {len(batch)} deliveries in one batch")
@@ -57,6 +57,7 @@ def _stub_requests_if_imported(monkeypatch):
         @property
         def text(self): return '{"ok": true}'
     monkeypatch.setattr("requests.get", lambda *a, **k: OK(), raising=False)
+    monkeypatch.setattr("requests.Session.get", lambda *a, **k: OK(), raising=False)
     monkeypatch.setattr("requests.post", lambda *a, **k: OK(), raising=False)
 
 def _openapi() -> Optional[dict]:
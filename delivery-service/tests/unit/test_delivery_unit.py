@@ -1,18 +1,22 @@
 # tests/unit/test_smoke.py
-import os, sys, importlib
+import os, sys, importlib, importlib.util, time
 from typing import Optional, Tuple
 import pytest
 from fastapi.testclient import TestClient
 
 # Ищем app.py из корня сервиса
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, SERVICE_DIR)
 
 # Локальная БД для юнитов (не трогаем реальную)
 os.environ.setdefault("DATABASE_URL", "sqlite:///./test_unit.db")
 
 # Импортируем приложение
 try:
-    app_module = importlib.import_module("app")
+    # По пути к файлу: с pythonpath из pytest.ini имя "app" занято order-service
+    spec = importlib.util.spec_from_file_location("delivery_service_app", os.path.join(SERVICE_DIR, "app.py"))
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
     app = getattr(app_module, "app", None)
     if app is None:
         raise RuntimeError("В модуле app отсутствует FastAPI-приложение с именем 'app'")
@@ -58,6 +62,7 @@ def _stub_requests_if_imported(monkeypatch):
         @property
         def text(self): return '{"ok": true}'
     monkeypatch.setattr("requests.get", lambda *a, **k: OK(), raising=False)
+    monkeypatch.setattr("requests.Session.get", lambda *a, **k: OK(), raising=False)
     monkeypatch.setattr("requests.post", lambda *a, **k: OK(), raising=False)
 
 def _openapi() -> Optional[dict]:
@@ -186,3 +191,298 @@ def test_create_and_fetch_delivery(monkeypatch):
         if r.status_code == 405:
             r = client.request("PUT", path_upd, json={"status": "in_transit"})
         assert r.status_code in (200, 204), f"{path_upd} -> {r.status_code}"
+
+def _fresh_registry(monkeypatch):
+    from couriers import CourierRegistry
+    registry = CourierRegistry()
+    monkeypatch.setattr(app_module, "courier_registry", registry)
+    monkeypatch.setattr(app_module, "notify_delivery", lambda m: None)
+    monkeypatch.setattr(app_module.status_bridge.publisher, "publish", lambda *a, **k: True)
+    return registry
+
+def _fresh_projection(monkeypatch, *order_ids):
+    # Заказы, о которых delivery-service уже узнал из order_events
+    from order_projection import OrderProjection
+    projection = OrderProjection()
+    for order_id in order_ids:
+        projection.apply(order_id, "paid")
+    monkeypatch.setattr(app_module, "order_projection", projection)
+    return projection
+
+def test_assign_picks_nearest_courier_with_capacity(monkeypatch):
+    _stub_requests_if_imported(monkeypatch)
+    registry = _fresh_registry(monkeypatch)
+    _fresh_projection(monkeypatch, 10, 11)
+    client.post("/couriers/1/ping", params={"lat": 55.750, "lon": 37.620, "capacity": 1})
+    client.post("/couriers/2/ping", params={"lat": 55.760, "lon": 37.640, "capacity": 1})
+    client.post("/couriers/3/ping", params={"lat": 55.900, "lon": 37.900})
+
+    r = client.post("/assign/10", params={"lat": 55.751, "lon": 37.621})
+    assert r.status_code == 200
+    assert r.json()["courier_id"] == 1
+    # Курьер 1 заполнен — следующий заказ рядом достаётся курьеру 2
+    r = client.post("/assign/11", params={"lat": 55.751, "lon": 37.621})
+    assert r.json()["courier_id"] == 2
+    assert registry.get(1).load == 1
+
+    delivery = client.get("/deliveries/order/10").json()
+    r = client.put(f"/deliveries/{delivery['delivery_id']}/complete")
+    assert r.status_code == 200
+    assert r.json()["status"] == "delivered"
+    assert registry.get(1).load == 0
+
+def test_assign_without_couriers_returns_503(monkeypatch):
+    _stub_requests_if_imported(monkeypatch)
+    _fresh_registry(monkeypatch)
+    _fresh_projection(monkeypatch, 12)
+    r = client.post("/assign/12", params={"lat": 55.75, "lon": 37.62})
+    assert r.status_code == 503
+    r = client.post("/assign/12")
+    assert r.status_code == 422
+
+def test_registry_moves_courier_between_cells():
+    from couriers import CourierRegistry
+    registry = CourierRegistry(cell_size_km=0.5)
+    registry.ping(1, 55.75, 37.62)
+    registry.ping(1, 55.80, 37.70)
+    assert registry.assign(55.80, 37.70).id == 1
+    registry.set_available(1, False)
+    registry.release(1)
+    assert registry.assign(55.80, 37.70) is None
+
+def test_scheduler_batch_verifies_once_and_commits_together(monkeypatch):
+    from couriers import CourierRegistry
+    from scheduler import AssignmentScheduler, OrderNotFound, _Request
+    registry = CourierRegistry()
+    registry.ping(1, 55.750, 37.620, capacity=1)
+    registry.ping(2, 55.760, 37.640, capacity=1)
+    verified, committed = [], []
+
+    def verify(ids):
+        verified.append(ids)
+        return {20, 21}
+
+    def commit(assignments):
+        committed.append(assignments)
+        return [100 + i for i in range(len(assignments))]
+
+    scheduler = AssignmentScheduler(registry, verify, commit, app_module.logger)
+    requests_ = [_Request(order_id, 55.751, 37.621) for order_id in (20, 21, 22)]
+    scheduler.flush(requests_)
+
+    assert verified == [[20, 21, 22]]
+    assert len(committed) == 1 and len(committed[0]) == 2
+    assert {r.future.result()["courier_id"] for r in requests_[:2]} == {1, 2}
+    with pytest.raises(OrderNotFound):
+        requests_[2].future.result()
+
+def test_assign_in_batch_mode(monkeypatch):
+    _fresh_registry(monkeypatch)
+    monkeypatch.setattr(app_module, "ASSIGNMENT_MODE", "batch")
+    monkeypatch.setattr(app_module.assignment_scheduler, "registry", app_module.courier_registry)
+    _fresh_projection(monkeypatch, 30)
+    client.post("/couriers/5/ping", params={"lat": 55.75, "lon": 37.62})
+
+    r = client.post("/assign/30", params={"lat": 55.75, "lon": 37.62})
+    assert r.status_code == 200
+    assert r.json()["courier_id"] == 5
+    assert client.get("/deliveries/order/30").json()["courier_id"] == 5
+
+def test_saga_delivery_request_assigns_without_order_lookup(monkeypatch):
+    from common.messaging import encode_event
+    registry = _fresh_registry(monkeypatch)
+    monkeypatch.setattr(app_module.assignment_scheduler, "registry", registry)
+    monkeypatch.setattr(app_module.assignment_scheduler, "verify_orders",
+                        lambda ids: pytest.fail("saga requests are not verified over HTTP"))
+    events = []
+    monkeypatch.setattr(app_module, "publish_delivery_event", lambda event, data: events.append((event, data)))
+    client.post("/couriers/7/ping", params={"lat": 55.75, "lon": 37.62, "capacity": 1})
+
+    def request(order_id):
+        body = encode_event("DeliveryRequested", {"order_id": order_id, "lat": 55.75, "lon": 37.62}).encode()
+        app_module.handle_order_event("order_events", body, None)
+
+    request(50)
+    for _ in range(200):
+        if events:
+            break
+        time.sleep(0.01)
+    delivery_id = client.get("/deliveries/order/50").json()["delivery_id"]
+    assert events == [("DeliveryAssigned", {"order_id": 50, "delivery_id": delivery_id, "courier_id": 7})]
+    request(50)  # повтор команды отвечает той же доставкой
+    assert events[-1] == events[0]
+
+    # Единственный курьер занят — отказ, по которому сага запускает компенсацию
+    request(51)
+    for _ in range(200):
+        if len(events) == 3:
+            break
+        time.sleep(0.01)
+    assert events[-1] == ("DeliveryFailed", {"order_id": 51, "reason": "no courier available"})
+
+def test_order_existence_comes_from_local_projection(monkeypatch):
+    import requests
+    from common.messaging import encode_event
+    projection = _fresh_projection(monkeypatch)
+    lookups = []
+    class Lookup:
+        status_code = 200
+        def json(self): return {"orders": [{"id": 62, "status": "created"}]}
+        def raise_for_status(self): pass
+    monkeypatch.setattr(requests.Session, "get", lambda self, url, **kw: lookups.append(kw["params"]["ids"]) or Lookup())
+
+    # Общая очередь пишет таблицу, эксклюзивная — проекцию в памяти каждой реплики
+    app_module.handle_order_event("order_events", encode_event("OrderCreated", {"order_id": 60}).encode(), None)
+    app_module.handle_projection_event("order_events", encode_event("OrderStatusChanged", {
+        "order_id": 61, "status": "paid"}).encode(), None)
+    app_module.handle_order_event("order_events", encode_event("OrderStatusChanged", {
+        "order_id": 60, "status": "paid"}).encode(), None)
+    app_module.handle_order_event("order_events", encode_event("OrderCreated", {"order_id": 60}).encode(), None)
+    assert projection.status(60) == "paid" and projection.status(61) == "paid" and len(projection) == 2
+    # Пакет из /update_orders — одно событие на все заказы
+    batch = encode_event("OrderStatusesChanged", {"orders": [{"order_id": 64, "status": "paid"},
+                                                             {"order_id": 65, "status": "cancelled"}]}).encode()
+    app_module.handle_order_event("order_events", batch, None)
+    assert (projection.status(64), projection.status(65)) == ("paid", "cancelled")
+    restarted = _fresh_projection(monkeypatch)
+    app_module.handle_projection_event("order_events", batch, None)
+    assert restarted.status(65) == "cancelled"
+    monkeypatch.setattr(app_module, "order_projection", projection)
+
+    assert app_module.known_orders([60, 61]) == {60, 61}
+    # По умолчанию промах проекции и таблицы — "не найден", без запроса в order-service
+    assert app_module.known_orders([60, 62]) == {60}
+    assert lookups == []
+    # Досмотр на время заполнения проекции: один пакетный запрос за заказами старше неё
+    monkeypatch.setattr(app_module, "ORDER_LOOKUP_FALLBACK", True)
+    assert app_module.known_orders([60, 62, 63]) == {60, 62}
+    assert lookups == [[62, 63]]
+    assert projection.status(62) == "created"
+
+    # После рестарта проекция восстанавливается из known_orders
+    restarted = _fresh_projection(monkeypatch)
+    app_module.load_order_projection()
+    assert {i: restarted.status(i) for i in (60, 61, 62)} == {60: "paid", 61: None, 62: "created"}
+    assert restarted.status(10 ** 9) is None and 10 ** 9 not in restarted
+    restarted.apply(10 ** 9, "delivered")
+    assert restarted.status(10 ** 9) == "delivered"
+
+def test_scheduler_dedupes_orders_and_reports_lookup_errors(monkeypatch):
+    from couriers import CourierRegistry
+    from scheduler import AssignmentScheduler, OrderLookupFailed, _Request
+    registry = CourierRegistry()
+    registry.ping(1, 55.750, 37.620, capacity=2)
+    committed = []
+    def commit(assignments):
+        committed.append(assignments)
+        return [200 + i for i in range(len(assignments))]
+    def broken_lookup(ids):
+        raise ValueError("bad lookup response")
+
+    scheduler = AssignmentScheduler(registry, broken_lookup, commit, app_module.logger)
+    requests_ = [_Request(70, 55.75, 37.62, verified=True), _Request(70, 55.75, 37.62, verified=True),
+                 _Request(71, 55.75, 37.62)]
+    scheduler.flush(requests_)
+    assert committed == [[(70, 1)]] and registry.get(1).load == 1
+    assert requests_[0].future.result() == requests_[1].future.result() == {"delivery_id": 200, "courier_id": 1}
+    with pytest.raises(OrderLookupFailed):
+        requests_[2].future.result()
+
+def test_publish_failure_keeps_committed_batch(monkeypatch):
+    _fresh_registry(monkeypatch)
+    def broken(*a, **k):
+        raise RuntimeError("publisher down")
+    monkeypatch.setattr(app_module, "publish_delivery_status", broken)
+    assert len(app_module.commit_deliveries([(80, 1), (81, 2)])) == 2
+    assert client.get("/deliveries/order/81").json()["courier_id"] == 2
+
+def test_inflight_orders_share_one_assignment(monkeypatch):
+    from couriers import CourierRegistry
+    from scheduler import AssignmentScheduler, DeliveryAlreadyAssigned, _Request
+    registry = CourierRegistry()
+    registry.ping(1, 55.750, 37.620, capacity=3)
+    committed = []
+    def commit(assignments):
+        committed.append(assignments)
+        return [300 + i for i in range(len(assignments))]
+
+    scheduler = AssignmentScheduler(registry, set, commit, app_module.logger, window=0.2)
+    first = scheduler.submit(90, 55.75, 37.62, verified=True)
+    # Повтор DeliveryRequested, пока заказ ещё в пачке
+    assert scheduler.submit(90, 55.75, 37.62, verified=True) is first
+    assert first.result(timeout=2) == {"delivery_id": 300, "courier_id": 1}
+    assert committed == [[(90, 1)]] and not scheduler._inflight
+
+    # Другая реплика успела сохранить доставку: курьер освобождается
+    scheduler.commit = lambda assignments: [None]
+    request = _Request(91, 55.75, 37.62, verified=True)
+    scheduler.flush([request])
+    with pytest.raises(DeliveryAlreadyAssigned):
+        request.future.result()
+    assert registry.get(1).load == 1
+
+def test_duplicate_delivery_per_order_is_rejected(monkeypatch):
+    registry = _fresh_registry(monkeypatch)
+    _fresh_projection(monkeypatch, 95)
+    monkeypatch.setattr(app_module, "ASSIGNMENT_MODE", "immediate")
+    client.post("/couriers/1/ping", params={"lat": 55.75, "lon": 37.62, "capacity": 2})
+    assert client.post("/assign/95", params={"courier_id": 1}).status_code == 200
+    r = client.post("/assign/95", params={"courier_id": 1})
+    assert r.status_code == 409 and registry.get(1).load == 1
+
+    ids = app_module.commit_deliveries([(95, 1), (96, 1)])
+    assert ids[0] is None and ids[1] is not None
+    assert client.get("/deliveries/order/96").json()["delivery_id"] == ids[1]
+
+def test_only_open_orders_are_assigned_and_lookup_errors_are_5xx(monkeypatch):
+    registry = _fresh_registry(monkeypatch)
+    projection = _fresh_projection(monkeypatch, 97)
+    projection.apply(98, "cancelled")
+    projection.apply(99, "delivered")
+    client.post("/couriers/1/ping", params={"lat": 55.75, "lon": 37.62, "capacity": 5})
+    monkeypatch.setattr(app_module.assignment_scheduler, "registry", registry)
+
+    for mode in ("immediate", "batch"):
+        monkeypatch.setattr(app_module, "ASSIGNMENT_MODE", mode)
+        for order_id, status in ((98, "cancelled"), (99, "delivered")):
+            r = client.post(f"/assign/{order_id}", params={"lat": 55.75, "lon": 37.62})
+            assert r.status_code == 409 and r.json()["detail"] == f"Order is {status}"
+    assert registry.get(1).load == 0
+
+    def broken(ids):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(app_module, "known_orders", broken)
+    monkeypatch.setattr(app_module.assignment_scheduler, "verify_orders", broken)
+    for mode in ("immediate", "batch"):
+        monkeypatch.setattr(app_module, "ASSIGNMENT_MODE", mode)
+        r = client.post("/assign/97", params={"lat": 55.75, "lon": 37.62})
+        assert r.status_code == 503 and r.json()["detail"] == "Order lookup failed"
+
+def test_courier_load_comes_from_deliveries_of_all_replicas(monkeypatch):
+    registry = _fresh_registry(monkeypatch)
+    _fresh_projection(monkeypatch, 110, 111)
+    monkeypatch.setattr(app_module, "ASSIGNMENT_MODE", "immediate")
+    client.post("/couriers/1/ping", params={"lat": 55.75, "lon": 37.62, "capacity": 1})
+    # Доставку курьеру 1 назначила другая реплика
+    db = app_module.SessionLocal()
+    other = app_module.Delivery(order_id=109, courier_id=1, status="in_transit")
+    db.add(other)
+    db.commit()
+
+    assert client.post("/assign/110", params={"lat": 55.75, "lon": 37.62}).status_code == 503
+    assert registry.get(1).load == 1
+    # ...и там же её завершили: курьер снова свободен
+    other.status = "delivered"
+    db.commit()
+    db.close()
+    r = client.post("/assign/111", params={"lat": 55.75, "lon": 37.62})
+    assert r.status_code == 200 and r.json()["courier_id"] == 1
+    assert (registry.get(1).load, registry.get(1).reserved) == (1, 0)
+
+    # Несохранённый резерв переживает синхронизацию
+    registry.ping(2, 55.75, 37.62, capacity=2)
+    registry.reserve(2)
+    registry.sync_loads({})
+    assert registry.get(2).load == 1
+    registry.cancel(2)
+    assert (registry.get(2).load, registry.get(2).reserved) == (0, 0)
@@ -1,13 +1,10 @@
 import pika
 from pika.credentials import PlainCredentials
 import os
-import sys
 import time
 
-# Добавляем путь к common модулю
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-
 from common.logging_config import setup_logging
+from common.messaging import consume_span
 
 # === Настройки из переменных окружения ===
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
@@ -17,6 +14,10 @@ RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest123")
 # Настройка логирования
 logger = setup_logging("notification-service")
 
+# Fanout-обменники, события которых логируются, и прямая очередь уведомлений
+EXCHANGES = ['catalog_events', 'payment_events']
+NOTIFICATIONS_QUEUE = 'notifications'
+
 # === Функция подключения с ретраем ===
 def connect():
     credentials = PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
@@ -34,31 +35,35 @@ def connect():
             attempt += 1
             time.sleep(5)
 
-# === Подключение и создание канала ===
-connection = connect()
-channel = connection.channel()
-
-# === Настройка exchange'ов и очередей ===
-exchanges = ['catalog_events', 'payment_events']
-for ex in exchanges:
-    channel.exchange_declare(exchange=ex, exchange_type='fanout')
-    result = channel.queue_declare(queue='', exclusive=True)
-    queue_name = result.method.queue
-    channel.queue_bind(exchange=ex, queue=queue_name)
+# === Обработчики ===
+def handle_event(ch, method, properties, body):
+    # Контекст трассы публикатора восстанавливается из заголовков сообщения
+    with consume_span(method.exchange, properties):
+        logger.info(f"Received event from {method.exchange}: {body.decode()}")
 
-    # Обработчик для fanout
-    def handle_event(ch, method, properties, body, ex=ex):
-        logger.info(f"Received event from {ex}: {body.decode()}")
-
-    channel.basic_consume(queue=queue_name, on_message_callback=handle_event, auto_ack=True)
+def handle_notify(ch, method, properties, body):
+    with consume_span(NOTIFICATIONS_QUEUE, properties):
+        logger.info(f"Notification received: {body.decode()}")
 
-# Прямая очередь для уведомлений
-channel.queue_declare(queue='notifications', durable=True)
+def setup_channel(channel):
+    """Объявляет обменники и очереди и подписывает обработчики."""
+    for ex in EXCHANGES:
+        channel.exchange_declare(exchange=ex, exchange_type='fanout')
+        result = channel.queue_declare(queue='', exclusive=True)
+        queue_name = result.method.queue
+        channel.queue_bind(exchange=ex, queue=queue_name)
+        channel.basic_consume(queue=queue_name, on_message_callback=handle_event, auto_ack=True)
 
-def handle_notify(ch, method, properties, body):
-    logger.info(f"Notification received: {body.decode()}")
+    channel.queue_declare(queue=NOTIFICATIONS_QUEUE, durable=True)
+    channel.basic_consume(queue=NOTIFICATIONS_QUEUE, on_message_callback=handle_notify, auto_ack=True)
 
-channel.basic_consume(queue='notifications', on_message_callback=handle_notify, auto_ack=True)
+def main():
+    # Подключение только при запуске: импорт модуля не ходит в брокер и не ждёт его
+    connection = connect()
+    channel = connection.channel()
+    setup_channel(channel)
+    logger.info("Notification Service started, waiting for messages...")
+    channel.start_consuming()
 
-logger.info("Notification Service started, waiting for messages...")
-channel.start_consuming()
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,158 @@
+import functools
+import json
 import os
-import sys
-from fastapi import FastAPI, Depends, HTTPException
-import requests
-import pika
-from pika.credentials import PlainCredentials
-from sqlalchemy import create_engine, Column, Integer, String
+import time
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import create_engine, and_, case, or_, select, update, Column, Integer, String, Float, JSON
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 
-# Добавляем путь к common модулю
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-
 from common.logging_config import setup_logging
 from common.middleware import LoggingMiddleware, setup_metrics_endpoint
-
-app = FastAPI(title="Order Service")
+from common.compression import CompressionMiddleware
+from common.profiler import setup_profiler_endpoint
+from common.lifecycle import Lifecycle, pool_has_capacity, pool_options, warm_pool
+from common.timing import instrument_engine
+from common.responses import FastJSONResponse, FastJSONRoute
+from common.streaming import stream_json_array
+from common.auth import Authenticator, ensure_subject
+from common.http_client import ServiceClient
+from common.resilience import UpstreamUnavailable
+from common.messaging import Consumer, Publisher, decode_event, encode_event
+from common.pubsub import StatusBridge, envelope_events
+from pricing import PriceCache, UnknownDishes
+import history
+import order_status
+import saga
 
 # Настройка логирования
 logger = setup_logging("order-service")
 
+# Схема БД и прогрев соединений — в lifespan, а не при импорте
+lifecycle = Lifecycle("order-service", logger)
+
+app = FastAPI(title="Order Service", default_response_class=FastJSONResponse, lifespan=lifecycle.lifespan)
+app.router.route_class = FastJSONRoute
+
 # Добавляем middleware для логирования и метрик
+# Сжатие внутри LoggingMiddleware: его время входит в фазы запроса
+app.add_middleware(CompressionMiddleware, service_name="order-service")
 app.add_middleware(LoggingMiddleware, service_name="order-service", logger=logger)
 setup_metrics_endpoint(app, "order-service")
+setup_profiler_endpoint(app, "order-service")
+lifecycle.setup_health_endpoints(app)
 
 logger.info("Order Service started")
 
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
 USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://localhost:8000')
+CATALOG_SERVICE_URL = os.getenv('CATALOG_SERVICE_URL', 'http://localhost:8002')
 DATABASE_URL = os.getenv('DATABASE_URL', "postgresql://user:password@db:5432/userdb")
+# Сага оформления: таймаут шага до повтора, число повторов до компенсации, период проверки
+SAGA_STEP_TIMEOUT = float(os.getenv('SAGA_STEP_TIMEOUT', '30'))
+SAGA_MAX_ATTEMPTS = int(os.getenv('SAGA_MAX_ATTEMPTS', '5'))
+SAGA_RECOVERY_INTERVAL = float(os.getenv('SAGA_RECOVERY_INTERVAL', '5'))
+SAGA_RECOVERY_BATCH = int(os.getenv('SAGA_RECOVERY_BATCH', '500'))
+
+status_bridge = StatusBridge(RABBITMQ_HOST, logger)
+# Одно постоянное соединение с брокером вместо нового на каждое уведомление
+event_publisher = Publisher(RABBITMQ_HOST, logger)
+
+# Вызовы апстримов с breaker'ом, адаптивным таймаутом и ограничением параллелизма
+user_client = ServiceClient.from_env("user-service", USER_SERVICE_URL, logger, "USER_SERVICE")
+catalog_client = ServiceClient.from_env("catalog-service", CATALOG_SERVICE_URL, logger, "CATALOG_SERVICE")
+
+# Токены проверяются локально (подпись + кэш claims), без запросов к user-service
+authenticator = Authenticator(RABBITMQ_HOST, logger)
+
+# Цены блюд: локальный кэш, который поддерживается событиями catalog_events
+price_cache = PriceCache(ttl=float(os.getenv('PRICE_CACHE_TTL', '300')))
 
-engine = create_engine(DATABASE_URL)
+def handle_catalog_event(exchange: str, body: bytes, properties):
+    event, data = decode_event(body)
+    price_cache.apply_event(event, data)
+
+catalog_consumer = Consumer(RABBITMQ_HOST, ['catalog_events'], handle_catalog_event, logger)
+
+engine = create_engine(DATABASE_URL, **pool_options())
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 class Order(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer)
-    items = Column(String)
+    user_id = Column(Integer, index=True)
+    items = Column(JSON)  # [{"dish_id": 1, "qty": 2, "price": 350.0}, ...]
+    total = Column(Float)
+    address = Column(String)
+    status = Column(String)
+
+class OrderHistory(Base):
+    # Денормализованная модель чтения: заказ + оплата + доставка + хронология
+    __tablename__ = "order_history"
+    order_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, index=True)
+    items = Column(JSON)
+    total = Column(Float)
     address = Column(String)
     status = Column(String)
+    payment_status = Column(String)
+    payment_id = Column(Integer)
+    amount = Column(Float)
+    delivery_status = Column(String)
+    delivery_id = Column(Integer)
+    courier_id = Column(Integer)
+    created_at = Column(String)
+    updated_at = Column(String)
+    timeline = Column(JSON)
+
+class Saga(Base):
+    # Состояние саги create→pay→deliver: переживает рестарт, по нему повторяются зависшие шаги
+    __tablename__ = "sagas"
+    order_id = Column(Integer, primary_key=True)
+    state = Column(String, index=True)
+    pickup_lat = Column(Float)
+    pickup_lon = Column(Float)
+    payment_id = Column(Integer)
+    delivery_id = Column(Integer)
+    attempts = Column(Integer, default=0)
+    deadline = Column(Float, index=True)  # time.time(), после которого шаг повторяется
+    error = Column(String)
+
+class LineItem(BaseModel):
+    dish_id: int
+    qty: int = Field(gt=0)
+
+class Pickup(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
 
-Base.metadata.create_all(bind=engine)
+class OrderCreate(BaseModel):
+    items: List[LineItem] = Field(min_length=1)
+    # Точка забора: с ней сага после оплаты сама назначает курьера
+    pickup: Optional[Pickup] = None
+
+class StatusUpdate(BaseModel):
+    order_id: int
+    status: str = Field(min_length=1)
+    # Оптимистичная проверка: статус меняется, только если текущий равен ожидаемому
+    expected_status: Optional[str] = None
+
+class BulkStatusUpdate(BaseModel):
+    updates: List[StatusUpdate] = Field(min_length=1, max_length=int(os.getenv('BULK_UPDATE_MAX', '1000')))
+
+def order_to_dict(order: Order) -> dict:
+    return {"id": order.id, "user_id": order.user_id, "items": order.items, "total": order.total,
+            "address": order.address, "status": order.status}
+
+lifecycle.schema(Base.metadata, engine)
+# Новая реплика готова только с открытыми соединениями к БД, брокеру и апстримам
+lifecycle.warmup("database", lambda: warm_pool(engine))
+lifecycle.warmup("amqp_publisher", lambda: (event_publisher.warm(), status_bridge.publisher.warm()))
+lifecycle.warmup("upstream_connections", lambda: (user_client.warm(), catalog_client.warm()))
+lifecycle.check("db_pool", lambda: pool_has_capacity(engine))
 
 def get_db():
     db = SessionLocal()
@@ -50,53 +162,389 @@ def get_db():
         db.close()
 
 def send_notification(message: str):  # Функция для отправки в RabbitMQ
-    credentials = PlainCredentials('guest', 'guest123')
-    connection = pika.BlockingConnection(pika.ConnectionParameters(
-        host=RABBITMQ_HOST,
-        credentials=credentials
-    ))
-    channel = connection.channel()
-    channel.queue_declare(queue='notifications', durable=True)
-    channel.basic_publish(exchange='', routing_key='notifications', body=message,
-                          properties=pika.BasicProperties(delivery_mode=2))
-    connection.close()
+    event_publisher.publish('', message, routing_key='notifications')
+
+def load_history(db: Session, order_id: int):
+    # Хронология дописывается read-modify-write: строка блокируется до коммита и перечитывается,
+    # чтобы параллельный переход или событие саги не потеряли запись
+    row = db.get(OrderHistory, order_id, with_for_update=True, populate_existing=True)
+    if row is None:
+        # Заказ создан до появления модели чтения — достраиваем строку из orders
+        order = db.get(Order, order_id)
+        if order is None:
+            return None
+        row = OrderHistory()
+        history.init_history(row, order)
+        db.add(row)
+    return row
+
+def load_histories(db: Session, order_ids: List[int]) -> Dict[int, OrderHistory]:
+    """Пакетный load_history: строки модели чтения одним запросом, недостающие — из orders вторым."""
+    # Блокировки в порядке order_id, чтобы пакеты не взаимоблокировались
+    rows = {r.order_id: r for r in db.query(OrderHistory).filter(OrderHistory.order_id.in_(order_ids))
+            .order_by(OrderHistory.order_id).with_for_update().populate_existing()}
+    missing = [i for i in order_ids if i not in rows]
+    if missing:
+        for order in db.query(Order).filter(Order.id.in_(missing)):
+            row = OrderHistory()
+            history.init_history(row, order)
+            db.add(row)
+            rows[order.id] = row
+    return rows
+
+def transition_order(db: Session, order_id: int, status: str) -> Tuple[bool, Optional[str]]:
+    """
+    Переход статуса одним условным UPDATE ... WHERE status IN (допустимые источники), без read-modify-write.
+    (True, status) — применён вместе с записью в истории; иначе (False, текущий статус или None, если заказа нет).
+    """
+    statement = update(Order) \
+        .where(Order.id == order_id, Order.status.in_(order_status.sources(status))) \
+        .values(status=status) \
+        .returning(Order.id) \
+        .execution_options(synchronize_session=False)
+    if db.execute(statement).first() is None:
+        return False, db.execute(select(Order.status).where(Order.id == order_id)).scalar()
+    history.apply_order_status(load_history(db, order_id), status)
+    return True, status
+
+def publish_order_status(order_id: int, status: str):
+    status_bridge.publish(f"order:{order_id}", {"type": "order", "order_id": order_id, "status": status})
+    # order_events: по нему delivery-service ведёт свою проекцию заказов
+    publish_order_event("OrderStatusChanged", {"order_id": order_id, "status": status})
+
+def publish_order_event(event: str, data: dict):
+    # Команды саги и факты о заказах: OrderCreated, OrderStatusChanged (OrderStatusesChanged — пакетом),
+    # DeliveryRequested, OrderCancelled
+    event_publisher.publish('order_events', encode_event(event, data))
+
+def handle_history_event(exchange: str, body: bytes, properties):
+    if exchange == 'status_events':
+        # Статусы заказа проецируются в той же транзакции, что и update_order; здесь — только доставка
+        updates = [(m["order_id"], functools.partial(history.apply_delivery, data=m))
+                   for m in (e["message"] for e in envelope_events(json.loads(body)))
+                   if m.get("type") == "delivery"]
+    else:
+        event, data = decode_event(body)
+        updates = [(data.get("order_id"), functools.partial(history.apply_payment, event=event, data=data))]
+    if not updates:
+        return
+    db = SessionLocal()
+    try:
+        for order_id, apply in updates:
+            row = load_history(db, order_id)
+            if row is None:
+                logger.warning(f"History event for unknown order: {order_id}")
+                continue
+            apply(row)
+        db.commit()
+    finally:
+        db.close()
+
+# Общая durable-очередь: каждое событие проецирует ровно одна реплика
+history_consumer = Consumer(RABBITMQ_HOST, ['payment_events', 'status_events'], handle_history_event, logger,
+                            queue_name='order-history')
+
+# Статус заказа, к которому ведёт событие саги (и ручных вызовов /pay, /assign, /complete)
+SAGA_ORDER_STATUS = {
+    "PaymentCompleted": order_status.PAID,
+    "PaymentFailed": order_status.CANCELLED,
+    "DeliveryAssigned": order_status.IN_DELIVERY,
+    "DeliveryFailed": order_status.CANCELLED,
+    "DeliveryCompleted": order_status.DELIVERED,
+}
+
+def advance_saga(db: Session, order_id: int, current: str, expected_attempts: Optional[int] = None, **values) -> bool:
+    """Условный переход саги: применяется, только если она всё ещё в current (и с тем же числом попыток)."""
+    statement = update(Saga).where(Saga.order_id == order_id, Saga.state == current)
+    if expected_attempts is not None:
+        statement = statement.where(Saga.attempts == expected_attempts)
+    statement = statement.values(**values).returning(Saga.order_id).execution_options(synchronize_session=False)
+    return db.execute(statement).first() is not None
+
+def saga_command(state: str, order_id: int, row: Saga, order: Optional[Order] = None,
+                 reason: Optional[str] = None) -> Tuple[str, dict]:
+    """Команда шага state: её шлёт переход в шаг и повторяет восстановление по таймауту."""
+    if state == saga.PAYMENT_PENDING:
+        return "OrderCreated", {"order_id": order_id, "user_id": order.user_id, "amount": order.total}
+    if state == saga.DELIVERY_PENDING:
+        return "DeliveryRequested", {"order_id": order_id, "lat": row.pickup_lat, "lon": row.pickup_lon}
+    return "OrderCancelled", {"order_id": order_id, "reason": reason or row.error}
+
+def handle_saga_event(exchange: str, body: bytes, properties):
+    event, data = decode_event(body)
+    order_id = data.get("order_id")
+    target = SAGA_ORDER_STATUS.get(event)
+    if order_id is None or (target is None and event not in ("PaymentRefunded", "PaymentCancelled")):
+        return
+    command = None
+    db = SessionLocal()
+    try:
+        row = db.get(Saga, order_id)
+        state = row and saga.next_state(row.state, event)
+        if state == saga.DELIVERY_PENDING and row.pickup_lat is None:
+            # Без точки забора курьер назначается вручную через POST /assign
+            state = saga.COMPLETED
+        if state:
+            values = {"state": state, "attempts": 0,
+                      "deadline": time.time() + SAGA_STEP_TIMEOUT if state in saga.ACTIVE else None}
+            for key in ("payment_id", "delivery_id"):
+                if data.get(key) is not None:
+                    values[key] = data[key]
+            if event.endswith("Failed"):
+                values["error"] = data.get("reason") or event
+            if advance_saga(db, order_id, row.state, **values):
+                if state in saga.ACTIVE:
+                    command = saga_command(state, order_id, row, reason=values.get("error"))
+            else:
+                state = None  # Сагу уже сдвинул повтор по таймауту
+        applied, current = transition_order(db, order_id, target) if target else (False, None)
+        db.commit()
+    finally:
+        db.close()
+    if state:
+        saga.record(state)
+        logger.info(f"Saga of order {order_id} moved to {state} on {event}")
+    if target:
+        order_status.record(target, order_status.outcome(applied, current, target))
+        if applied:
+            publish_order_status(order_id, target)
+    if command:
+        publish_order_event(*command)
+
+def recover_sagas(now: Optional[float] = None) -> int:
+    """Повторяет шаги саг с истёкшим deadline; после SAGA_MAX_ATTEMPTS повторов — компенсация."""
+    now = time.time() if now is None else now
+    commands, cancelled = [], []
+    db = SessionLocal()
+    try:
+        stuck = db.query(Saga, Order).join(Order, Order.id == Saga.order_id) \
+            .filter(Saga.state.in_(saga.ACTIVE), Saga.deadline <= now) \
+            .order_by(Saga.deadline).limit(SAGA_RECOVERY_BATCH).all()
+        for row, order in stuck:
+            if row.state != saga.COMPENSATING and row.attempts >= SAGA_MAX_ATTEMPTS:
+                reason = f"{row.state} timed out"
+                if advance_saga(db, order.id, row.state, expected_attempts=row.attempts, state=saga.COMPENSATING,
+                                attempts=0, deadline=now + SAGA_STEP_TIMEOUT, error=reason):
+                    saga.record(saga.COMPENSATING)
+                    if transition_order(db, order.id, order_status.CANCELLED)[0]:
+                        cancelled.append(order.id)
+                    commands.append(saga_command(saga.COMPENSATING, order.id, row, reason=reason))
+            elif advance_saga(db, order.id, row.state, expected_attempts=row.attempts, attempts=row.attempts + 1,
+                              deadline=now + saga.backoff(SAGA_STEP_TIMEOUT, row.attempts + 1)):
+                saga.order_saga_retries_total.labels(row.state).inc()
+                commands.append(saga_command(row.state, order.id, row, order))
+        db.commit()
+    finally:
+        db.close()
+    for order_id in cancelled:
+        order_status.record(order_status.CANCELLED, "applied")
+        publish_order_status(order_id, order_status.CANCELLED)
+    for command in commands:
+        publish_order_event(*command)
+    return len(commands)
+
+# Отдельная общая очередь: шаг саги по каждому событию выполняет ровно одна реплика
+saga_consumer = Consumer(RABBITMQ_HOST, ['payment_events', 'delivery_events'], handle_saga_event, logger,
+                         queue_name='order-saga')
+saga_recovery = saga.SagaRecovery(recover_sagas, logger, interval=SAGA_RECOVERY_INTERVAL)
+lifecycle.on_shutdown(saga_recovery.stop)
+
+def start_consumers():
+    saga_recovery.start()
+    consumers = (history_consumer, saga_consumer, catalog_consumer, authenticator.consumer)
+    # Подключаются параллельно; шаг готов, только когда все подписаны на очереди
+    for consumer in consumers:
+        consumer.start()
+    for consumer in consumers:
+        consumer.warm()
+
+lifecycle.warmup("amqp_consumers", start_consumers)
+
+def fetch_prices(dish_ids: List[int]) -> Dict[int, float]:
+    # Один пакетный запрос к catalog-service на все недостающие цены
+    resp = catalog_client.get("/dishes/prices", params={"ids": dish_ids})
+    resp.raise_for_status()
+    return {d["id"]: d["price"] for d in resp.json()["prices"]}
+
+def price_line_items(items: List[LineItem]) -> tuple:
+    quantities: Dict[int, int] = {}
+    for item in items:
+        quantities[item.dish_id] = quantities.get(item.dish_id, 0) + item.qty
+    catalog_consumer.start()
+    try:
+        prices = price_cache.resolve(quantities, fetch_prices)
+    except UnknownDishes as e:
+        logger.warning(f"Unknown dishes in order: {e.dish_ids}")
+        raise HTTPException(status_code=422, detail=f"Unknown dishes: {e.dish_ids}")
+    except Exception as e:
+        logger.error(f"Failed to resolve prices: {e}")
+        raise HTTPException(status_code=503, detail="Catalog service unavailable")
+    lines = [{"dish_id": dish_id, "qty": qty, "price": prices[dish_id]} for dish_id, qty in quantities.items()]
+    total = round(sum(line["price"] * line["qty"] for line in lines), 2)
+    return lines, total
 
 @app.post("/create_order")
-def create_order(user_id: int, items: str, db: Session = Depends(get_db)):
+def create_order(user_id: int, order_in: OrderCreate, db: Session = Depends(get_db),
+                 claims: Optional[dict] = Depends(authenticator)):
+    ensure_subject(claims, user_id)
     logger.info(f"Creating order for user: {user_id}")
     # Вложенный вызов к User Service
     try:
-        user_response = requests.get(f"{USER_SERVICE_URL}/user/{user_id}")
+        user_response = user_client.get(f"/user/{user_id}", hedge=True)
         user_response.raise_for_status()
         user_data = user_response.json()
         logger.info(f"User data fetched for user: {user_id}")
+    except UpstreamUnavailable as e:
+        # Быстрый отказ: не ждём медленный user-service и не держим поток
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to fetch user data: {e}")
         raise HTTPException(status_code=404, detail="User not found or service unavailable")
     
-    order = Order(user_id=user_id, items=items, address=user_data["address"], status="created")
+    lines, total = price_line_items(order_in.items)
+    order = Order(user_id=user_id, items=lines, total=total, address=user_data["address"], status="created")
     db.add(order)
+    db.flush()
+    row = OrderHistory()
+    history.init_history(row, order)
+    db.add(row)
+    pickup = order_in.pickup
+    db.add(Saga(order_id=order.id, state=saga.PAYMENT_PENDING, attempts=0, deadline=time.time() + SAGA_STEP_TIMEOUT,
+                pickup_lat=pickup.lat if pickup else None, pickup_lon=pickup.lon if pickup else None))
     db.commit()
     db.refresh(order)
-    send_notification(f"Order created for user {user_id}")  # Асинхронное уведомление
+    # Сага: оплата и доставка идут событиями, запрос их не ждёт
+    saga.record(saga.PAYMENT_PENDING)
+    publish_order_event("OrderCreated", {"order_id": order.id, "user_id": user_id, "amount": total})
+    send_notification(f"Order created for user {user_id}, total {total}")  # Асинхронное уведомление
     logger.info(f"Order created successfully: {order.id}")
-    return {"message": "Order created", "order": {"id": order.id, "user_id": order.user_id, "items": order.items, "address": order.address, "status": order.status}}
+    return {"message": "Order created", "order": order_to_dict(order)}
+
+@app.get("/orders/lookup")
+def lookup_orders(ids: List[int] = Query(...), db: Session = Depends(get_db)):
+    # Пакетная проверка заказов: существование (delivery-service), сумма к оплате (payment-service)
+    orders = db.query(Order.id, Order.status, Order.total).filter(Order.id.in_(ids)).all()
+    logger.info(f"Looked up {len(ids)} orders, found {len(orders)}")
+    return {"orders": [{"id": o.id, "status": o.status, "total": o.total} for o in orders]}
+
+def order_summary(o) -> dict:
+    return {"id": o.id, "items": o.items, "total": o.total, "status": o.status}
 
 @app.get("/orders/{user_id}")
-def get_orders(user_id: int, db: Session = Depends(get_db)):
+def get_orders(user_id: int, stream: bool = False, db: Session = Depends(get_db),
+               claims: Optional[dict] = Depends(authenticator)):
+    ensure_subject(claims, user_id)
     logger.info(f"Fetching orders for user: {user_id}")
-    orders = db.query(Order).filter(Order.user_id == user_id).all()
+    statement = select(Order.id, Order.items, Order.total, Order.status).where(Order.user_id == user_id) \
+        .order_by(Order.id)
+    if stream:
+        # Выгрузка без материализации: строки читаются и отдаются пачками
+        return stream_json_array(SessionLocal, statement, order_summary, key="orders")
+    orders = db.execute(statement).all()
     logger.info(f"Found {len(orders)} orders for user {user_id}")
-    return {"orders": [{"id": o.id, "items": o.items, "status": o.status} for o in orders]}
+    return {"orders": [order_summary(o) for o in orders]}
+
+@app.get("/history/{user_id}")
+def get_order_history(user_id: int, db: Session = Depends(get_db), claims: Optional[dict] = Depends(authenticator)):
+    ensure_subject(claims, user_id)
+    # Полная история заказов пользователя из модели чтения, без обхода других сервисов
+    logger.info(f"Fetching order history for user: {user_id}")
+    rows = db.query(OrderHistory).filter(OrderHistory.user_id == user_id).order_by(OrderHistory.order_id.desc()).all()
+    logger.info(f"Found {len(rows)} history records for user {user_id}")
+    return {"orders": [history.history_to_dict(r) for r in rows]}
+
+@app.get("/history/order/{order_id}")
+def get_order_timeline(order_id: int, db: Session = Depends(get_db), claims: Optional[dict] = Depends(authenticator)):
+    logger.info(f"Fetching order timeline: {order_id}")
+    row = db.get(OrderHistory, order_id)
+    if not row:
+        logger.warning(f"Order history not found: {order_id}")
+        raise HTTPException(status_code=404, detail="Order not found")
+    ensure_subject(claims, row.user_id)
+    return history.history_to_dict(row)
+
+def ensure_known_status(status: str):
+    if status not in order_status.TRANSITIONS:
+        raise HTTPException(status_code=422, detail=f"Unknown order status: {status}")
+
 
 @app.put("/update_order/{order_id}")
 def update_order(order_id: int, status: str, db: Session = Depends(get_db)):
     logger.info(f"Updating order {order_id} to status: {status}")
-    order = db.query(Order).filter(Order.id == order_id).first()
-    if not order:
+    ensure_known_status(status)
+    applied, current = transition_order(db, order_id, status)
+    result = order_status.outcome(applied, current, status)
+    order_status.record(status, result)
+    if result == "not_found":
         logger.warning(f"Order not found: {order_id}")
         raise HTTPException(status_code=404, detail="Order not found")
-    order.status = status
-    db.commit()
-    logger.info(f"Order {order_id} updated successfully to {status}")
+    if result == "rejected":
+        logger.warning(f"Rejected status change of order {order_id}: {current} -> {status}")
+        raise HTTPException(status_code=409, detail=f"Cannot change order {order_id} status from {current} to {status}")
+    if applied:
+        db.commit()
+        publish_order_status(order_id, status)
+        logger.info(f"Order {order_id} updated successfully to {status}")
+    # Повтор того же перехода — не ошибка и не новое событие
     return {"message": f"Order {order_id} updated to {status}"}
+
+@app.put("/update_orders")
+def update_orders(body: BulkStatusUpdate, db: Session = Depends(get_db)):
+    # Пакетная смена статусов одним UPDATE ... CASE с проверкой допустимости перехода,
+    # expected_status и одним коммитом
+    updates = {u.order_id: u for u in body.updates}
+    if len(updates) != len(body.updates):
+        raise HTTPException(status_code=422, detail="Duplicate order_id in updates")
+    for u in body.updates:
+        ensure_known_status(u.status)
+    logger.info(f"Bulk updating status of {len(updates)} orders")
+    by_target: Dict[str, List[int]] = {}
+    for order_id, u in updates.items():
+        by_target.setdefault(u.status, []).append(order_id)
+    allowed = or_(*(and_(Order.id.in_(ids), Order.status.in_(order_status.sources(target)))
+                    for target, ids in by_target.items()))
+    expected = {i: u.expected_status for i, u in updates.items() if u.expected_status is not None}
+    statement = update(Order).where(Order.id.in_(updates), allowed) \
+        .values(status=case({i: u.status for i, u in updates.items()}, value=Order.id)) \
+        .returning(Order.id, Order.status) \
+        .execution_options(synchronize_session=False)
+    if expected:
+        statement = statement.where(Order.status == case(expected, value=Order.id, else_=Order.status))
+    updated = dict(db.execute(statement).all())
+
+    # Почему не обновились остальные: заказа нет, переход недопустим или статус не совпал с ожидаемым
+    missing = [i for i in updates if i not in updated]
+    current = dict(db.execute(select(Order.id, Order.status).where(Order.id.in_(missing))).all()) if missing else {}
+    rows = load_histories(db, list(updated))
+    for order_id, status in updated.items():
+        history.apply_order_status(rows[order_id], status)
+    db.commit()
+
+    status_bridge.publish_batch([(f"order:{i}", {"type": "order", "order_id": i, "status": s})
+                                 for i, s in updated.items()])
+    if updated:
+        publish_order_event("OrderStatusesChanged",
+                            {"orders": [{"order_id": i, "status": s} for i, s in updated.items()]})
+    results = []
+    for order_id, u in updates.items():
+        if order_id in updated:
+            order_status.record(u.status, "applied")
+            results.append({"order_id": order_id, "outcome": "updated", "status": updated[order_id]})
+        elif current.get(order_id) == u.status:
+            order_status.record(u.status, "unchanged")
+            results.append({"order_id": order_id, "outcome": "unchanged", "status": u.status})
+        elif order_id in current:
+            order_status.record(u.status, "rejected")
+            results.append({"order_id": order_id, "outcome": "conflict", "status": current[order_id]})
+        else:
+            order_status.record(u.status, "not_found")
+            results.append({"order_id": order_id, "outcome": "not_found"})
+    logger.info(f"Bulk update: {len(updated)} updated, {len(current)} conflicts, "
+                f"{len(missing) - len(current)} not found")
+    return {"updated": len(updated), "results": results}
+
+@app.get("/orders/{order_id}/stream")
+async def stream_order_status(order_id: int):
+    # SSE: статусы заказа и доставки по мере изменения, без опроса
+    logger.info(f"Status stream opened for order: {order_id}")
+    return status_bridge.stream(f"order:{order_id}")
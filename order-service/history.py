@@ -0,0 +1,86 @@
+"""
+Проекция истории заказов (read model).
+
+Функции применяют события к строке order_history: текущие статусы заказа,
+оплаты и доставки плюс хронология. Повторно доставленные события не
+дублируют записи в хронологии.
+"""
+from datetime import datetime
+from typing import Optional
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _append(row, event: str, **details):
+    entry = {"at": _now(), "event": event}
+    entry.update(details)
+    # JSON-колонку нужно переприсвоить, иначе SQLAlchemy не заметит изменение
+    row.timeline = list(row.timeline or []) + [entry]
+    row.updated_at = entry["at"]
+
+
+def init_history(row, order):
+    row.order_id = order.id
+    row.user_id = order.user_id
+    row.items = order.items
+    row.total = order.total
+    row.address = order.address
+    row.status = order.status
+    row.created_at = _now()
+    row.timeline = []
+    _append(row, "OrderCreated", status=order.status)
+
+
+def apply_order_status(row, status: str) -> bool:
+    if row.status == status:
+        return False
+    row.status = status
+    _append(row, "OrderStatusChanged", status=status)
+    return True
+
+
+def apply_payment(row, event: str, data: dict) -> bool:
+    status = {"PaymentCompleted": "completed", "PaymentFailed": "failed",
+              "PaymentRefunded": "refunded", "PaymentCancelled": "cancelled"}.get(event)
+    if status is None:
+        return False
+    payment_id: Optional[int] = data.get("payment_id")
+    if row.payment_status == status and row.payment_id == payment_id:
+        return False
+    row.payment_status = status
+    row.payment_id = payment_id
+    # У отменённого до списания платежа сумма нулевая — прежнюю не затираем
+    amount = data.get("amount") if status != "cancelled" else None
+    if amount is not None:
+        row.amount = amount
+    _append(row, event, payment_id=payment_id, amount=amount)
+    return True
+
+
+def apply_delivery(row, data: dict) -> bool:
+    status = data.get("status")
+    if row.delivery_status == status and row.delivery_id == data.get("delivery_id"):
+        return False
+    row.delivery_status = status
+    row.delivery_id = data.get("delivery_id")
+    row.courier_id = data.get("courier_id")
+    _append(row, "DeliveryStatusChanged", status=status, courier_id=row.courier_id)
+    return True
+
+
+def history_to_dict(row) -> dict:
+    return {
+        "order_id": row.order_id,
+        "user_id": row.user_id,
+        "items": row.items,
+        "total": row.total,
+        "address": row.address,
+        "status": row.status,
+        "payment": {"status": row.payment_status, "payment_id": row.payment_id, "amount": row.amount},
+        "delivery": {"status": row.delivery_status, "delivery_id": row.delivery_id, "courier_id": row.courier_id},
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+        "timeline": row.timeline or [],
+    }
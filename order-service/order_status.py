@@ -0,0 +1,66 @@
+"""
+Жизненный цикл заказа: допустимые переходы статусов.
+
+    created ──► paid ──► in_delivery ──► delivered
+       │          │
+       └──────────┴──► cancelled
+
+Переход применяется одним условным UPDATE ... WHERE id = ? AND status IN
+(sources(target)) RETURNING: без чтения строки и без блокировок в Python.
+При гонке двух переходов одного заказа второй UPDATE не находит строку в
+допустимом статусе и получает отказ, а не перезаписывает первый.
+"""
+from typing import Dict, FrozenSet, Tuple
+
+from prometheus_client import Counter
+
+CREATED = "created"
+PAID = "paid"
+IN_DELIVERY = "in_delivery"
+DELIVERED = "delivered"
+CANCELLED = "cancelled"
+
+TRANSITIONS: Dict[str, FrozenSet[str]] = {
+    CREATED: frozenset({PAID, CANCELLED}),
+    PAID: frozenset({IN_DELIVERY, CANCELLED}),
+    IN_DELIVERY: frozenset({DELIVERED}),
+    DELIVERED: frozenset(),
+    CANCELLED: frozenset(),
+}
+
+STATUSES = tuple(TRANSITIONS)
+
+# applied — переход выполнен; unchanged — заказ уже в целевом статусе (повтор);
+# rejected — недопустимый переход или проигранная гонка; not_found — нет заказа
+order_status_transitions_total = Counter(
+    'order_status_transitions_total',
+    'Order status transition attempts',
+    ['to_status', 'result']
+)
+
+_SOURCES: Dict[str, Tuple[str, ...]] = {
+    target: tuple(source for source, targets in TRANSITIONS.items() if target in targets) for target in TRANSITIONS
+}
+
+
+def sources(target: str) -> Tuple[str, ...]:
+    """Статусы, из которых допустим переход в target."""
+    return _SOURCES[target]
+
+
+def can_transition(current: str, target: str) -> bool:
+    return target in TRANSITIONS.get(current, ())
+
+
+def record(target: str, result: str, count: int = 1):
+    if count:
+        order_status_transitions_total.labels(target, result).inc(count)
+
+
+def outcome(applied: bool, current, target: str) -> str:
+    """Результат условного перехода для метрики: current — статус после неудачного UPDATE (None — нет заказа)."""
+    if applied:
+        return "applied"
+    if current is None:
+        return "not_found"
+    return "unchanged" if current == target else "rejected"
@@ -0,0 +1,67 @@
+"""
+Локальный кэш цен блюд из catalog-service.
+
+Кэш обновляется событиями catalog_events (DishCreated, DishPriceChanged);
+TTL страхует от пропущенных событий, пока потребитель был отключён.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class UnknownDishes(Exception):
+    def __init__(self, dish_ids: List[int]):
+        super().__init__(f"Unknown dishes: {dish_ids}")
+        self.dish_ids = dish_ids
+
+
+class PriceCache:
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._prices: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def put(self, dish_id: int, price: float, now: Optional[float] = None):
+        expires = (time.monotonic() if now is None else now) + self.ttl
+        with self._lock:
+            self._prices[dish_id] = (price, expires)
+
+    def get(self, dish_id: int, now: Optional[float] = None) -> Optional[float]:
+        entry = self._prices.get(dish_id)
+        if entry is None or entry[1] < (time.monotonic() if now is None else now):
+            return None
+        return entry[0]
+
+    def apply_event(self, event: str, data: dict):
+        """Применяет событие каталога; остальные события игнорируются."""
+        if event in ("DishCreated", "DishPriceChanged") and data.get("price") is not None:
+            self.put(int(data["id"]), float(data["price"]))
+        elif event == "DishDeleted":
+            with self._lock:
+                self._prices.pop(int(data["id"]), None)
+
+    def resolve(self, dish_ids: Iterable[int],
+                fetch: Callable[[List[int]], Dict[int, float]]) -> Dict[int, float]:
+        """
+        Цены для всех dish_ids. Всё, чего нет в кэше, запрашивается одним
+        вызовом fetch, сколько бы позиций ни было в заказе.
+        """
+        prices, missing = {}, []
+        for dish_id in dict.fromkeys(dish_ids):
+            price = self.get(dish_id)
+            if price is None:
+                missing.append(dish_id)
+            else:
+                prices[dish_id] = price
+        if missing:
+            fetched = fetch(missing)
+            for dish_id, price in fetched.items():
+                self.put(dish_id, price)
+            prices.update(fetched)
+            unknown = [dish_id for dish_id in missing if dish_id not in fetched]
+            if unknown:
+                raise UnknownDishes(unknown)
+        return prices
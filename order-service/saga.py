@@ -0,0 +1,107 @@
+"""
+Сага оформления заказа: создание → оплата → назначение доставки.
+
+Шаги идут через брокер, ни один HTTP-запрос не ждёт другой сервис:
+
+    create_order ── OrderCreated (order_events) ──► payment-service
+        ◄── PaymentCompleted / PaymentFailed (payment_events)
+    ── DeliveryRequested (order_events) ──► delivery-service
+        ◄── DeliveryAssigned / DeliveryFailed (delivery_events)
+
+Компенсация: при отказе доставки или исчерпании повторов шага заказ
+отменяется и публикуется OrderCancelled; payment-service возвращает деньги
+(PaymentRefunded) или отменяет так и не проведённый платёж (PaymentCancelled).
+
+Состояние саги хранится в таблице sagas. Шаг, на который не пришёл ответ до
+deadline, повторяется (команды идемпотентны по order_id) с экспоненциальной
+задержкой; после SAGA_MAX_ATTEMPTS — компенсация. Переходы выполняются
+условным UPDATE ... WHERE state = ?, поэтому событие и повтор по таймауту
+не перезаписывают друг друга.
+"""
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter
+
+PAYMENT_PENDING = "payment_pending"
+DELIVERY_PENDING = "delivery_pending"
+COMPLETED = "completed"
+COMPENSATING = "compensating"
+COMPENSATED = "compensated"
+FAILED = "failed"
+
+# Состояния, в которых сага ждёт ответа и подлежит повтору по таймауту
+ACTIVE = (PAYMENT_PENDING, DELIVERY_PENDING, COMPENSATING)
+
+# (состояние, событие) -> следующее состояние
+STEPS: Dict[Tuple[str, str], str] = {
+    (PAYMENT_PENDING, "PaymentCompleted"): DELIVERY_PENDING,
+    (PAYMENT_PENDING, "PaymentFailed"): FAILED,
+    (DELIVERY_PENDING, "DeliveryAssigned"): COMPLETED,
+    (DELIVERY_PENDING, "DeliveryFailed"): COMPENSATING,
+    (COMPENSATING, "PaymentRefunded"): COMPENSATED,
+    (COMPENSATING, "PaymentCancelled"): COMPENSATED,
+}
+
+# Команда, которую повторяет шаг при таймауте
+COMMANDS = {
+    PAYMENT_PENDING: "OrderCreated",
+    DELIVERY_PENDING: "DeliveryRequested",
+    COMPENSATING: "OrderCancelled",
+}
+
+order_saga_transitions_total = Counter(
+    'order_saga_transitions_total',
+    'Order saga state transitions',
+    ['state']
+)
+
+order_saga_retries_total = Counter(
+    'order_saga_retries_total',
+    'Saga steps re-sent after a timeout',
+    ['state']
+)
+
+
+def next_state(state: str, event: str) -> Optional[str]:
+    return STEPS.get((state, event))
+
+
+def backoff(timeout: float, attempts: int, cap: float = 300.0) -> float:
+    """Задержка до следующего повтора шага: timeout * 2^attempts, не больше cap."""
+    return min(timeout * 2 ** attempts, cap)
+
+
+def record(state: str):
+    order_saga_transitions_total.labels(state).inc()
+
+
+class SagaRecovery:
+    """Фоновый поток, который раз в interval секунд повторяет зависшие шаги саг (recover())."""
+
+    def __init__(self, recover: Callable[[], int], logger: logging.Logger, interval: float = 5.0):
+        self.recover = recover
+        self.logger = logger
+        self.interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="saga-recovery", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                resent = self.recover()
+                if resent:
+                    self.logger.info(f"Saga recovery re-sent {resent} steps")
+            except Exception:
+                self.logger.exception("Saga recovery failed")
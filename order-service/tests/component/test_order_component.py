@@ -65,27 +65,30 @@ def clean_db(_init_app):
 def mock_external_services(monkeypatch):
     import requests
     class MockUserResponse:
+        status_code = 200
         def json(self):
             return {"username": "testuser", "address": "123 Test Street"}
         def raise_for_status(self):
             pass
     
-    monkeypatch.setattr(requests, "get", lambda url, **kwargs: MockUserResponse())
+    monkeypatch.setattr(requests.Session, "get", lambda self, url, **kwargs: MockUserResponse())
     
     if hasattr(app_module, "send_notification"):
         monkeypatch.setattr(app_module, "send_notification", lambda m: None)
 
+    prices = {10: 300.0, 11: 150.0, 12: 75.5}
+    monkeypatch.setattr(app_module, "fetch_prices", lambda ids: {i: prices[i] for i in ids if i in prices})
+    monkeypatch.setattr(app_module.catalog_consumer, "start", lambda: None)
+
 
 def test_create_order_and_get_orders_component(_init_app):
     user_id = 1
-    items = "Product A:2, Product B:1"
+    items = [{"dish_id": 10, "qty": 2}, {"dish_id": 11, "qty": 1}]
     
     response = client.post(
         "/create_order",
-        params={
-            "user_id": user_id,
-            "items": items
-        }
+        params={"user_id": user_id},
+        json={"items": items}
     )
     
     assert response.status_code == 200, f"Ожидался статус 200, получен {response.status_code}"
@@ -103,7 +106,8 @@ def test_create_order_and_get_orders_component(_init_app):
     
     order_id = order["id"]
     assert order["user_id"] == user_id
-    assert order["items"] == items
+    assert [(i["dish_id"], i["qty"]) for i in order["items"]] == [(10, 2), (11, 1)]
+    assert order["total"] == 750.0
     assert order["status"] == "created"
     assert order["address"] == "123 Test Street"
     
@@ -122,27 +126,26 @@ def test_create_order_and_get_orders_component(_init_app):
             break
     
     assert found_order is not None, "Созданный заказ не найден в списке заказов"
-    assert found_order["items"] == items
+    assert found_order["items"] == order["items"]
+    assert found_order["total"] == 750.0
     assert found_order["status"] == "created"
 
 
 def test_create_order_and_update_status_component(_init_app):
     user_id = 2
-    items = "Product C:3"
+    items = [{"dish_id": 12, "qty": 3}]
     
     response = client.post(
         "/create_order",
-        params={
-            "user_id": user_id,
-            "items": items
-        }
+        params={"user_id": user_id},
+        json={"items": items}
     )
     assert response.status_code == 200
     order_data = response.json()
     order_id = order_data["order"]["id"]
     assert order_data["order"]["status"] == "created"
     
-    new_status = "processing"
+    new_status = "paid"
     response = client.put(
         f"/update_order/{order_id}",
         params={"status": new_status}
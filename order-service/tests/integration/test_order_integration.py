@@ -24,12 +24,15 @@ def clean_db():
 def test_create_persists_in_db(monkeypatch):
     import requests
     class OK:
+        status_code = 200
         def json(self): return {"address": "Real DB Addr"}
         def raise_for_status(self): pass
-    monkeypatch.setattr(requests, "get", lambda url: OK())
+    monkeypatch.setattr(requests.Session, "get", lambda self, url, **kw: OK())
     monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    monkeypatch.setattr(app_module, "fetch_prices", lambda ids: {i: 100.0 for i in ids})
+    monkeypatch.setattr(app_module.catalog_consumer, "start", lambda: None)
 
-    r = client.post("/create_order", params={"user_id": 5, "items": "ABC:2"})
+    r = client.post("/create_order", params={"user_id": 5}, json={"items": [{"dish_id": 1, "qty": 2}]})
     assert r.status_code == 200
     oid = r.json()["order"]["id"]
 
@@ -39,5 +42,6 @@ def test_create_persists_in_db(monkeypatch):
         assert row is not None
         assert row.user_id == 5
         assert row.status == "created"
+        assert row.total == 200.0
     finally:
         s.close()
@@ -0,0 +1,376 @@
+import logging
+import pytest
+from fastapi.testclient import TestClient
+
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+
+logger = logging.getLogger("common-tests")
+
+def test_circuit_breaker_half_open_and_adaptive_timeout():
+    from common.resilience import AdaptiveTimeout, CircuitBreaker
+    breaker = CircuitBreaker("cb-test", min_calls=2, open_seconds=10, half_open_calls=2)
+    breaker.record_success()
+    breaker.record_failure(now=0)
+    breaker.record_failure(now=0)
+    assert breaker.state == "open" and not breaker.allow(now=5)
+    assert breaker.allow(now=11) and breaker.allow(now=11) and not breaker.allow(now=11)
+    breaker.record_success()
+    breaker.record_failure(now=12)
+    assert breaker.state == "open"
+    assert breaker.allow(now=23) and breaker.allow(now=23)
+    breaker.record_success()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    timeout = AdaptiveTimeout("at-test", multiplier=2, minimum=0.01, maximum=5, warmup=10, recompute_every=10)
+    assert timeout.current == 5
+    for _ in range(100):
+        timeout.observe(0.02)
+    assert timeout.current == 0.04
+    # Апстрим замедлился: таймауты сами поднимают таймаут вместо вечного отказа
+    timeout.observe_timeout()
+    timeout.observe_timeout()
+    assert timeout.current == 0.16
+    for _ in range(10):
+        timeout.observe_timeout()
+    assert timeout.current == 5
+
+    # Вызов без исхода (неожиданное исключение) возвращает пробный слот
+    breaker = CircuitBreaker("cb-probe", min_calls=1, open_seconds=1, half_open_calls=1)
+    breaker.record_failure(now=0)
+    assert breaker.allow(now=2) and not breaker.allow(now=2)
+    breaker.release_probe()
+    assert breaker.allow(now=2)
+
+def test_hedged_get_takes_first_response_within_budget(monkeypatch):
+    import time
+    import requests
+    from common.http_client import ServiceClient
+    class Resp:
+        status_code = 200
+        def __init__(self, url): self.url = url
+        def close(self): pass
+    def get(self, url, **kw):
+        if url.startswith("http://slow"):
+            time.sleep(0.3)
+        return Resp(url)
+    monkeypatch.setattr(requests.Session, "get", get)
+    client_ = ServiceClient("hedge-test", "http://slow,http://fast", logger,
+                            hedge_budget=0.5, hedge_burst=1)
+    client_.timeout.hedge_delay = 0.02
+    slow, fast = client_.resolver.endpoints
+    pick = client_.resolver.pick
+    # Основной запрос всегда на медленную реплику, дубль — на другую
+    monkeypatch.setattr(client_.resolver, "pick", lambda exclude=None: pick(exclude=exclude or fast))
+
+    start = time.perf_counter()
+    assert client_.get("/user/1", hedge=True).url == "http://fast/user/1"
+    assert time.perf_counter() - start < 0.2
+    # Бюджет исчерпан (0.5 < 1): дубль не отправляется, ждём основной ответ
+    assert client_.get("/user/1", hedge=True).url == "http://slow/user/1"
+    # Без hedge запросы не дублируются вовсе
+    assert client_.get("/user/1").url == "http://slow/user/1"
+
+def test_resolver_spreads_load_and_ejects_failing_replica(monkeypatch):
+    import socket
+    from common.discovery import Resolver
+    monkeypatch.setattr(socket, "getaddrinfo", lambda host, port, **kw: [
+        (None, None, None, "", ("10.0.0.1", port)), (None, None, None, "", ("10.0.0.2", port)),
+        (None, None, None, "", ("10.0.0.3", port))])
+    resolver = Resolver("users-test", "dns+http://user-service:8000", eject_after=3, eject_seconds=60)
+    assert sorted(e.url for e in resolver.endpoints) == [
+        "http://10.0.0.1:8000", "http://10.0.0.2:8000", "http://10.0.0.3:8000"]
+
+    counts = {e.url: 0 for e in resolver.endpoints}
+    inflight = []
+    for _ in range(300):
+        endpoint = resolver.pick()
+        counts[endpoint.url] += 1
+        inflight.append(endpoint)
+        if len(inflight) > 6:
+            resolver.release(inflight.pop(0), 0.01, ok=True)
+    assert max(counts.values()) - min(counts.values()) < 60
+
+    for endpoint in inflight:
+        resolver.release(endpoint, 0.01, ok=True)
+    bad = resolver.endpoints[0]
+    for _ in range(3):
+        bad.inflight += 1
+        resolver.release(bad, 0.01, ok=False)
+    assert all(resolver.pick() is not bad for _ in range(50))
+
+def test_lifespan_creates_schema_and_gates_readiness(monkeypatch):
+    import logging, threading
+    from fastapi import FastAPI
+    from sqlalchemy import Column, Integer, MetaData, Table, create_engine, inspect
+    from sqlalchemy.pool import StaticPool
+    from common.lifecycle import Lifecycle
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    lifecycle = Lifecycle("demo", logging.getLogger("demo"), retry_delay=0.01)
+    metadata = MetaData()
+    Table("orders", metadata, Column("id", Integer, primary_key=True))
+    lifecycle.schema(metadata, engine)
+    release, attempts = threading.Event(), []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("broker not ready")
+        release.wait(5)
+    lifecycle.warmup("amqp", flaky)
+    demo = FastAPI(lifespan=lifecycle.lifespan)
+    lifecycle.setup_health_endpoints(demo)
+
+    monkeypatch.setenv("DB_SCHEMA_MODE", "startup")
+    assert "orders" not in inspect(engine).get_table_names()
+    with TestClient(demo) as c:
+        assert "orders" in inspect(engine).get_table_names()
+        assert c.get("/health/live").status_code == 200
+        r = c.get("/health/ready")
+        assert r.status_code == 503 and r.json()["checks"]["schema"] == "ok"
+        release.set()
+        for _ in range(200):
+            if c.get("/health/ready").status_code == 200:
+                break
+            threading.Event().wait(0.01)
+        assert c.get("/health/ready").json() == {"status": "ready", "checks": {"schema": "ok", "amqp": "ok"}}
+    assert len(attempts) == 2
+
+def test_warm_pool_and_upstreams_gate_readiness(tmp_path):
+    import logging, threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from fastapi import FastAPI
+    from sqlalchemy import create_engine
+    from common.http_client import ServiceClient
+    from common.lifecycle import Lifecycle, pool_has_capacity, warm_pool
+    engine = create_engine(f"sqlite:///{tmp_path}/pool.db", pool_size=2, max_overflow=0, pool_timeout=0.1)
+    warm_pool(engine, 5)
+    assert engine.pool.checkedin() == 2
+
+    lifecycle = Lifecycle("demo", logging.getLogger("demo"))
+    lifecycle.check("db_pool", lambda: pool_has_capacity(engine))
+    demo = FastAPI()
+    lifecycle.setup_health_endpoints(demo)
+    c = TestClient(demo)
+    assert c.get("/health/ready").status_code == 200
+    held = [engine.connect() for _ in range(2)]
+    assert c.get("/health/ready").json() == {"status": "not_ready", "checks": {"db_pool": "failed"}}
+    for connection in held:
+        connection.close()
+    assert c.get("/health/ready").status_code == 200
+
+    peers = set()
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_GET(self):
+            peers.add(self.client_address[1])
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+        def log_message(self, *a): pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        upstream = ServiceClient("warm-test", f"http://127.0.0.1:{server.server_port}", logging.getLogger("demo"))
+        assert upstream.warm(connections=2) == 2
+        warmed = set(peers)
+        for _ in range(3):
+            assert upstream.get("/user/1").status_code == 200
+        # Запросы после прогрева идут по уже открытым keep-alive соединениям
+        assert len(warmed) == 2 and peers == warmed
+        assert ServiceClient("down", "http://127.0.0.1:9", logging.getLogger("demo")).warm() == 0
+    finally:
+        server.shutdown()
+
+def test_compression_negotiates_caches_and_skips_streams():
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from prometheus_client import REGISTRY
+    from common.compression import CompressionMiddleware, choose_encoding
+    assert choose_encoding("gzip;q=0.5, br", ["zstd", "br", "gzip"]) == "br"
+    assert choose_encoding("*;q=0.1, gzip;q=0", ["gzip"]) is None
+    assert choose_encoding("identity", ["gzip"]) is None
+
+    demo = FastAPI()
+    demo.add_middleware(CompressionMiddleware, service_name="demo-gzip", minimum_size=500, encodings="gzip")
+    menu = [{"id": i, "name": f"Dish {i % 10}", "price": 100.0} for i in range(200)]
+    @demo.get("/menu")
+    def get_menu():
+        return menu
+    @demo.get("/small")
+    def small():
+        return {"ok": True}
+    @demo.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"data: " + b"x" * 1000 + b"\n\n"] * 2), media_type="text/event-stream")
+    demo_client = TestClient(demo)
+    def sample(name, labels):
+        return REGISTRY.get_sample_value(name, {"service": "demo-gzip", **labels}) or 0
+
+    for _ in range(3):
+        r = demo_client.get("/menu", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip" and "Accept-Encoding" in r.headers["vary"]
+        assert r.json() == menu
+    # Меню сжато один раз, остальные ответы — из кэша сжатых вариантов
+    assert sample("http_compression_responses_total", {"encoding": "gzip", "result": "compressed"}) == 1
+    assert sample("http_compression_responses_total", {"encoding": "gzip", "result": "cache_hit"}) == 2
+    assert sample("http_compression_saved_bytes_total", {"encoding": "gzip"}) > 0
+    assert sample("http_compression_cpu_seconds_total", {"encoding": "gzip"}) > 0
+
+    assert "content-encoding" not in demo_client.get("/menu", headers={"Accept-Encoding": "identity"}).headers
+    assert "content-encoding" not in demo_client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    r = demo_client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers and r.text.count("data: ") == 2
+
+def test_consumer_acks_only_after_handler_succeeds():
+    from types import SimpleNamespace
+    from common.messaging import Consumer
+    calls = []
+    class Channel:
+        connection = SimpleNamespace(sleep=lambda seconds: calls.append(("sleep", seconds)))
+        def basic_ack(self, delivery_tag): calls.append(("ack", delivery_tag))
+        def basic_publish(self, exchange, routing_key, body, properties):
+            calls.append(("publish", routing_key, properties.headers))
+    failures = []
+    def handler(exchange, body, properties):
+        failures.append(exchange)
+        if len(failures) < 3:
+            raise RuntimeError("db unavailable")
+    consumer = Consumer("localhost", ["payment_events"], handler, logger,
+                        queue_name="order-history", max_attempts=2)
+    method = SimpleNamespace(exchange="payment_events", routing_key="", delivery_tag=1)
+
+    consumer._on_message(Channel(), method, SimpleNamespace(headers=None), b"PaymentCompleted:{}")
+    assert calls == [("sleep", 0.5), ("publish", "order-history", {"x-attempts": 1, "x-exchange": "payment_events"}),
+                     ("ack", 1)]
+    # Повтор приходит из default exchange, но обработчик видит исходный exchange
+    retry = SimpleNamespace(exchange="", routing_key="order-history", delivery_tag=2)
+    consumer._on_message(Channel(), retry, SimpleNamespace(headers=calls[1][2]), b"PaymentCompleted:{}")
+    assert calls[-2:] == [("publish", "order-history.dead", {"x-attempts": 2, "x-exchange": "payment_events"}),
+                          ("ack", 2)]
+    calls.clear()
+    consumer._on_message(Channel(), method, SimpleNamespace(headers=None), b"PaymentCompleted:{}")
+    assert calls == [("ack", 1)] and failures == ["payment_events"] * 3
+
+def test_cancelled_hedge_does_not_leak_inflight():
+    from concurrent.futures import Future
+    from common.http_client import ServiceClient
+    client_ = ServiceClient("hedge-leak", "http://127.0.0.1:1", logger)
+    endpoint = client_.resolver.pick()
+    assert endpoint.inflight == 1
+    client_._abandon(Future(), endpoint)  # не начатый запрос отменяется
+    assert endpoint.inflight == 0
+
+def test_consumer_warm_waits_for_subscription(monkeypatch):
+    import threading
+    from types import SimpleNamespace
+    from common import messaging
+    consumer = messaging.Consumer("localhost", ["auth_events"], lambda *a: None, logger, retry_delay=0.01)
+    monkeypatch.setattr(messaging.pika, "BlockingConnection", lambda params: (_ for _ in ()).throw(OSError("refused")))
+    with pytest.raises(ConnectionError):
+        consumer.warm(timeout=0.1)
+    assert not consumer.connected
+
+    class Channel:
+        def queue_declare(self, **kwargs): return SimpleNamespace(method=SimpleNamespace(queue="amq.gen"))
+        def exchange_declare(self, **kwargs): pass
+        def queue_bind(self, **kwargs): pass
+        def basic_qos(self, **kwargs): pass
+        def basic_consume(self, **kwargs): pass
+        def start_consuming(self): threading.Event().wait()  # поток потребителя остаётся подписанным
+    monkeypatch.setattr(messaging.pika, "BlockingConnection", lambda params: SimpleNamespace(channel=Channel))
+    consumer.warm(timeout=2)
+    assert consumer.connected
+
+def test_publisher_drops_message_that_keeps_failing(monkeypatch):
+    import threading
+    from types import SimpleNamespace
+    from common import messaging
+    sent, attempts = [], []
+    class Channel:
+        def exchange_declare(self, exchange, exchange_type):
+            if exchange == "typed_events":
+                attempts.append(exchange)
+                raise RuntimeError("PRECONDITION_FAILED - inequivalent arg 'type'")
+        def basic_publish(self, exchange, routing_key, body, properties): sent.append(body)
+    connection = SimpleNamespace(channel=Channel, process_data_events=lambda time_limit: None)
+    monkeypatch.setattr(messaging.pika, "BlockingConnection", lambda params: connection)
+    publisher = messaging.Publisher("localhost", logger, retry_delay=0.01, max_attempts=3)
+    publisher.publish("typed_events", "Bad:{}")
+    publisher.publish("order_events", "Good:{}")
+    for _ in range(300):
+        if sent:
+            break
+        threading.Event().wait(0.01)
+    # Сообщение с ошибкой обменника отброшено после трёх попыток и не блокирует следующее
+    assert attempts == ["typed_events"] * 3 and sent == ["Good:{}"]
+
+def test_status_stream_subscribes_only_while_iterated(monkeypatch):
+    import asyncio
+    from fastapi import HTTPException
+    from common.pubsub import StatusBridge
+    bridge = StatusBridge("localhost", logger)
+    monkeypatch.setattr(bridge.consumer, "start", lambda: None)
+    before = bridge.broker.subscriber_count
+    # Ответы, которые так и не начали отдавать (клиент ушёл раньше), подписок не держат
+    for _ in range(5):
+        bridge.stream("order:1")
+    assert bridge.broker.subscriber_count == before
+
+    async def first_chunk():
+        events = bridge.stream("order:1").body_iterator
+        chunk = await events.__anext__()
+        subscribed = bridge.broker.subscriber_count
+        await events.aclose()
+        return chunk, subscribed
+    assert asyncio.run(first_chunk()) == (b"retry: 3000\n\n", before + 1)
+    assert bridge.broker.subscriber_count == before
+
+    monkeypatch.setattr(bridge.broker, "max_subscribers", before)
+    with pytest.raises(HTTPException):
+        bridge.stream("order:1")
+
+def test_server_timing_reports_each_phase_once():
+    from fastapi import FastAPI
+    from prometheus_client import REGISTRY
+    from common.middleware import LoggingMiddleware
+    from common.timing import phase
+    demo = FastAPI()
+    demo.add_middleware(LoggingMiddleware, service_name="demo", logger=logger, server_timing=True)
+    @demo.get("/items/{item_id}")
+    def item(item_id: int):
+        with phase("db"):
+            with phase("db"):
+                pass
+        return {"id": item_id}
+    header = TestClient(demo).get("/items/3").headers["Server-Timing"]
+    assert header.startswith("db;dur=") and "total;dur=" in header and header.count("db;") == 1
+    assert REGISTRY.get_sample_value("http_request_phase_seconds_count",
+                                     {"service": "demo", "route": "/items/{item_id}", "phase": "db"}) == 1
+
+def test_fast_json_route_keeps_fastapi_semantics():
+    import datetime
+    from fastapi import FastAPI
+    from pydantic import BaseModel
+    from common.responses import FastJSONResponse, FastJSONRoute
+    class Item(BaseModel):
+        id: int
+    demo = FastAPI(default_response_class=FastJSONResponse)
+    demo.router.route_class = FastJSONRoute
+    @demo.post("/items", status_code=201)
+    async def create(id: int):
+        return {"id": id, "at": datetime.datetime(2024, 1, 2, 3, 4, 5)}
+    @demo.get("/models")
+    def models():
+        return {"items": [Item(id=1)], 7: "int key"}
+    @demo.get("/typed", response_model=Item)
+    def typed():
+        return {"id": 2, "secret": "dropped"}
+    demo_client = TestClient(demo)
+    r = demo_client.post("/items", params={"id": 3})
+    assert r.status_code == 201 and r.json() == {"id": 3, "at": "2024-01-02T03:04:05"}
+    assert demo_client.post("/items", params={"id": "x"}).status_code == 422
+    # Нестандартные типы и response_model идут прежним путём FastAPI
+    assert demo_client.get("/models").json() == {"items": [{"id": 1}], "7": "int key"}
+    assert demo_client.get("/typed").json() == {"id": 2}
@@ -1,4 +1,5 @@
 import os
+import json
 import importlib
 import types
 import pytest
@@ -18,21 +19,52 @@ def reset_db():
     app_module.Base.metadata.create_all(bind=app_module.engine)
     yield
 
+PRICES = {1: 250.0, 2: 120.5, 3: 99.0}
+
+@pytest.fixture(autouse=True)
+def catalog_prices(monkeypatch):
+    calls = []
+    def fetch(ids):
+        calls.append(list(ids))
+        return {i: PRICES[i] for i in ids if i in PRICES}
+    monkeypatch.setattr(app_module, "fetch_prices", fetch)
+    monkeypatch.setattr(app_module, "price_cache", app_module.PriceCache())
+    monkeypatch.setattr(app_module.catalog_consumer, "start", lambda: None)
+    return calls
+
+@pytest.fixture
+def user_service(monkeypatch):
+    """Заглушка user-service: GET отдаёт адрес, аргументы вызовов копятся в списке."""
+    import requests
+    calls = []
+    class OK:
+        status_code = 200
+        def json(self): return {"address": "Mock Ave 1"}
+        def raise_for_status(self): pass
+    def get(self, url, **kw):
+        calls.append(kw)
+        return OK()
+    monkeypatch.setattr(requests.Session, "get", get)
+    return calls
+
 def test_create_order_success(monkeypatch):
     import requests
     class OK:
         status_code = 200
         def json(self): return {"address": "Mock Ave 1"}
         def raise_for_status(self): pass
-    monkeypatch.setattr(requests, "get", lambda url: OK())
+    monkeypatch.setattr(requests.Session, "get", lambda self, url, **kw: OK())
 
     called = {"msg": None}
     monkeypatch.setattr(app_module, "send_notification", lambda m: called.update(msg=m))
 
-    r = client.post("/create_order", params={"user_id": 7, "items": "sku1:2,sku2:1"})
+    r = client.post("/create_order", params={"user_id": 7},
+                    json={"items": [{"dish_id": 1, "qty": 2}, {"dish_id": 2, "qty": 1}]})
     assert r.status_code == 200
     data = r.json()["order"]
     assert data["user_id"] == 7
+    assert data["items"] == [{"dish_id": 1, "qty": 2, "price": 250.0}, {"dish_id": 2, "qty": 1, "price": 120.5}]
+    assert data["total"] == 620.5
     assert data["address"] == "Mock Ave 1"
     assert data["status"] == "created"
     assert "Order created for user 7" in called["msg"]
@@ -40,28 +72,432 @@ def test_create_order_success(monkeypatch):
 def test_create_order_user_not_found(monkeypatch):
     import requests
     class Err:
+        status_code = 404
         def raise_for_status(self): raise requests.HTTPError("404")
-    monkeypatch.setattr(requests, "get", lambda url: Err())
+    monkeypatch.setattr(requests.Session, "get", lambda self, url, **kw: Err())
 
-    r = client.post("/create_order", params={"user_id": 999, "items": "x"})
+    r = client.post("/create_order", params={"user_id": 999}, json={"items": [{"dish_id": 1, "qty": 1}]})
     assert r.status_code == 404
     assert r.json()["detail"] == "User not found or service unavailable"
 
 def test_get_and_update_flow(monkeypatch):
     import requests
     class OK:
+        status_code = 200
         def json(self): return {"address": "UL. Test, 1"}
         def raise_for_status(self): pass
-    monkeypatch.setattr(requests, "get", lambda url: OK())
+    monkeypatch.setattr(requests.Session, "get", lambda self, url, **kw: OK())
     monkeypatch.setattr(app_module, "send_notification", lambda m: None)
 
-    r = client.post("/create_order", params={"user_id": 1, "items": "A:1"})
+    r = client.post("/create_order", params={"user_id": 1}, json={"items": [{"dish_id": 1, "qty": 1}]})
     order_id = r.json()["order"]["id"]
 
     r2 = client.get("/orders/1")
     assert r2.status_code == 200
     assert any(o["id"] == order_id for o in r2.json()["orders"])
 
-    r3 = client.put(f"/update_order/{order_id}", params={"status": "shipped"})
+    r3 = client.put(f"/update_order/{order_id}", params={"status": "paid"})
     assert r3.status_code == 200
-    assert "updated to shipped" in r3.json()["message"]
+    assert "updated to paid" in r3.json()["message"]
+
+def test_update_order_pushes_status_event(monkeypatch, user_service):
+    import asyncio
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    monkeypatch.setattr(app_module.status_bridge.publisher, "publish", lambda *a, **k: True)
+
+    order_id = client.post("/create_order", params={"user_id": 3}, json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]["id"]
+
+    async def scenario():
+        sub = app_module.status_bridge.broker.subscribe(f"order:{order_id}")
+        try:
+            await asyncio.to_thread(client.put, f"/update_order/{order_id}", params={"status": "paid"})
+            return await sub.get(timeout=2.0)
+        finally:
+            app_module.status_bridge.broker.unsubscribe(sub)
+
+    event = json.loads(asyncio.run(scenario()))
+    assert event == {"type": "order", "order_id": order_id, "status": "paid"}
+    assert app_module.status_bridge.broker.subscriber_count == 0
+
+def test_lookup_orders_returns_only_existing(monkeypatch, user_service):
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    order = client.post("/create_order", params={"user_id": 4}, json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]
+
+    r = client.get("/orders/lookup", params={"ids": [order["id"], 9999]})
+    assert r.status_code == 200
+    assert r.json()["orders"] == [{"id": order["id"], "status": "created", "total": order["total"]}]
+
+def test_create_order_resolves_prices_in_one_catalog_call(monkeypatch, catalog_prices, user_service):
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    app_module.price_cache.apply_event("DishPriceChanged", {"id": 3, "price": 80.0})
+
+    items = [{"dish_id": 1, "qty": 1}, {"dish_id": 2, "qty": 2}, {"dish_id": 3, "qty": 1}, {"dish_id": 1, "qty": 1}]
+    r = client.post("/create_order", params={"user_id": 8}, json={"items": items})
+    assert r.status_code == 200
+    assert r.json()["order"]["total"] == 2 * 250.0 + 2 * 120.5 + 80.0
+    assert catalog_prices == [[1, 2]]
+
+    # Все цены уже в кэше — каталог больше не вызывается
+    client.post("/create_order", params={"user_id": 8}, json={"items": items})
+    assert catalog_prices == [[1, 2]]
+
+def test_create_order_with_unknown_dish(monkeypatch, user_service):
+    r = client.post("/create_order", params={"user_id": 8}, json={"items": [{"dish_id": 42, "qty": 1}]})
+    assert r.status_code == 422
+
+def test_history_read_model_follows_events(monkeypatch, user_service):
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    monkeypatch.setattr(app_module.status_bridge.publisher, "publish", lambda *a, **k: True)
+    order_id = client.post("/create_order", params={"user_id": 11},
+                           json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]["id"]
+
+    payment = f'PaymentCompleted:{{"order_id": {order_id}, "amount": 250.0, "payment_id": 77}}'.encode()
+    app_module.handle_history_event("payment_events", payment, None)
+    app_module.handle_history_event("payment_events", payment, None)  # повторная доставка
+    delivery = {"origin": "x", "topic": f"order:{order_id}", "message": {
+        "type": "delivery", "order_id": order_id, "delivery_id": 5, "courier_id": 9, "status": "in_transit"}}
+    app_module.handle_history_event("status_events", json.dumps(delivery).encode(), None)
+    client.put(f"/update_order/{order_id}", params={"status": "paid"})
+    client.put(f"/update_order/{order_id}", params={"status": "in_delivery"})
+
+    r = client.get("/history/11")
+    assert r.status_code == 200
+    record = r.json()["orders"][0]
+    assert record["order_id"] == order_id
+    assert record["status"] == "in_delivery"
+    assert record["payment"] == {"status": "completed", "payment_id": 77, "amount": 250.0}
+    assert record["delivery"] == {"status": "in_transit", "delivery_id": 5, "courier_id": 9}
+    assert [e["event"] for e in record["timeline"]] == [
+        "OrderCreated", "PaymentCompleted", "DeliveryStatusChanged", "OrderStatusChanged", "OrderStatusChanged"]
+    assert client.get(f"/history/order/{order_id}").json()["timeline"] == record["timeline"]
+
+def test_history_records_cancelled_payment():
+    import history
+    from types import SimpleNamespace
+    row = SimpleNamespace(payment_status=None, payment_id=None, amount=None, timeline=[], updated_at=None)
+    data = {"order_id": 1, "amount": 0.0, "payment_id": 12}
+    assert history.apply_payment(row, "PaymentCancelled", data)
+    assert not history.apply_payment(row, "PaymentCancelled", data)  # повторная доставка
+    assert (row.payment_status, row.payment_id, row.amount) == ("cancelled", 12, None)
+    assert [(e["event"], e["amount"]) for e in row.timeline] == [("PaymentCancelled", None)]
+
+def test_bearer_token_is_verified_locally(monkeypatch, user_service):
+    from common.auth import TokenSigner
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    verifier = app_module.authenticator.verifier
+    monkeypatch.setattr(verifier, "keys", {"test": b"test-secret"})
+    signer = TokenSigner(verifier.keys, "test")
+    own = {"Authorization": f"Bearer {signer.issue(21, 'alice')[0]}"}
+    other = {"Authorization": f"Bearer {signer.issue(22, 'bob')[0]}"}
+
+    r = client.post("/create_order", params={"user_id": 21}, json={"items": [{"dish_id": 1, "qty": 1}]}, headers=own)
+    assert r.status_code == 200
+    order_id = r.json()["order"]["id"]
+    assert client.get("/orders/21", headers=own).status_code == 200
+    assert client.get("/orders/21", headers=other).status_code == 403
+    assert client.get(f"/history/order/{order_id}", headers=other).status_code == 403
+    assert client.get("/orders/21", headers={"Authorization": "Bearer garbage"}).status_code == 401
+
+    claims = verifier.verify(own["Authorization"].split()[1])
+    app_module.authenticator._on_event("auth_events", f'TokenRevoked:{{"jti": "{claims["jti"]}", "exp": {claims["exp"]}}}'.encode(), None)
+    assert client.get("/orders/21", headers=own).status_code == 401
+    # Без заголовка доступ сохраняется, пока AUTH_REQUIRED не включён
+    assert client.get("/orders/21").status_code == 200
+
+def test_user_service_failures_open_circuit_and_fail_fast(monkeypatch):
+    import requests
+    from common.http_client import ServiceClient
+    from common.resilience import CircuitBreaker
+    client_ = ServiceClient("user-service-test", "http://users", app_module.logger,
+                            breaker=CircuitBreaker("user-service-test", min_calls=4, open_seconds=60))
+    monkeypatch.setattr(app_module, "user_client", client_)
+    calls = []
+    def slow(self, url, **kw):
+        calls.append(kw["timeout"])
+        raise requests.Timeout("read timed out")
+    monkeypatch.setattr(requests.Session, "get", slow)
+
+    for _ in range(4):
+        r = client.post("/create_order", params={"user_id": 1}, json={"items": [{"dish_id": 1, "qty": 1}]})
+        assert r.status_code == 503
+    assert client_.breaker.state == "open"
+    # Открытый breaker отвечает сразу, апстрим больше не вызывается
+    r = client.post("/create_order", params={"user_id": 1}, json={"items": [{"dish_id": 1, "qty": 1}]})
+    assert r.status_code == 503
+    assert "circuit_open" in r.json()["detail"]
+    assert len(calls) == 4 and all(t == client_.timeout.maximum for t in calls)
+
+def test_request_phases_are_timed_per_route(monkeypatch, user_service):
+    from prometheus_client import REGISTRY
+    from common.timing import phase
+    monkeypatch.setattr(app_module, "send_notification", phase("amqp_publish")(lambda m: None))
+    def count(name):
+        labels = {"service": "order-service", "route": "/create_order", "phase": name}
+        return REGISTRY.get_sample_value("http_request_phase_seconds_count", labels) or 0
+    before = {name: count(name) for name in ("db", "upstream_http", "amqp_publish", "serialization")}
+
+    r = client.post("/create_order", params={"user_id": 5}, json={"items": [{"dish_id": 1, "qty": 1}]})
+    assert r.status_code == 200
+    assert {name: count(name) - before[name] for name in before} == dict.fromkeys(before, 1)
+    # Вне запроса таймер ничего не пишет
+    with phase("db"):
+        pass
+
+
+def test_trace_context_propagates_to_upstream_logs_and_amqp(monkeypatch, user_service):
+    import logging
+    from common import tracing
+    from common.logging_config import JSONFormatter
+    seen = {}
+    monkeypatch.setattr(app_module, "send_notification", lambda m: seen.update(amqp=tracing.inject()))
+    spans = []
+    monkeypatch.setattr(tracing._Config, "exporter", types.SimpleNamespace(export=spans.append))
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(json.loads(JSONFormatter("order-service").format(record)))
+    app_module.logger.addHandler(handler)
+    try:
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        r = client.post("/create_order", params={"user_id": 3}, json={"items": [{"dish_id": 1, "qty": 1}]},
+                        headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"})
+    finally:
+        app_module.logger.removeHandler(handler)
+    assert r.status_code == 200
+    seen["traceparent"] = user_service[-1]["headers"]["traceparent"]
+    assert seen["traceparent"].split("-")[1] == trace_id
+    assert seen["amqp"]["traceparent"].split("-")[1] == trace_id
+    assert {rec.get("trace_id") for rec in records} == {trace_id}
+
+    server = next(s for s in spans if s["kind"] == "server")
+    upstream = next(s for s in spans if s["kind"] == "client")
+    assert server["name"] == "POST /create_order" and server["parent_id"] == "00f067aa0ba902b7"
+    assert upstream["parent_id"] == server["span_id"] and upstream["trace_id"] == trace_id
+    assert seen["traceparent"].split("-")[2] == upstream["span_id"]
+    # Некорректный заголовок начинает новую трассу
+    assert tracing.parse_traceparent("00-zz-00f067aa0ba902b7-01") is None
+
+def test_profiler_endpoint_samples_worker_threads(monkeypatch):
+    import threading, time
+    monkeypatch.delenv("PROFILER_TOKEN", raising=False)
+    assert client.get("/debug/profile", params={"seconds": 0.1}).status_code == 404
+    monkeypatch.setenv("PROFILER_TOKEN", "s3cret")
+    assert client.get("/debug/profile", params={"seconds": 0.1}, headers={"X-Admin-Token": "nope"}).status_code == 403
+
+    stop = threading.Event()
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+    worker = threading.Thread(target=busy_loop, name="busy-worker")
+    worker.start()
+    try:
+        r = client.get("/debug/profile", params={"seconds": 0.3, "interval_ms": 5}, headers={"X-Admin-Token": "s3cret"})
+    finally:
+        stop.set()
+        worker.join()
+    assert r.status_code == 200
+    lines = r.text.splitlines()
+    assert any(line.startswith("busy-worker;") and "busy_loop (unit/test_smoke.py:" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+def test_plain_json_endpoints_skip_jsonable_encoder(monkeypatch):
+    import fastapi.routing
+    calls = []
+    original = fastapi.routing.jsonable_encoder
+    monkeypatch.setattr(fastapi.routing, "jsonable_encoder", lambda obj, *a, **kw: calls.append(obj) or original(obj, *a, **kw))
+
+    db = app_module.SessionLocal()
+    db.add_all([app_module.Order(user_id=6, items=[{"dish_id": 1, "qty": 1, "price": 250.0}], total=250.0,
+                                 address="Fast St. 6", status="created") for _ in range(3)])
+    db.commit()
+    db.close()
+    r = client.get("/orders/6")
+    assert r.status_code == 200 and len(r.json()["orders"]) == 3
+    assert calls == []
+
+def test_orders_stream_in_chunks_with_own_session(monkeypatch):
+    from sqlalchemy import select
+    from common.streaming import json_array_chunks
+    monkeypatch.setenv("STREAM_CHUNK_SIZE", "2")
+    db = app_module.SessionLocal()
+    db.add_all([app_module.Order(user_id=8, items=[{"dish_id": i, "qty": 1, "price": 99.0}], total=99.0 * i,
+                                 address="Stream St. 8", status="created") for i in range(1, 6)])
+    db.commit()
+    db.close()
+
+    r = client.get("/orders/8", params={"stream": "true"})
+    assert r.status_code == 200 and r.headers["content-type"] == "application/json"
+    assert r.json() == client.get("/orders/8").json() and len(r.json()["orders"]) == 5
+    assert client.get("/orders/9", params={"stream": "true"}).json() == {"orders": []}
+
+    statement = select(app_module.Order.id, app_module.Order.items, app_module.Order.total,
+                       app_module.Order.status).where(app_module.Order.user_id == 8).order_by(app_module.Order.id)
+    chunks = json_array_chunks(app_module.SessionLocal, statement, app_module.order_summary, key="orders")
+    assert next(chunks) == b'{"orders":['
+    assert next(chunks).startswith(b'{"id":')
+    assert app_module.engine.pool.checkedout() == 1
+    # Клиент отключился посреди выгрузки: генератор закрывается и отдаёт соединение пулу
+    chunks.close()
+    assert app_module.engine.pool.checkedout() == 0
+
+def test_bulk_status_update_is_conditional_and_batched(monkeypatch, user_service):
+    from common.messaging import encode_event
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    published, order_events = [], []
+    monkeypatch.setattr(app_module.status_bridge.publisher, "publish", lambda exchange, body, **k: published.append(body))
+    ids = [client.post("/create_order", params={"user_id": 9}, json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]["id"]
+           for _ in range(3)]
+    monkeypatch.setattr(app_module.event_publisher, "publish", lambda exchange, body, **k: order_events.append(body))
+
+    r = client.put("/update_orders", json={"updates": [
+        {"order_id": ids[0], "status": "paid", "expected_status": "created"},
+        {"order_id": ids[1], "status": "delivered", "expected_status": "paid"},
+        {"order_id": ids[2], "status": "cancelled"},
+        {"order_id": 999999, "status": "paid"},
+    ]})
+    assert r.status_code == 200
+    assert r.json() == {"updated": 2, "results": [
+        {"order_id": ids[0], "outcome": "updated", "status": "paid"},
+        {"order_id": ids[1], "outcome": "conflict", "status": "created"},
+        {"order_id": ids[2], "outcome": "updated", "status": "cancelled"},
+        {"order_id": 999999, "outcome": "not_found"},
+    ]}
+    assert [o["status"] for o in sorted(client.get("/orders/9").json()["orders"], key=lambda o: o["id"])] == \
+        ["paid", "created", "cancelled"]
+    assert client.get(f"/history/order/{ids[0]}").json()["timeline"][-1]["status"] == "paid"
+    # Одно сообщение в status_events на весь пакет; другие реплики и проекция его разбирают
+    envelope = json.loads(published[-1])
+    assert len(published) == 1 and [e["message"]["order_id"] for e in envelope["events"]] == [ids[0], ids[2]]
+    app_module.handle_history_event("status_events", published[-1].encode(), None)
+    # И одно событие в order_events для проекции delivery-service
+    assert order_events == [encode_event("OrderStatusesChanged", {"orders": [
+        {"order_id": ids[0], "status": "paid"}, {"order_id": ids[2], "status": "cancelled"}]})]
+
+    assert client.put("/update_orders", json={"updates": [{"order_id": ids[0], "status": "paid"}] * 2}).status_code == 422
+
+def test_status_transitions_follow_lifecycle(monkeypatch, user_service):
+    from concurrent.futures import ThreadPoolExecutor
+    from prometheus_client import REGISTRY
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    monkeypatch.setattr(app_module.status_bridge.publisher, "publish", lambda *a, **k: True)
+    def create():
+        return client.post("/create_order", params={"user_id": 12},
+                           json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]["id"]
+    def count(to_status, result):
+        return REGISTRY.get_sample_value("order_status_transitions_total",
+                                         {"to_status": to_status, "result": result}) or 0.0
+
+    order_id = create()
+    rejected = count("delivered", "rejected")
+    assert client.put(f"/update_order/{order_id}", params={"status": "shipped"}).status_code == 422
+    r = client.put(f"/update_order/{order_id}", params={"status": "delivered"})
+    assert r.status_code == 409 and "from created to delivered" in r.json()["detail"]
+    assert count("delivered", "rejected") == rejected + 1
+    assert client.put(f"/update_order/{order_id}", params={"status": "paid"}).status_code == 200
+    # Повтор того же перехода идемпотентен и не добавляет событие в историю
+    unchanged = count("paid", "unchanged")
+    assert client.put(f"/update_order/{order_id}", params={"status": "paid"}).status_code == 200
+    assert count("paid", "unchanged") == unchanged + 1
+    assert [e["event"] for e in client.get(f"/history/order/{order_id}").json()["timeline"]] == \
+        ["OrderCreated", "OrderStatusChanged"]
+    assert client.put("/update_order/999999", params={"status": "paid"}).status_code == 404
+
+    # Гонка передачи в доставку и отмены оплаченного заказа: ровно один переход выигрывает
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        codes = list(pool.map(lambda s: client.put(f"/update_order/{order_id}", params={"status": s}).status_code,
+                              ["in_delivery", "cancelled"]))
+    assert sorted(codes) == [200, 409]
+    final = [o["status"] for o in client.get("/orders/12").json()["orders"] if o["id"] == order_id][0]
+    assert final == ("in_delivery" if codes[0] == 200 else "cancelled")
+
+def _saga_setup(monkeypatch):
+    from common.messaging import decode_event
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    monkeypatch.setattr(app_module.status_bridge.publisher, "publish", lambda *a, **k: True)
+    commands = []
+    monkeypatch.setattr(app_module.event_publisher, "publish",
+                        lambda exchange, body, **k: commands.append((exchange,) + decode_event(body.encode())))
+    return commands
+
+def _order_status(user_id, order_id):
+    return [o["status"] for o in client.get(f"/orders/{user_id}").json()["orders"] if o["id"] == order_id][0]
+
+def test_saga_drives_order_through_payment_and_delivery(monkeypatch, user_service):
+    from common.messaging import encode_event
+    commands = _saga_setup(monkeypatch)
+    order_id = client.post("/create_order", params={"user_id": 13}, json={
+        "items": [{"dish_id": 1, "qty": 2}], "pickup": {"lat": 55.75, "lon": 37.62}}).json()["order"]["id"]
+    assert commands == [("order_events", "OrderCreated", {"order_id": order_id, "user_id": 13, "amount": 500.0})]
+
+    paid = encode_event("PaymentCompleted", {"order_id": order_id, "amount": 500.0, "payment_id": 3}).encode()
+    app_module.handle_saga_event("payment_events", paid, None)
+    app_module.handle_saga_event("payment_events", paid, None)  # повторная доставка не повторяет шаг
+    assert _order_status(13, order_id) == "paid"
+    # Смена статуса тоже уходит в order_events (проекция заказов в delivery-service)
+    assert commands[1:] == [("order_events", "OrderStatusChanged", {"order_id": order_id, "status": "paid"}),
+                            ("order_events", "DeliveryRequested", {"order_id": order_id, "lat": 55.75, "lon": 37.62})]
+
+    # Курьера нет: компенсация отменяет заказ и просит вернуть деньги
+    failed = encode_event("DeliveryFailed", {"order_id": order_id, "reason": "no courier available"}).encode()
+    app_module.handle_saga_event("delivery_events", failed, None)
+    assert _order_status(13, order_id) == "cancelled"
+    assert commands[-1] == ("order_events", "OrderCancelled", {"order_id": order_id, "reason": "no courier available"})
+    refunded = encode_event("PaymentRefunded", {"order_id": order_id, "amount": 500.0, "payment_id": 3}).encode()
+    app_module.handle_saga_event("payment_events", refunded, None)
+    db = app_module.SessionLocal()
+    try:
+        row = db.get(app_module.Saga, order_id)
+        assert (row.state, row.payment_id, row.deadline) == ("compensated", 3, None)
+    finally:
+        db.close()
+    # Платёжные события проецирует history_consumer; сага добавляет в историю только смену статуса
+    assert [e.get("status") for e in client.get(f"/history/order/{order_id}").json()["timeline"]] == [
+        "created", "paid", "cancelled"]
+
+    # Без точки забора сага завершается после оплаты, а назначение вручную переводит заказ в доставку
+    order_id = client.post("/create_order", params={"user_id": 13},
+                           json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]["id"]
+    app_module.handle_saga_event("payment_events", encode_event("PaymentCompleted", {
+        "order_id": order_id, "amount": 250.0, "payment_id": 4}).encode(), None)
+    assert [c[1] for c in commands[-2:]] == ["OrderCreated", "OrderStatusChanged"]
+    app_module.handle_saga_event("delivery_events", encode_event("DeliveryAssigned", {
+        "order_id": order_id, "delivery_id": 8, "courier_id": 2}).encode(), None)
+    assert _order_status(13, order_id) == "in_delivery"
+
+def test_saga_recovery_resends_stuck_steps_then_compensates(monkeypatch, user_service):
+    commands = _saga_setup(monkeypatch)
+    monkeypatch.setattr(app_module, "SAGA_MAX_ATTEMPTS", 2)
+    order_id = client.post("/create_order", params={"user_id": 14},
+                           json={"items": [{"dish_id": 2, "qty": 1}]}).json()["order"]["id"]
+    commands.clear()
+    assert app_module.recover_sagas(now=0) == 0  # deadline ещё не наступил
+
+    later = app_module.time.time() + 10 ** 6
+    assert app_module.recover_sagas(now=later) == 1
+    assert app_module.recover_sagas(now=later) == 0  # следующий повтор — с задержкой
+    assert app_module.recover_sagas(now=later * 2) == 1
+    assert [c[1] for c in commands] == ["OrderCreated", "OrderCreated"]
+    assert _order_status(14, order_id) == "created"
+
+    # Повторы исчерпаны: заказ отменяется, платёж (если успел пройти) возвращается
+    assert app_module.recover_sagas(now=later * 3) == 1
+    assert commands[-1] == ("order_events", "OrderCancelled", {"order_id": order_id, "reason": "payment_pending timed out"})
+    assert _order_status(14, order_id) == "cancelled"
+
+def test_history_append_rereads_row_before_writing(monkeypatch, user_service):
+    monkeypatch.setattr(app_module, "send_notification", lambda m: None)
+    order_id = client.post("/create_order", params={"user_id": 12},
+                           json={"items": [{"dish_id": 1, "qty": 1}]}).json()["order"]["id"]
+
+    slow = app_module.SessionLocal()
+    stale = app_module.load_history(slow, order_id)  # строка уже в identity map этой сессии
+    assert len(stale.timeline) == 1
+    # Тем временем событие оплаты дописало хронологию в другой транзакции
+    payment = f'PaymentCompleted:{{"order_id": {order_id}, "amount": 1.0, "payment_id": 5}}'.encode()
+    app_module.handle_history_event("payment_events", payment, None)
+    try:
+        assert app_module.transition_order(slow, order_id, "paid") == (True, "paid")
+        slow.commit()
+    finally:
+        slow.close()
+    events = [e["event"] for e in client.get(f"/history/order/{order_id}").json()["timeline"]]
+    assert events == ["OrderCreated", "PaymentCompleted", "OrderStatusChanged"]
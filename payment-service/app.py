@@ -1,43 +1,65 @@
 from fastapi import FastAPI, Depends, HTTPException
 from sqlalchemy import create_engine, Column, Integer, String, Float
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 import os
-import sys
-import pika
-from pika.credentials import PlainCredentials
-
-# Добавляем путь к common модулю
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from typing import Optional
 
 from common.logging_config import setup_logging
+from common.messaging import Consumer, Publisher, decode_event, encode_event
 from common.middleware import LoggingMiddleware, setup_metrics_endpoint
-
-app = FastAPI(title="Payment Service")
+from common.compression import CompressionMiddleware
+from common.profiler import setup_profiler_endpoint
+from common.lifecycle import Lifecycle, ping_database
+from common.timing import instrument_engine
+from common.responses import FastJSONResponse, FastJSONRoute
+from common.http_client import ServiceClient
+from common.resilience import UpstreamUnavailable
 
 # Настройка логирования
 logger = setup_logging("payment-service")
 
+# Схема БД и прогрев соединений — в lifespan, а не при импорте
+lifecycle = Lifecycle("payment-service", logger)
+
+app = FastAPI(title="Payment Service", default_response_class=FastJSONResponse, lifespan=lifecycle.lifespan)
+app.router.route_class = FastJSONRoute
+
 # Добавляем middleware для логирования и метрик
+# Сжатие внутри LoggingMiddleware: его время входит в фазы запроса
+app.add_middleware(CompressionMiddleware, service_name="payment-service")
 app.add_middleware(LoggingMiddleware, service_name="payment-service", logger=logger)
 setup_metrics_endpoint(app, "payment-service")
+setup_profiler_endpoint(app, "payment-service")
+lifecycle.setup_health_endpoints(app)
 
 logger.info("Payment Service started")
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order-service:8001")
+
+# Одно постоянное соединение с брокером вместо нового на каждое событие
+event_publisher = Publisher(RABBITMQ_HOST, logger)
+# Сумма заказа для ручного /pay, если OrderCreated ещё не пришёл
+order_client = ServiceClient.from_env("order-service", ORDER_SERVICE_URL, logger, "ORDER_SERVICE")
 
 engine = create_engine(DATABASE_URL)
+instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
 class Payment(Base):
     __tablename__ = "payments"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer)
+    # Не больше одного платежа на заказ: повтор команды и /pay не спишут дважды
+    order_id = Column(Integer, unique=True)
     amount = Column(Float)
     status = Column(String, default="pending")
 
-Base.metadata.create_all(bind=engine)
+lifecycle.schema(Base.metadata, engine)
+lifecycle.warmup("database", lambda: ping_database(engine))
+lifecycle.warmup("amqp_publisher", event_publisher.warm)
 
 def get_db():
     db = SessionLocal()
@@ -47,21 +69,99 @@ def get_db():
         db.close()
 
 def publish_event(event: str, data: dict):
-    credentials = PlainCredentials('guest', 'guest123')
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials))
-    channel = connection.channel()
-    channel.exchange_declare(exchange='payment_events', exchange_type='fanout')
-    channel.basic_publish(exchange='payment_events', routing_key='', body=f"{event}:{data}")
-    connection.close()
+    event_publisher.publish('payment_events', encode_event(event, data))
+
+def charge_order(db: Session, order_id: int, amount: float) -> Optional[Payment]:
+    # Шаг саги по OrderCreated; повтор команды не списывает деньги второй раз
+    payment = db.query(Payment).filter(Payment.order_id == order_id).first()
+    if payment is None:
+        if amount is None or amount <= 0:
+            logger.warning(f"Payment for order {order_id} declined: invalid amount {amount}")
+            publish_event("PaymentFailed", {"order_id": order_id, "amount": amount, "reason": "invalid amount"})
+            return None
+        payment = Payment(order_id=order_id, amount=amount, status="completed")
+        db.add(payment)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Платёж по заказу уже создала параллельная команда или отмена
+            db.rollback()
+            payment = db.query(Payment).filter(Payment.order_id == order_id).first()
+        else:
+            logger.info(f"Payment completed for order {order_id}: {payment.id}")
+    if payment.status == "completed":
+        publish_event("PaymentCompleted", {"order_id": order_id, "amount": payment.amount, "payment_id": payment.id})
+    return payment
+
+def cancel_order_payment(db: Session, order_id: int):
+    # Компенсация по OrderCancelled: возврат проведённого платежа, иначе запрет будущего списания
+    payment = db.query(Payment).filter(Payment.order_id == order_id).first()
+    if payment is None:
+        payment = Payment(order_id=order_id, amount=0.0, status="cancelled")
+        db.add(payment)
+    elif payment.status == "completed":
+        payment.status = "refunded"
+    try:
+        db.commit()
+    except IntegrityError:
+        # Списание успело раньше — повторяем уже как возврат
+        db.rollback()
+        return cancel_order_payment(db, order_id)
+    event = "PaymentRefunded" if payment.status == "refunded" else "PaymentCancelled"
+    publish_event(event, {"order_id": order_id, "amount": payment.amount, "payment_id": payment.id})
+    logger.info(f"Payment for order {order_id} {payment.status}")
+
+def handle_order_event(exchange: str, body: bytes, properties):
+    event, data = decode_event(body)
+    if event not in ("OrderCreated", "OrderCancelled"):
+        return
+    db = SessionLocal()
+    try:
+        if event == "OrderCreated":
+            charge_order(db, data["order_id"], data.get("amount"))
+        else:
+            cancel_order_payment(db, data["order_id"])
+    finally:
+        db.close()
+
+# Общая durable-очередь: каждую команду саги выполняет ровно одна реплика
+order_consumer = Consumer(RABBITMQ_HOST, ['order_events'], handle_order_event, logger, queue_name='payment-orders')
+lifecycle.warmup("amqp_consumers", order_consumer.warm)
+
+def fetch_order_total(order_id: int) -> Optional[float]:
+    resp = order_client.get("/orders/lookup", params={"ids": [order_id]})
+    resp.raise_for_status()
+    orders = resp.json()["orders"]
+    return orders[0]["total"] if orders else None
 
 @app.post("/pay/{order_id}")
-def pay_order(order_id: int, amount: float, db: Session = Depends(get_db)):
-    logger.info(f"Processing payment for order: {order_id}, amount: {amount}")
-    payment = Payment(order_id=order_id, amount=amount, status="completed")
-    db.add(payment)
-    db.commit()
-    publish_event("PaymentCompleted", {"order_id": order_id, "amount": amount})
-    logger.info(f"Payment completed successfully: {payment.id}")
+def pay_order(order_id: int, amount: Optional[float] = None, db: Session = Depends(get_db)):
+    logger.info(f"Processing payment for order: {order_id}")
+    payment = db.query(Payment).filter(Payment.order_id == order_id).first()
+    if payment is not None and payment.status != "completed":
+        logger.warning(f"Payment for order {order_id} rejected: payment {payment.status}")
+        raise HTTPException(status_code=409, detail=f"Payment {payment.status}")
+    # Списывается сумма заказа (из OrderCreated или order-service), а не присланная клиентом;
+    # amount — только сверка с ней
+    if payment is not None:
+        total = payment.amount
+    else:
+        try:
+            total = fetch_order_total(order_id)
+        except UpstreamUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        if total is None:
+            logger.warning(f"Payment for unknown order: {order_id}")
+            raise HTTPException(status_code=404, detail="Order not found")
+    if amount is not None and round(amount, 2) != round(total, 2):
+        logger.warning(f"Payment for order {order_id} rejected: amount {amount} != order total {total}")
+        raise HTTPException(status_code=409, detail="Amount does not match order total")
+    # Тот же идемпотентный путь, что и у команды саги
+    payment = charge_order(db, order_id, total)
+    if payment is None:
+        raise HTTPException(status_code=400, detail="Invalid amount")
+    if payment.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Payment {payment.status}")
     return {"status": "paid", "payment_id": payment.id}
 
 @app.get("/payments/order/{order_id}")
@@ -60,10 +60,16 @@ def clean_db(_init_app):
     yield
 
 
+# Суммы заказов, которые вернул бы order-service: /pay списывает их, а не присланный amount
+ORDER_TOTALS = {100: 99.99, 201: 50.00, 202: 75.50, 203: 120.00}
+
+
 @pytest.fixture(autouse=True)
 def mock_external_services(monkeypatch):
     if hasattr(app_module, "publish_event"):
         monkeypatch.setattr(app_module, "publish_event", lambda event, data: None)
+    if hasattr(app_module, "fetch_order_total"):
+        monkeypatch.setattr(app_module, "fetch_order_total", ORDER_TOTALS.get)
 
 
 def test_create_payment_and_get_by_order_id_component(_init_app):
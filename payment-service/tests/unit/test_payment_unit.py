@@ -1,18 +1,22 @@
 # tests/unit/test_smoke.py
-import os, sys, importlib
+import os, sys, importlib, importlib.util
 from typing import Optional, Tuple
 import pytest
 from fastapi.testclient import TestClient
 
 # Ищем app.py из корня сервиса
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, SERVICE_DIR)
 
 # Локальная БД для юнитов (не трогаем реальную)
 os.environ.setdefault("DATABASE_URL", "sqlite:///./test_unit.db")
 
 # Импортируем приложение
 try:
-    app_module = importlib.import_module("app")
+    # По пути к файлу: с pythonpath из pytest.ini имя "app" занято order-service
+    spec = importlib.util.spec_from_file_location("payment_service_app", os.path.join(SERVICE_DIR, "app.py"))
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
     app = getattr(app_module, "app", None)
     if app is None:
         raise RuntimeError("В модуле app отсутствует FastAPI-приложение с именем 'app'")
@@ -218,3 +222,65 @@ def test_create_fetch_and_refund(monkeypatch):
         )
         r = client.post(path_ref, json={"reason": "requested_by_customer"})
         assert r.status_code in (200, 201, 204), f"POST {path_ref} -> {r.status_code}"
+
+def test_saga_commands_charge_once_and_refund(monkeypatch):
+    from common.messaging import encode_event
+    published = []
+    monkeypatch.setattr(app_module, "publish_event", lambda event, data: published.append((event, data)))
+    created = encode_event("OrderCreated", {"order_id": 40, "user_id": 1, "amount": 99.5}).encode()
+    app_module.handle_order_event("order_events", created, None)
+    app_module.handle_order_event("order_events", created, None)  # повтор команды по таймауту саги
+    assert [e for e, _ in published] == ["PaymentCompleted", "PaymentCompleted"]
+    assert published[0][1] == published[1][1]
+    assert client.get("/payments/order/40").json()["status"] == "completed"
+
+    app_module.handle_order_event("order_events", encode_event("OrderCancelled", {"order_id": 40}).encode(), None)
+    assert published[-1] == ("PaymentRefunded", {"order_id": 40, "amount": 99.5, "payment_id": published[0][1]["payment_id"]})
+    assert client.get("/payments/order/40").json()["status"] == "refunded"
+
+    # Отмена до оплаты: списания не будет и после запоздавшей команды
+    app_module.handle_order_event("order_events", encode_event("OrderCancelled", {"order_id": 41}).encode(), None)
+    app_module.handle_order_event("order_events", encode_event("OrderCreated", {"order_id": 41, "amount": 10.0}).encode(), None)
+    assert [e for e, _ in published[-1:]] == ["PaymentCancelled"]
+    app_module.handle_order_event("order_events", encode_event("OrderCreated", {"order_id": 42, "amount": 0}).encode(), None)
+    assert published[-1][0] == "PaymentFailed"
+
+def test_pay_charges_order_total_idempotently_and_respects_cancellation(monkeypatch):
+    published = []
+    monkeypatch.setattr(app_module, "publish_event", lambda event, data: published.append((event, data)))
+    monkeypatch.setattr(app_module, "fetch_order_total", {50: 20.0, 51: 0.0, 52: 20.0}.get)
+    first = client.post("/pay/50")
+    again = client.post("/pay/50", params={"amount": 20.0})
+    assert first.status_code == again.status_code == 200
+    assert first.json()["payment_id"] == again.json()["payment_id"]
+    assert client.get("/payments/order/50").json()["amount"] == 20.0
+    # Сумму задаёт заказ, а не клиент
+    r = client.post("/pay/50", params={"amount": 1.0})
+    assert r.status_code == 409 and r.json()["detail"] == "Amount does not match order total"
+    assert client.post("/pay/51").status_code == 400
+    assert client.post("/pay/53", params={"amount": 5.0}).status_code == 404
+
+    app_module.cancel_order_payment(app_module.SessionLocal(), 52)
+    r = client.post("/pay/52", params={"amount": 20.0})
+    assert r.status_code == 409 and r.json()["detail"] == "Payment cancelled"
+    assert client.get("/payments/order/52").json()["status"] == "cancelled"
+
+def test_charge_race_reuses_existing_payment(monkeypatch):
+    published = []
+    monkeypatch.setattr(app_module, "publish_event", lambda event, data: published.append((event, data)))
+    db = app_module.SessionLocal()
+    app_module.cancel_order_payment(app_module.SessionLocal(), 53)
+
+    # Проверка не видит платёж — его создала отмена в другой реплике
+    class _Miss:
+        def filter(self, *a): return self
+        def first(self): return None
+    real_query = db.query
+    calls = []
+    def query(*a):
+        calls.append(a)
+        return _Miss() if len(calls) == 1 else real_query(*a)
+    monkeypatch.setattr(db, "query", query)
+    payment = app_module.charge_order(db, 53, 10.0)
+    assert payment.status == "cancelled"
+    assert [e for e, _ in published] == ["PaymentCancelled"]
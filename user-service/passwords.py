@@ -0,0 +1,104 @@
+"""
+Хеширование паролей (scrypt) в отдельном ограниченном пуле.
+
+Формат хеша: scrypt$<n>$<r>$<p>$<salt>$<hash> (base64). Параметры хранятся
+в самом хеше, поэтому после смены стоимости старые хеши продолжают
+проверяться и перехешируются при следующем входе.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, NamedTuple
+
+from prometheus_client import Counter, Gauge
+
+password_hash_inflight = Gauge(
+    'password_hash_inflight',
+    'Password hashing jobs queued or running'
+)
+
+password_hash_rejected_total = Counter(
+    'password_hash_rejected_total',
+    'Password hashing jobs rejected by admission control'
+)
+
+
+class ScryptParams(NamedTuple):
+    n: int = 2 ** 14
+    r: int = 8
+    p: int = 1
+
+
+def _derive(password: str, salt: bytes, params: ScryptParams) -> bytes:
+    # maxmem с запасом: scrypt требует ~128 * n * r байт
+    return hashlib.scrypt(password.encode(), salt=salt, n=params.n, r=params.r, p=params.p,
+                          maxmem=256 * params.n * params.r + 1024 * 1024, dklen=32)
+
+
+def hash_password(password: str, params: ScryptParams) -> str:
+    salt = os.urandom(16)
+    digest = _derive(password, salt, params)
+    return "$".join([
+        "scrypt", str(params.n), str(params.r), str(params.p),
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode(),
+    ])
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    if not encoded.startswith("scrypt$"):
+        # Пароль сохранён до появления хеширования
+        return hmac.compare_digest(password.encode(), encoded.encode())
+    _, n, r, p, salt, digest = encoded.split("$")
+    expected = _derive(password, base64.b64decode(salt), ScryptParams(int(n), int(r), int(p)))
+    return hmac.compare_digest(expected, base64.b64decode(digest))
+
+
+def needs_rehash(encoded: str, params: ScryptParams) -> bool:
+    if not encoded.startswith("scrypt$"):
+        return True
+    _, n, r, p, _, _ = encoded.split("$")
+    return ScryptParams(int(n), int(r), int(p)) != params
+
+
+class Overloaded(Exception):
+    pass
+
+
+class HashingPool:
+    """
+    Пул для CPU-ёмкого хеширования с собственным контролем допуска.
+
+    Одновременно принимается не больше workers + queue_depth задач; остальные
+    сразу получают Overloaded. Корутина ждёт результат, не занимая поток
+    общего threadpool, поэтому всплеск входов не вытесняет чтение профилей.
+    hashlib.scrypt отпускает GIL, так что потоков достаточно; kind="process"
+    изолирует хеширование полностью.
+    """
+
+    def __init__(self, workers: int, queue_depth: int, kind: str = "thread"):
+        self._executor: Executor = (
+            ProcessPoolExecutor(max_workers=workers) if kind == "process"
+            else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def _done(self, _future):
+        self._slots.release()
+        password_hash_inflight.dec()
+
+    async def run(self, fn: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            password_hash_rejected_total.inc()
+            raise Overloaded()
+        password_hash_inflight.inc()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
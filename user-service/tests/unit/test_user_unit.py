@@ -1,17 +1,21 @@
 # tests/unit/test_smoke.py
-import os, sys, importlib, uuid
+import os, sys, importlib, importlib.util, uuid
 from typing import Optional, Tuple
 import pytest
 from fastapi.testclient import TestClient
 
 # PYTHONPATH -> корень сервиса
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, SERVICE_DIR)
 # Локальная БД для юнитов
 os.environ.setdefault("DATABASE_URL", "sqlite:///./test_unit.db")
 
 # Импортируем приложение
 try:
-    app_module = importlib.import_module("app")
+    # По пути к файлу: с pythonpath из pytest.ini имя "app" занято order-service
+    spec = importlib.util.spec_from_file_location("user_service_app", os.path.join(SERVICE_DIR, "app.py"))
+    app_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app_module)
     app = getattr(app_module, "app", None)
     if app is None:
         raise RuntimeError("В модуле app нет FastAPI-приложения 'app'")
@@ -75,7 +79,9 @@ def _discover_user_paths(openapi: dict):
         if any(k in lower for k in ("user", "users")) and "get" in methods and "{" in p and res["get_by_id"] is None:
             res["get_by_id"] = p
         # профиль текущего пользователя
-        if any(k in lower for k in ("me", "profile")) and "get" in methods and res["me"] is None:
+        # по сегментам пути: подстрока "me" есть и в /metrics
+        segments = lower.strip("/").split("/")
+        if any(k in segments for k in ("me", "profile")) and "get" in methods and res["me"] is None:
             res["me"] = p
         # логин/токен
         if "post" in methods and any(k in lower for k in ("login", "/token")) and res["login"] is None:
@@ -111,6 +117,8 @@ def _auth_headers_if_possible(login_path: Optional[str], token_path: Optional[st
             {"login": username, "password": password},
         ):
             r = client.post(login_path, json=body)
+            if r.status_code == 422:
+                r = client.post(login_path, params=body)
             if r.status_code in (200, 201):
                 try:
                     data = r.json()
@@ -165,6 +173,10 @@ def test_register_login_me_and_get_by_id_flow():
             {"username": username, "password": password},
         ):
             r = client.post(paths["create"], json=body)
+            if r.status_code == 422:
+                # /register принимает поля в query-параметрах
+                r = client.post(paths["create"], params={"username": username, "password": password,
+                                                         "address": "Test st. 1"})
             if r.status_code in (200, 201):
                 try:
                     created = r.json()
@@ -184,7 +196,7 @@ def test_register_login_me_and_get_by_id_flow():
                 break
 
     # авторизуемся, если есть login/token
-    headers = _auth_headers_if_possible(paths["login"], paths["token"], email, password)
+    headers = _auth_headers_if_possible(paths["login"], paths["token"], username, password)
 
     # /me или /profile
     if paths["me"] and headers:
@@ -206,3 +218,80 @@ def test_register_login_me_and_get_by_id_flow():
         if r.status_code == 405:
             r = client.request("PUT", path_upd, json={"full_name": "Updated Name"}, headers=headers or None)
         assert r.status_code in (200, 204), f"{path_upd} -> {r.status_code}"
+
+def test_register_stores_hash_and_login_rehashes(monkeypatch):
+    from passwords import ScryptParams
+    monkeypatch.setattr(app_module, "HASH_PARAMS", ScryptParams(n=2 ** 10, r=8, p=1))
+    r = client.post("/register", params={"username": "hasher", "password": "secret123", "address": "A 1"})
+    assert r.status_code == 200
+
+    db = app_module.SessionLocal()
+    try:
+        stored = db.query(app_module.User).filter_by(username="hasher").first().password
+    finally:
+        db.close()
+    assert stored.startswith("scrypt$1024$")
+    assert "secret123" not in stored
+
+    assert client.post("/login", params={"username": "hasher", "password": "wrong!!"}).status_code == 400
+    assert client.post("/login", params={"username": "nobody", "password": "secret123"}).status_code == 400
+
+    # Стоимость увеличили — хеш обновляется при успешном входе
+    monkeypatch.setattr(app_module, "HASH_PARAMS", ScryptParams(n=2 ** 11, r=8, p=1))
+    assert client.post("/login", params={"username": "hasher", "password": "secret123"}).status_code == 200
+    db = app_module.SessionLocal()
+    try:
+        assert db.query(app_module.User).filter_by(username="hasher").first().password.startswith("scrypt$2048$")
+    finally:
+        db.close()
+
+def test_login_rejected_when_hash_pool_saturated(monkeypatch):
+    from passwords import HashingPool
+    pool = HashingPool(workers=1, queue_depth=0)
+    pool._slots.acquire()
+    monkeypatch.setattr(app_module, "password_pool", pool)
+    r = client.post("/login", params={"username": "any", "password": "secret123"})
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+def test_login_issues_token_and_logout_revokes_it(monkeypatch):
+    published = []
+    monkeypatch.setattr(app_module.event_publisher, "publish", lambda exchange, body, **kw: published.append((exchange, body)))
+    client.post("/register", params={"username": "tokened", "password": "secret123", "address": "A 1"})
+    r = client.post("/login", params={"username": "tokened", "password": "secret123"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["token_type"] == "bearer" and body["expires_in"] > 0
+    claims = app_module.authenticator.verifier.verify(body["access_token"])
+    assert claims["username"] == "tokened"
+
+    headers = {"Authorization": f"Bearer {body['access_token']}"}
+    assert client.post("/logout", headers=headers).status_code == 200
+    assert published and published[0][0] == "auth_events"
+    assert published[0][1].startswith("TokenRevoked:")
+    # Отозванный токен больше не принимается, даже из кэша
+    assert client.post("/logout", headers=headers).status_code == 401
+    assert client.post("/logout").status_code == 401
+
+def test_token_verifier_accepts_rotated_keys_and_rejects_tampering():
+    from common.auth import TokenError, TokenSigner, TokenVerifier
+    keys = {"old": b"old-secret", "new": b"new-secret"}
+    verifier = TokenVerifier(keys)
+    old_token, _ = TokenSigner(keys, "old").issue(1, "a")
+    new_token, _ = TokenSigner(keys, "new").issue(1, "a")
+    assert verifier.verify(old_token)["kid"] == "old"
+    assert verifier.verify(new_token)["kid"] == "new"
+
+    payload, signature = new_token.split(".")
+    with pytest.raises(TokenError):
+        verifier.verify(payload + "." + signature[::-1])
+    with pytest.raises(TokenError):
+        TokenVerifier({"new": b"new-secret"}).verify(old_token)
+    expired, _ = TokenSigner(keys, "new", ttl=-1).issue(1, "a")
+    with pytest.raises(TokenError):
+        verifier.verify(expired)
+    # Подписанный, но не объект JSON — 401, а не 500
+    from common.auth import _b64encode, _sign
+    listed = _b64encode(b'["new"]')
+    with pytest.raises(TokenError):
+        verifier.verify(listed + "." + _sign(b"new-secret", listed))